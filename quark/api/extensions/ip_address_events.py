@@ -0,0 +1,86 @@
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from neutron.api import extensions
+from neutron.common import exceptions
+from neutron import manager
+from neutron.openstack.common import log as logging
+from neutron import wsgi
+
+RESOURCE_NAME = "ip_address_event"
+RESOURCE_COLLECTION = RESOURCE_NAME + "s"
+
+LOG = logging.getLogger(__name__)
+
+
+class IpAddressEventsController(wsgi.Controller):
+
+    def __init__(self, plugin):
+        self._resource_name = RESOURCE_NAME
+        self._plugin = plugin
+
+    def index(self, request):
+        network_id = request.GET.get("network_id")
+        ip_address = request.GET.get("ip_address")
+        if not (network_id and ip_address):
+            raise exceptions.BadRequest(
+                resource=RESOURCE_COLLECTION,
+                msg="network_id and ip_address are required")
+        events = self._plugin.get_ip_address_events(
+            request.context, network_id, ip_address,
+            start=request.GET.get("start"), end=request.GET.get("end"))
+        return {RESOURCE_COLLECTION: events}
+
+
+class Ip_address_events(object):
+    """IP address ownership history.
+
+    GET /ip_address_events?network_id=<id>&ip_address=<address>
+    [&start=<iso8601>&end=...] returns the allocations and deallocations
+    of an address of the network in the range, preceded by the last one
+    before it, i.e. who held it at start.
+    """
+    @classmethod
+    def get_name(cls):
+        return "IP address events"
+
+    @classmethod
+    def get_alias(cls):
+        return RESOURCE_COLLECTION
+
+    @classmethod
+    def get_description(cls):
+        return "Expose the allocation history of IP addresses"
+
+    @classmethod
+    def get_namespace(cls):
+        return ("http://docs.openstack.org/network/ext/"
+                "ip_address_events/api/v2.0")
+
+    @classmethod
+    def get_updated(cls):
+        return "2013-10-01T10:00:00-00:00"
+
+    def get_extended_resources(self, version):
+        return {}
+
+    @classmethod
+    def get_resources(cls):
+        """Returns Ext Resources."""
+        controller = IpAddressEventsController(
+            manager.NeutronManager.get_plugin())
+        return [extensions.ResourceExtension(
+            Ip_address_events.get_alias(),
+            controller)]
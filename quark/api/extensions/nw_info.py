@@ -0,0 +1,80 @@
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import webob
+
+from neutron.api import extensions
+from neutron import manager
+from neutron.openstack.common import log as logging
+from neutron import wsgi
+
+RESOURCE_NAME = "nw_info"
+RESOURCE_COLLECTION = RESOURCE_NAME
+
+LOG = logging.getLogger(__name__)
+
+
+class NwInfoController(wsgi.Controller):
+
+    def __init__(self, plugin):
+        self._resource_name = RESOURCE_NAME
+        self._plugin = plugin
+
+    def index(self, request):
+        device_ids = request.GET.getall("device_id")
+        if not device_ids:
+            raise webob.exc.HTTPBadRequest(
+                explanation="At least one device_id is required")
+        return {"nw_info": self._plugin.get_ports_nw_info(request.context,
+                                                          device_ids)}
+
+
+class Nw_info(object):
+    """Network info of whole devices in one call.
+
+    GET /nw_info?device_id=<id>[&device_id=<id>...] returns every port of
+    the devices with fixed IPs, subnets, routes, gateway and DNS.
+    """
+    @classmethod
+    def get_name(cls):
+        return "Device network info"
+
+    @classmethod
+    def get_alias(cls):
+        return RESOURCE_COLLECTION
+
+    @classmethod
+    def get_description(cls):
+        return "Expose the complete network info of devices in one call"
+
+    @classmethod
+    def get_namespace(cls):
+        return ("http://docs.openstack.org/network/ext/"
+                "nw_info/api/v2.0")
+
+    @classmethod
+    def get_updated(cls):
+        return "2013-10-01T10:00:00-00:00"
+
+    def get_extended_resources(self, version):
+        return {}
+
+    @classmethod
+    def get_resources(cls):
+        """Returns Ext Resources."""
+        controller = NwInfoController(manager.NeutronManager.get_plugin())
+        return [extensions.ResourceExtension(
+            Nw_info.get_alias(),
+            controller)]
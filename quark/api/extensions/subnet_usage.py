@@ -0,0 +1,82 @@
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from neutron.api import extensions
+from neutron import manager
+from neutron.openstack.common import log as logging
+from neutron import wsgi
+
+RESOURCE_NAME = "subnet_usage"
+RESOURCE_COLLECTION = RESOURCE_NAME
+
+LOG = logging.getLogger(__name__)
+
+
+class SubnetUsageController(wsgi.Controller):
+
+    def __init__(self, plugin):
+        self._resource_name = RESOURCE_NAME
+        self._plugin = plugin
+
+    def index(self, request):
+        filters = {}
+        subnet_ids = request.GET.getall("subnet_id")
+        if subnet_ids:
+            filters["id"] = subnet_ids
+        network_ids = request.GET.getall("network_id")
+        if network_ids:
+            filters["network_id"] = network_ids
+        return self._plugin.get_subnets_usage(request.context, filters)
+
+
+class Subnet_usage(object):
+    """Subnet and network utilization.
+
+    GET /subnet_usage[?subnet_id=<id>&network_id=<id>...] returns the
+    allocated, reusable, cooling down, policy excluded and available
+    address counts of each subnet, and of each network they belong to.
+    """
+    @classmethod
+    def get_name(cls):
+        return "Subnet usage"
+
+    @classmethod
+    def get_alias(cls):
+        return RESOURCE_COLLECTION
+
+    @classmethod
+    def get_description(cls):
+        return "Expose IP address utilization of subnets and networks"
+
+    @classmethod
+    def get_namespace(cls):
+        return ("http://docs.openstack.org/network/ext/"
+                "subnet_usage/api/v2.0")
+
+    @classmethod
+    def get_updated(cls):
+        return "2013-10-01T10:00:00-00:00"
+
+    def get_extended_resources(self, version):
+        return {}
+
+    @classmethod
+    def get_resources(cls):
+        """Returns Ext Resources."""
+        controller = SubnetUsageController(
+            manager.NeutronManager.get_plugin())
+        return [extensions.ResourceExtension(
+            Subnet_usage.get_alias(),
+            controller)]
@@ -0,0 +1,66 @@
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Request scoped database sessions
+
+Plugin.sessioned closes the context's session after every plugin call,
+so an extension handler making several calls checks out a connection
+and rebuilds the identity map for each of them. With this middleware in
+the pipeline, after the one that sets neutron.context, the calls of a
+request share one session and its connection, closed once the response
+is built:
+
+    [filter:quark_session]
+    paste.filter_factory = quark.api.request_session:RequestSession.factory
+"""
+
+import webob.dec
+
+from neutron.openstack.common import log as logging
+from neutron import wsgi
+
+LOG = logging.getLogger(__name__)
+
+REQUEST_SCOPED = "quark_request_scoped"
+
+
+def is_request_scoped(context):
+    return getattr(context, REQUEST_SCOPED, False)
+
+
+def close_session(context):
+    """Closes the context's session, rolling back anything left open."""
+    session = context._session
+    context._session = None
+    if session is not None:
+        session.close()
+
+
+class RequestSession(wsgi.Middleware):
+    """Shares one database session across the plugin calls of a request."""
+
+    @webob.dec.wsgify(RequestClass=wsgi.Request)
+    def __call__(self, req):
+        ctx = req.environ.get("neutron.context")
+        if ctx is None:
+            return self.application
+
+        setattr(ctx, REQUEST_SCOPED, True)
+        try:
+            return req.get_response(self.application)
+        finally:
+            setattr(ctx, REQUEST_SCOPED, False)
+            close_session(ctx)
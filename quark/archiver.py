@@ -0,0 +1,130 @@
+# Copyright 2013 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Archiver for long deallocated IP and MAC addresses
+
+Deallocated rows are kept for auditing, but the reuse queries have to
+scan past them. Rows deallocated longer ago than the configured age are
+moved to the quark_ip_addresses_history and quark_mac_addresses_history
+tables, one bounded batch per transaction, so the hot tables only hold
+live and reusable addresses. Archived addresses are free again and the
+allocation cursors hand them out once they wrap around their range.
+"""
+
+import datetime
+import threading
+import time
+
+from neutron import context as neutron_context
+from neutron.openstack.common import log as logging
+from neutron.openstack.common import timeutils
+from oslo.config import cfg
+
+from quark.db import api as db_api
+
+LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
+
+quark_opts = [
+    cfg.IntOpt('archive_ip_addresses_after',
+               default=0,
+               help=_("Seconds after deallocation an IP address is moved to "
+                      "the history table. 0 disables archiving. Keep it "
+                      "well above ipam_reuse_after")),
+    cfg.IntOpt('archive_mac_addresses_after',
+               default=0,
+               help=_("Seconds after deallocation a MAC address is moved to "
+                      "the history table. 0 disables archiving")),
+    cfg.IntOpt('archive_batch_size',
+               default=500,
+               help=_("Rows archived per transaction")),
+    cfg.IntOpt('archive_interval',
+               default=3600,
+               help=_("Seconds between archiver runs"))
+]
+CONF.register_opts(quark_opts, "QUARK")
+
+_ARCHIVER = None
+_ARCHIVER_LOCK = threading.Lock()
+
+
+def is_enabled():
+    return (CONF.QUARK.archive_ip_addresses_after > 0 or
+            CONF.QUARK.archive_mac_addresses_after > 0)
+
+
+def _archive(context, archive_fn, age):
+    if age <= 0:
+        return 0
+    before = timeutils.utcnow() - datetime.timedelta(seconds=age)
+    batch_size = CONF.QUARK.archive_batch_size
+    total = 0
+    while True:
+        with context.session.begin():
+            archived = archive_fn(context, before, batch_size)
+        total += archived
+        if archived < batch_size:
+            return total
+
+
+def archive(context):
+    """Archives everything old enough, returning (ips, macs) moved."""
+    ips = _archive(context, db_api.ip_address_archive,
+                   CONF.QUARK.archive_ip_addresses_after)
+    macs = _archive(context, db_api.mac_address_archive,
+                    CONF.QUARK.archive_mac_addresses_after)
+    if ips or macs:
+        LOG.info("Archived %d IP and %d MAC addresses" % (ips, macs))
+    return ips, macs
+
+
+class Archiver(object):
+    """Runs archive() every archive_interval from a daemon thread."""
+    def __init__(self):
+        self.thread = threading.Thread(target=self._run,
+                                       name="quark-archiver")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(CONF.QUARK.archive_interval)
+            context = neutron_context.get_admin_context()
+            try:
+                archive(context)
+            except Exception:
+                LOG.exception("Failed to archive deallocated addresses")
+            finally:
+                context.session.close()
+
+
+def start():
+    """Starts this process' archiver if archiving is enabled."""
+    global _ARCHIVER
+    if not is_enabled():
+        return None
+    if _ARCHIVER is None:
+        with _ARCHIVER_LOCK:
+            if _ARCHIVER is None:
+                _ARCHIVER = Archiver()
+    return _ARCHIVER
+
+
+def reset():
+    """Forgets the archiver, e.g. after a fork where its thread is gone."""
+    global _ARCHIVER
+    with _ARCHIVER_LOCK:
+        _ARCHIVER = None
@@ -0,0 +1,316 @@
+# Copyright 2013 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Tenant scoped response cache for Quark
+
+Responses are stored under a key that embeds a generation token for the
+requesting tenant, plus a global token for shared networks. Writes replace
+the token instead of deleting entries, so stale responses simply stop being
+addressable and age out of the backend.
+"""
+
+import copy
+import hashlib
+import json
+import threading
+import time
+
+from neutron.openstack.common import importutils
+from neutron.openstack.common import log as logging
+from neutron.openstack.common import uuidutils
+from oslo.config import cfg
+
+from quark.db import replica
+from quark import network_strategy
+
+LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
+STRATEGY = network_strategy.STRATEGY
+
+quark_opts = [
+    cfg.BoolOpt('response_cache_enabled',
+                default=False,
+                help=_("Cache get_networks and get_subnets responses per "
+                       "tenant")),
+    cfg.StrOpt('response_cache_driver',
+               default='quark.cache.LRUCache',
+               help=_("Backend class of the response cache")),
+    cfg.IntOpt('response_cache_size',
+               default=1024,
+               help=_("Maximum entries held by the in-process LRU cache")),
+    cfg.IntOpt('response_cache_ttl',
+               default=300,
+               help=_("Seconds a cached response stays valid")),
+    cfg.ListOpt('response_cache_servers',
+                default=[],
+                help=_("memcached servers used by MemcachedCache. Without "
+                       "any a process local stand-in is used"))
+]
+CONF.register_opts(quark_opts, "QUARK")
+
+GLOBAL_SCOPE = "*"
+
+_BACKEND = None
+_BACKEND_LOCK = threading.Lock()
+
+
+class LRUCache(object):
+    """In-process least recently used cache.
+
+    Entries live in a circular doubly linked list, most recently used
+    first, so get, set and eviction are all constant time.
+    """
+    PREV, NEXT, KEY, VALUE, EXPIRES = range(5)
+
+    def __init__(self, size=None):
+        self.size = size or CONF.QUARK.response_cache_size
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self._map = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None, None]
+
+    def _unlink(self, link):
+        link[self.PREV][self.NEXT] = link[self.NEXT]
+        link[self.NEXT][self.PREV] = link[self.PREV]
+
+    def _push_front(self, link):
+        first = self._root[self.NEXT]
+        link[self.PREV] = self._root
+        link[self.NEXT] = first
+        first[self.PREV] = link
+        self._root[self.NEXT] = link
+
+    def get(self, key):
+        with self._lock:
+            link = self._map.get(key)
+            if link is None:
+                return None
+            if link[self.EXPIRES] and link[self.EXPIRES] <= _now():
+                self._unlink(link)
+                del self._map[key]
+                return None
+            self._unlink(link)
+            self._push_front(link)
+            return link[self.VALUE]
+
+    def set(self, key, value, time=0):
+        expires = time and _now() + time or None
+        with self._lock:
+            link = self._map.get(key)
+            if link is not None:
+                self._unlink(link)
+            link = [None, None, key, value, expires]
+            self._map[key] = link
+            self._push_front(link)
+            while len(self._map) > self.size:
+                oldest = self._root[self.PREV]
+                self._unlink(oldest)
+                del self._map[oldest[self.KEY]]
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            link = self._map.pop(key, None)
+            if link is not None:
+                self._unlink(link)
+        return True
+
+    def flush_all(self):
+        with self._lock:
+            self._clear()
+
+
+class LocalMemcache(object):
+    """Process local stand-in for a memcached client.
+
+    Implements the subset of the python-memcached client interface the
+    response cache needs, without any size bound.
+    """
+    def __init__(self):
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value, expires = self._cache.get(key, (None, None))
+            if expires and expires <= _now():
+                del self._cache[key]
+                return None
+            return value
+
+    def set(self, key, value, time=0):
+        with self._lock:
+            self._cache[key] = (value, time and _now() + time or None)
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            self._cache.pop(key, None)
+        return True
+
+    def flush_all(self):
+        with self._lock:
+            self._cache.clear()
+
+
+class MemcachedCache(object):
+    """Shared response cache backed by memcached.
+
+    Falls back to LocalMemcache when response_cache_servers is empty.
+    """
+    def __init__(self):
+        servers = CONF.QUARK.response_cache_servers
+        if servers:
+            memcache = importutils.import_module("memcache")
+            self.client = memcache.Client(servers)
+        else:
+            self.client = LocalMemcache()
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, time=0):
+        return self.client.set(key, value, time=time)
+
+    def delete(self, key):
+        return self.client.delete(key)
+
+    def flush_all(self):
+        return self.client.flush_all()
+
+
+def _now():
+    return time.time()
+
+
+def get_backend():
+    global _BACKEND
+    if _BACKEND is None:
+        with _BACKEND_LOCK:
+            if _BACKEND is None:
+                driver = importutils.import_class(
+                    CONF.QUARK.response_cache_driver)
+                _BACKEND = driver()
+    return _BACKEND
+
+
+def reset():
+    """Forgets the backend, e.g. after a fork where its sockets are shared."""
+    global _BACKEND
+    with _BACKEND_LOCK:
+        _BACKEND = None
+
+
+def is_enabled():
+    return CONF.QUARK.response_cache_enabled
+
+
+def _generation_key(scope):
+    return "quark-gen-%s" % scope
+
+
+def _generation(backend, scope):
+    key = _generation_key(scope)
+    generation = backend.get(key)
+    if generation is None:
+        generation = uuidutils.generate_uuid()
+        backend.set(key, generation)
+    return generation
+
+
+def _cache_key(backend, resource, context, filters, fields):
+    query = json.dumps([filters, fields], sort_keys=True, default=str)
+    return "quark-%s-%s-%s-%s-%s" % (
+        resource, context.tenant_id,
+        _generation(backend, context.tenant_id),
+        _generation(backend, GLOBAL_SCOPE),
+        hashlib.md5(query).hexdigest())
+
+
+def is_shared_network(network_id):
+    return (STRATEGY.is_parent_network(network_id) or
+            STRATEGY.get_parent_network(network_id) != network_id)
+
+
+def invalidate(context, tenant_id=None, network_id=None):
+    """Retires the cached responses of the requesting tenant and tenant_id.
+
+    Writes to a shared network also retire the global generation, which
+    every tenant's keys embed.
+    """
+    if not is_enabled():
+        return
+    scopes = set([context.tenant_id, tenant_id])
+    scopes.discard(None)
+    if network_id and is_shared_network(network_id):
+        scopes.add(GLOBAL_SCOPE)
+
+    backend = get_backend()
+    for scope in scopes:
+        backend.set(_generation_key(scope), uuidutils.generate_uuid())
+
+
+def invalidate_all():
+    """Retires every cached response.
+
+    Routes and IP policies change subnet responses of arbitrary tenants.
+    """
+    if not is_enabled():
+        return
+    get_backend().set(_generation_key(GLOBAL_SCOPE),
+                      uuidutils.generate_uuid())
+
+
+def _ttl(context):
+    """Returns the lifetime of a response, None if it must not be stored."""
+    ttl = CONF.QUARK.response_cache_ttl
+    if replica.should_use_replica(context):
+        sticky = CONF.QUARK.read_replica_sticky_seconds
+        if sticky <= 0:
+            return None
+        ttl = ttl and min(ttl, sticky) or sticky
+    return ttl
+
+
+def cached(resource):
+    """Caches a plugin module list call per tenant, filters and fields.
+
+    Admin contexts are never cached as their queries are not tenant scoped.
+    Responses read from the replica may predate the generation they would be
+    stored under, so they are kept no longer than the replica is trusted to
+    lag, and not at all without a sticky window.
+    """
+    def _decorator(func):
+        def _wrapped(context, filters=None, fields=None):
+            if not is_enabled() or context.is_admin:
+                return func(context, filters, fields)
+
+            backend = get_backend()
+            key = _cache_key(backend, resource, context, filters, fields)
+            res = backend.get(key)
+            if res is not None:
+                return copy.deepcopy(res)
+
+            res = func(context, filters, fields)
+            ttl = _ttl(context)
+            if ttl is not None:
+                backend.set(key, copy.deepcopy(res), time=ttl)
+            return res
+        return _wrapped
+    return _decorator
@@ -0,0 +1,40 @@
+"""Add IP address reservations for worker leases
+
+Revision ID: 25b4829817c9
+Revises: None
+Create Date: 2013-10-09 16:41:27.302144
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '25b4829817c9'
+down_revision = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        "quark_ip_address_reservations",
+        sa.Column("id", sa.String(36), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("subnet_id", sa.String(36), nullable=False),
+        sa.Column("address", sa.String(64), nullable=False),
+        sa.Column("owner", sa.String(255), nullable=False),
+        sa.Column("expires_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(["subnet_id"], ["quark_subnets.id"],
+                                ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        mysql_engine="InnoDB")
+    op.create_index("ix_quark_ip_address_reservations_owner",
+                    "quark_ip_address_reservations", ["owner"])
+    op.create_index("ix_quark_ip_address_reservations_expires_at",
+                    "quark_ip_address_reservations", ["expires_at"])
+    op.create_index("idx_ip_address_reservations_subnet_address",
+                    "quark_ip_address_reservations",
+                    ["subnet_id", "address"], unique=True)
+
+
+def downgrade():
+    op.drop_table("quark_ip_address_reservations")
@@ -0,0 +1,51 @@
+"""Denormalize route cidr bounds
+
+Revision ID: 2a7b4ad9c6d1
+Revises: 2ac09a0930ee
+Create Date: 2013-10-21 14:02:11.507133
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2a7b4ad9c6d1'
+down_revision = '2ac09a0930ee'
+
+from alembic import op
+import netaddr
+import sqlalchemy as sa
+
+from quark.db import custom_types
+
+routes = sa.sql.table("quark_routes",
+                      sa.sql.column("id", sa.String(36)),
+                      sa.sql.column("cidr", sa.String(64)),
+                      sa.sql.column("first_ip", custom_types.OrderedINET()),
+                      sa.sql.column("last_ip", custom_types.OrderedINET()),
+                      sa.sql.column("prefix", sa.Integer()))
+
+
+def upgrade():
+    op.add_column("quark_routes",
+                  sa.Column("first_ip", sa.CHAR(39), nullable=True))
+    op.add_column("quark_routes",
+                  sa.Column("last_ip", sa.CHAR(39), nullable=True))
+    op.add_column("quark_routes",
+                  sa.Column("prefix", sa.Integer(), nullable=True))
+
+    connection = op.get_bind()
+    existing = connection.execute(
+        sa.select([routes.c.id, routes.c.cidr])).fetchall()
+    for route_id, cidr in existing:
+        preip = netaddr.IPNetwork(cidr)
+        ip = preip.ipv6()
+        connection.execute(
+            routes.update().
+            where(routes.c.id == route_id).
+            values(first_ip=ip.first, last_ip=ip.last,
+                   prefix=preip.prefixlen))
+
+
+def downgrade():
+    op.drop_column("quark_routes", "prefix")
+    op.drop_column("quark_routes", "last_ip")
+    op.drop_column("quark_routes", "first_ip")
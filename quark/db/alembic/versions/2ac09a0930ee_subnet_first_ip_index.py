@@ -0,0 +1,43 @@
+"""Store subnet bounds as ordered text and index them
+
+Revision ID: 2ac09a0930ee
+Revises: afe3857265ed
+Create Date: 2013-10-18 10:31:57.604418
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2ac09a0930ee'
+down_revision = 'afe3857265ed'
+
+from alembic import op
+import sqlalchemy as sa
+
+BOUNDS = ("first_ip", "last_ip")
+
+
+def upgrade():
+    # NOTE(quark): the bounds were BLOBs of decimal text on MySQL, which
+    #              compare with integers as doubles. Zero padded they
+    #              compare exactly as text. SQLite stored them padded already
+    if op.get_bind().dialect.name == "mysql":
+        for column in BOUNDS:
+            op.alter_column("quark_subnets", column, type_=sa.CHAR(39),
+                            existing_type=sa.LargeBinary(),
+                            existing_nullable=True)
+            op.execute("UPDATE quark_subnets SET %(c)s = LPAD(%(c)s, 39, '0') "
+                       "WHERE %(c)s IS NOT NULL" % dict(c=column))
+    op.create_index("idx_subnets_first_ip", "quark_subnets", ["first_ip"])
+
+
+def downgrade():
+    op.drop_index("idx_subnets_first_ip", "quark_subnets")
+    if op.get_bind().dialect.name == "mysql":
+        for column in BOUNDS:
+            op.execute("UPDATE quark_subnets "
+                       "SET %(c)s = CAST(CAST(%(c)s AS DECIMAL(39)) AS CHAR) "
+                       "WHERE %(c)s IS NOT NULL" % dict(c=column))
+            op.alter_column("quark_subnets", column,
+                            type_=sa.LargeBinary(),
+                            existing_type=sa.CHAR(39),
+                            existing_nullable=True)
@@ -0,0 +1,74 @@
+"""Add maintained subnet usage counts
+
+Revision ID: 31f6f45176ba
+Revises: c91bad7e7c9f
+Create Date: 2013-10-11 13:05:38.914520
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '31f6f45176ba'
+down_revision = 'c91bad7e7c9f'
+
+import uuid
+
+from alembic import op
+import sqlalchemy as sa
+
+subnets = sa.sql.table("quark_subnets",
+                       sa.sql.column("id", sa.String(36)))
+ip_addresses = sa.sql.table("quark_ip_addresses",
+                            sa.sql.column("id", sa.String(36)),
+                            sa.sql.column("subnet_id", sa.String(36)),
+                            sa.sql.column("_deallocated", sa.Boolean()))
+subnet_usage = sa.sql.table("quark_subnet_usage",
+                            sa.sql.column("id", sa.String(36)),
+                            sa.sql.column("subnet_id", sa.String(36)),
+                            sa.sql.column("slot", sa.Integer()),
+                            sa.sql.column("allocated", sa.Integer()),
+                            sa.sql.column("deallocated", sa.Integer()))
+
+
+def upgrade():
+    op.create_table(
+        "quark_subnet_usage",
+        sa.Column("id", sa.String(36), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("subnet_id", sa.String(36), nullable=False),
+        sa.Column("slot", sa.Integer(), nullable=False),
+        sa.Column("allocated", sa.Integer(), nullable=False),
+        sa.Column("deallocated", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["subnet_id"], ["quark_subnets.id"],
+                                ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        mysql_engine="InnoDB")
+    op.create_index("idx_subnet_usage_subnet_slot", "quark_subnet_usage",
+                    ["subnet_id", "slot"], unique=True)
+    op.create_index("idx_ip_addresses_subnet_deallocated",
+                    "quark_ip_addresses",
+                    ["subnet_id", "_deallocated", "deallocated_at"])
+
+    # NOTE(quark): existing counts go to slot 0, which updates fall back to
+    #              when the slot they picked has no row
+    connection = op.get_bind()
+    counts = dict((subnet_id, [0, 0]) for subnet_id, in
+                  connection.execute(sa.select([subnets.c.id])))
+    for subnet_id, deallocated, count in connection.execute(
+            sa.select([ip_addresses.c.subnet_id,
+                       ip_addresses.c._deallocated,
+                       sa.func.count(ip_addresses.c.id)]).
+            group_by(ip_addresses.c.subnet_id,
+                     ip_addresses.c._deallocated)):
+        if subnet_id in counts:
+            counts[subnet_id][1 if deallocated else 0] += count
+    if counts:
+        connection.execute(subnet_usage.insert(), [
+            dict(id=str(uuid.uuid4()), subnet_id=subnet_id, slot=0,
+                 allocated=allocated, deallocated=deallocated)
+            for subnet_id, (allocated, deallocated) in counts.items()])
+
+
+def downgrade():
+    op.drop_index("idx_ip_addresses_subnet_deallocated",
+                  "quark_ip_addresses")
+    op.drop_table("quark_subnet_usage")
@@ -0,0 +1,39 @@
+"""Add the IP address event log
+
+Revision ID: 863354f36db8
+Revises: cd37c43af670
+Create Date: 2013-10-16 11:38:54.250618
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '863354f36db8'
+down_revision = 'cd37c43af670'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        "quark_ip_address_events",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("event", sa.String(16), nullable=False),
+        sa.Column("address_readable", sa.String(128), nullable=False),
+        sa.Column("ip_address_id", sa.String(36), nullable=True),
+        sa.Column("subnet_id", sa.String(36), nullable=True),
+        sa.Column("network_id", sa.String(36), nullable=True),
+        sa.Column("tenant_id", sa.String(255), nullable=True),
+        sa.Column("port_id", sa.String(36), nullable=True),
+        sa.Column("device_id", sa.String(255), nullable=True),
+        sa.Column("occurred_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        mysql_engine="InnoDB")
+    op.create_index("idx_ip_address_events_network_address_occurred_at",
+                    "quark_ip_address_events",
+                    ["network_id", "address_readable", "occurred_at"])
+
+
+def downgrade():
+    op.drop_table("quark_ip_address_events")
@@ -0,0 +1,49 @@
+"""Add tracked quota usage and reservations
+
+Revision ID: afe3857265ed
+Revises: 863354f36db8
+Create Date: 2013-10-17 14:46:32.519862
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'afe3857265ed'
+down_revision = '863354f36db8'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        "quark_quota_usages",
+        sa.Column("tenant_id", sa.String(255), nullable=True),
+        sa.Column("id", sa.String(36), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("resource", sa.String(255), nullable=False),
+        sa.Column("scope_id", sa.String(255), nullable=False),
+        sa.Column("in_use", sa.Integer(), nullable=False),
+        sa.Column("reserved", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        mysql_engine="InnoDB")
+    op.create_index("idx_quota_usages_resource_scope", "quark_quota_usages",
+                    ["resource", "scope_id"], unique=True)
+
+    op.create_table(
+        "quark_quota_reservations",
+        sa.Column("id", sa.String(36), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("usage_id", sa.String(36), nullable=False),
+        sa.Column("delta", sa.Integer(), nullable=False),
+        sa.Column("expires_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(["usage_id"], ["quark_quota_usages.id"],
+                                ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        mysql_engine="InnoDB")
+    op.create_index("ix_quark_quota_reservations_expires_at",
+                    "quark_quota_reservations", ["expires_at"])
+
+
+def downgrade():
+    op.drop_table("quark_quota_reservations")
+    op.drop_table("quark_quota_usages")
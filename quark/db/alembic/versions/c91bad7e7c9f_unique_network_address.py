@@ -0,0 +1,83 @@
+"""Enforce unique addresses per network
+
+Revision ID: c91bad7e7c9f
+Revises: 25b4829817c9
+Create Date: 2013-10-10 09:52:16.480377
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c91bad7e7c9f'
+down_revision = '25b4829817c9'
+
+from alembic import op
+import sqlalchemy as sa
+
+ip_addresses = sa.sql.table("quark_ip_addresses",
+                            sa.sql.column("id", sa.String(36)),
+                            sa.sql.column("network_id", sa.String(36)),
+                            sa.sql.column("address"),
+                            sa.sql.column("address_readable",
+                                          sa.String(128)),
+                            sa.sql.column("_deallocated", sa.Boolean()))
+associations = sa.sql.table("quark_port_ip_address_associations",
+                            sa.sql.column("ip_address_id", sa.String(36)))
+
+
+def _spare_duplicates(connection):
+    """Returns the ids of rows that only repeat an address of their network.
+
+    A copy is spare when it is deallocated and no port holds it. Of an
+    address stored only as spare copies the first is kept. Addresses in use
+    through more than one copy can not be merged safely, so the upgrade
+    stops and names all of them before anything is deleted.
+    """
+    duplicates = connection.execute(
+        sa.select([ip_addresses.c.network_id, ip_addresses.c.address]).
+        group_by(ip_addresses.c.network_id, ip_addresses.c.address).
+        having(sa.func.count(ip_addresses.c.id) > 1)).fetchall()
+
+    held = sa.exists().where(
+        associations.c.ip_address_id == ip_addresses.c.id)
+    spare, conflicts = [], []
+    for network_id, address in duplicates:
+        copies = connection.execute(
+            sa.select([ip_addresses.c.id, ip_addresses.c.address_readable,
+                       held, ip_addresses.c._deallocated]).
+            where(ip_addresses.c.network_id == network_id).
+            where(ip_addresses.c.address == address).
+            order_by(ip_addresses.c.id)).fetchall()
+        in_use = [c for c in copies if c[2] or not c[3]]
+        if len(in_use) > 1:
+            conflicts.append("%s in network %s (rows %s)" % (
+                copies[0][1], network_id, ", ".join(c[0] for c in in_use)))
+            continue
+        keep = in_use and in_use[0] or copies[0]
+        spare.extend(c[0] for c in copies if c is not keep)
+
+    if conflicts:
+        raise RuntimeError("Addresses in use through more than one row, "
+                           "resolve them by hand before upgrading: %s" %
+                           "; ".join(conflicts))
+    return spare
+
+
+def upgrade():
+    spare = _spare_duplicates(op.get_bind())
+    if spare:
+        op.execute(ip_addresses.delete().where(
+            ip_addresses.c.id.in_(spare)))
+
+    # NOTE(quark): address is a BLOB on MySQL, indexed by a prefix long
+    #              enough for the decimal text of any address
+    if op.get_bind().dialect.name == "mysql":
+        op.execute("CREATE UNIQUE INDEX idx_ip_addresses_network_address "
+                   "ON quark_ip_addresses (network_id, address(39))")
+    else:
+        op.create_index("idx_ip_addresses_network_address",
+                        "quark_ip_addresses", ["network_id", "address"],
+                        unique=True)
+
+
+def downgrade():
+    op.drop_index("idx_ip_addresses_network_address", "quark_ip_addresses")
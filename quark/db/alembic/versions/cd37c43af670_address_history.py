@@ -0,0 +1,62 @@
+"""Add IP and MAC address history tables
+
+Revision ID: cd37c43af670
+Revises: ce118920998d
+Create Date: 2013-10-15 15:12:49.027736
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'cd37c43af670'
+down_revision = 'ce118920998d'
+
+from alembic import op
+import sqlalchemy as sa
+
+from quark.db import custom_types
+
+
+def upgrade():
+    op.create_table(
+        "quark_ip_addresses_history",
+        sa.Column("id", sa.String(36), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("address_readable", sa.String(128), nullable=False),
+        sa.Column("address", custom_types.INET(), nullable=False),
+        sa.Column("subnet_id", sa.String(36), nullable=True),
+        sa.Column("network_id", sa.String(36), nullable=True),
+        sa.Column("version", sa.Integer(), nullable=True),
+        sa.Column("used_by_tenant_id", sa.String(255), nullable=True),
+        sa.Column("allocated_at", sa.DateTime(), nullable=True),
+        sa.Column("deallocated_at", sa.DateTime(), nullable=True),
+        sa.Column("archived_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        mysql_engine="InnoDB")
+    op.create_index("ix_quark_ip_addresses_history_subnet_id",
+                    "quark_ip_addresses_history", ["subnet_id"])
+    op.create_index("ix_quark_ip_addresses_history_archived_at",
+                    "quark_ip_addresses_history", ["archived_at"])
+    op.create_index("idx_ip_addresses_history_network_address",
+                    "quark_ip_addresses_history",
+                    ["network_id", "address_readable"])
+
+    op.create_table(
+        "quark_mac_addresses_history",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("address", sa.BigInteger(), nullable=False),
+        sa.Column("tenant_id", sa.String(255), nullable=True),
+        sa.Column("mac_address_range_id", sa.String(36), nullable=True),
+        sa.Column("deallocated_at", sa.DateTime(), nullable=True),
+        sa.Column("archived_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        mysql_engine="InnoDB")
+    op.create_index("ix_quark_mac_addresses_history_address",
+                    "quark_mac_addresses_history", ["address"])
+    op.create_index("ix_quark_mac_addresses_history_archived_at",
+                    "quark_mac_addresses_history", ["archived_at"])
+
+
+def downgrade():
+    op.drop_table("quark_mac_addresses_history")
+    op.drop_table("quark_ip_addresses_history")
@@ -0,0 +1,24 @@
+"""Add per network subnet selection policies
+
+Revision ID: ce118920998d
+Revises: 31f6f45176ba
+Create Date: 2013-10-14 10:27:03.665089
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'ce118920998d'
+down_revision = '31f6f45176ba'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column("quark_networks",
+                  sa.Column("subnet_selection", sa.String(255),
+                            nullable=True))
+
+
+def downgrade():
+    op.drop_column("quark_networks", "subnet_selection")
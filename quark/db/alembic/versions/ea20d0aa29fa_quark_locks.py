@@ -0,0 +1,27 @@
+"""Add the names the table lock manager locks
+
+Revision ID: ea20d0aa29fa
+Revises: 2a7b4ad9c6d1
+Create Date: 2013-10-22 10:37:54.218306
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'ea20d0aa29fa'
+down_revision = '2a7b4ad9c6d1'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        "quark_locks",
+        sa.Column("name", sa.String(255), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("name"),
+        mysql_engine="InnoDB")
+
+
+def downgrade():
+    op.drop_table("quark_locks")
@@ -13,20 +13,26 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import datetime
 import inspect
+import random
 
+from neutron.openstack.common.db import exception as db_exception
 from neutron.openstack.common import log as logging
 from neutron.openstack.common import timeutils
 from neutron.openstack.common import uuidutils
+from oslo.config import cfg
 from sqlalchemy import event
 from sqlalchemy import func as sql_func
 from sqlalchemy import and_, asc, orm, or_
 
+from quark.db import locks
 from quark.db import models
 from quark import network_strategy
 
 
+CONF = cfg.CONF
 STRATEGY = network_strategy.STRATEGY
 LOG = logging.getLogger(__name__)
 
@@ -49,6 +55,119 @@ for _name, klass in inspect.getmembers(models, inspect.isclass):
         event.listen(klass, "init", _perhaps_generate_id)
 
 
+def _bump_subnet_usage(connection, subnet_id, allocated=0, deallocated=0):
+    if not subnet_id:
+        return
+    usage = models.SubnetUsage.__table__
+    slots = [random.randrange(CONF.QUARK.subnet_usage_slots)]
+    if slots[0] != 0:
+        # NOTE(quark): slot 0 always exists, the random one may not if the
+        #              number of slots was raised since the subnet was made
+        slots.append(0)
+    for slot in slots:
+        result = connection.execute(
+            usage.update().
+            where(and_(usage.c.subnet_id == subnet_id, usage.c.slot == slot)).
+            values(allocated=usage.c.allocated + allocated,
+                   deallocated=usage.c.deallocated + deallocated))
+        if result.rowcount:
+            return
+
+
+def _subnet_inserted(mapper, connection, target):
+    # NOTE(quark): inserted here rather than through the relationship so the
+    #              rows exist before any address of the subnet is flushed
+    connection.execute(
+        models.SubnetUsage.__table__.insert(),
+        [dict(id=uuidutils.generate_uuid(), subnet_id=target.id, slot=slot,
+              allocated=0, deallocated=0)
+         for slot in xrange(CONF.QUARK.subnet_usage_slots)])
+
+
+def _ip_address_inserted(mapper, connection, target):
+    if target._deallocated:
+        _bump_subnet_usage(connection, target.subnet_id, deallocated=1)
+    else:
+        _bump_subnet_usage(connection, target.subnet_id, allocated=1)
+
+
+def _ip_address_updated(mapper, connection, target):
+    history = orm.attributes.get_history(target, "_deallocated")
+    if not history.deleted:
+        return
+    was_deallocated = bool(history.deleted[0])
+    if was_deallocated == bool(target._deallocated):
+        return
+    delta = -1 if was_deallocated else 1
+    _bump_subnet_usage(connection, target.subnet_id, allocated=-delta,
+                       deallocated=delta)
+
+
+def _ip_address_deleted(mapper, connection, target):
+    if target._deallocated:
+        _bump_subnet_usage(connection, target.subnet_id, deallocated=-1)
+    else:
+        _bump_subnet_usage(connection, target.subnet_id, allocated=-1)
+
+
+def _lock_inserted(lock_name):
+    def _inserted(mapper, connection, target):
+        connection.execute(models.Lock.__table__.insert(),
+                           dict(name=lock_name(target.id)))
+    return _inserted
+
+
+def _lock_deleted(lock_name):
+    def _deleted(mapper, connection, target):
+        lock = models.Lock.__table__
+        connection.execute(lock.delete().where(
+            lock.c.name == lock_name(target.id)))
+    return _deleted
+
+event.listen(models.Subnet, "after_insert", _subnet_inserted)
+# NOTE(quark): the rows the table lock manager locks are made along with
+#              the cursors they guard, so first claims never race to
+#              insert them
+for _model, _lock_name in ((models.Subnet, locks.subnet_lock_name),
+                           (models.MacAddressRange,
+                            locks.mac_range_lock_name)):
+    event.listen(_model, "after_insert", _lock_inserted(_lock_name))
+    event.listen(_model, "after_delete", _lock_deleted(_lock_name))
+# NOTE(quark): keep the subnet usage counts in step with every flush of an
+#              IP address, whichever code path made it
+event.listen(models.IPAddress, "after_insert", _ip_address_inserted)
+event.listen(models.IPAddress, "after_update", _ip_address_updated)
+event.listen(models.IPAddress, "after_delete", _ip_address_deleted)
+
+
+# NOTE(quark): quota resources whose usage is tracked, with the column that
+#              scopes their counts
+QUOTA_USAGE_SCOPES = {
+    "ports_per_network": models.Port.network_id,
+    "security_rules_per_group": models.SecurityGroupRule.group_id,
+    "network": models.Network.tenant_id,
+    "subnet": models.Subnet.tenant_id,
+}
+
+
+def _bump_quota_usage(delta):
+    def _bump(mapper, connection, target):
+        usage = models.QuotaUsage.__table__
+        for resource, column in QUOTA_USAGE_SCOPES.items():
+            if not isinstance(target, column.class_):
+                continue
+            connection.execute(
+                usage.update().
+                where(and_(usage.c.resource == resource,
+                           usage.c.scope_id == getattr(target, column.key))).
+                values(in_use=usage.c.in_use + delta))
+    return _bump
+
+for _model in set(column.class_ for column in QUOTA_USAGE_SCOPES.values()):
+    event.listen(_model, "after_insert", _bump_quota_usage(1))
+    event.listen(_model, "after_delete", _bump_quota_usage(-1))
+
+
 def _listify(filters):
     for key in ["name", "network_id", "id", "device_id", "tenant_id",
                 "mac_address", "shared", "version"]:
@@ -61,59 +180,41 @@ def _listify(filters):
             filters[key] = listified
 
 
-def _model_query(context, model, filters, fields=None):
-    filters = filters or {}
-    model_filters = []
-
-    if filters.get("name"):
-        model_filters.append(model.name.in_(filters["name"]))
-
-    if filters.get("network_id"):
-        model_filters.append(model.network_id.in_(filters["network_id"]))
-
-    if filters.get("mac_address"):
-        model_filters.append(model.mac_address.in_(filters["mac_address"]))
-
-    if filters.get("id"):
-        model_filters.append(model.id.in_(filters["id"]))
-
-    if filters.get("reuse_after"):
-        reuse_after = filters["reuse_after"]
-        reuse = (timeutils.utcnow() -
-                 datetime.timedelta(seconds=reuse_after))
-        model_filters.append(model.deallocated_at <= reuse)
+def _reuse_after_filter(column, reuse_after):
+    reuse = timeutils.utcnow() - datetime.timedelta(seconds=reuse_after)
+    return column <= reuse
 
-    if filters.get("subnet_id"):
-        model_filters.append(model.subnet_id ==
-                             filters["subnet_id"])
-
-    if filters.get("deallocated"):
-        model_filters.append(model.deallocated == filters["deallocated"])
-
-    if filters.get("_deallocated") is not None:
-        if filters.get("_deallocated"):
-            model_filters.append(model._deallocated == 1)
-        else:
-            model_filters.append(model._deallocated != 1)
-
-    if filters.get("address"):
-        model_filters.append(model.address == filters["address"])
 
-    if filters.get("version"):
-        model_filters.append(model.version.in_(filters["version"]))
+def _deallocated_filter(column, deallocated):
+    if deallocated:
+        return column == 1
+    return column != 1
 
-    if filters.get("ip_version"):
-        model_filters.append(model.ip_version == filters["ip_version"])
 
-    if filters.get("ip_address"):
-        model_filters.append(model.address == int(filters["ip_address"]))
+# NOTE(quark): filter key -> (model attribute, criterion builder), in the
+#              order their criteria are added to queries
+_MODEL_FILTERS = (
+    ("name", "name", lambda column, value: column.in_(value)),
+    ("network_id", "network_id", lambda column, value: column.in_(value)),
+    ("mac_address", "mac_address", lambda column, value: column.in_(value)),
+    ("id", "id", lambda column, value: column.in_(value)),
+    ("reuse_after", "deallocated_at", _reuse_after_filter),
+    ("subnet_id", "subnet_id", lambda column, value: column == value),
+    ("deallocated", "deallocated", lambda column, value: column == value),
+    ("_deallocated", "_deallocated", _deallocated_filter),
+    ("address", "address", lambda column, value: column == value),
+    ("version", "version", lambda column, value: column.in_(value)),
+    ("ip_version", "ip_version", lambda column, value: column == value),
+    ("ip_address", "address", lambda column, value: column == int(value)),
+    ("mac_address_range_id", "mac_address_range_id",
+     lambda column, value: column == value),
+    ("cidr", "cidr", lambda column, value: column == value),
+    ("tenant_id", "tenant_id", lambda column, value: column.in_(value)),
+)
 
-    if filters.get("mac_address_range_id"):
-        model_filters.append(model.mac_address_range_id ==
-                             filters["mac_address_range_id"])
 
-    if filters.get("cidr"):
-        model_filters.append(model.cidr == filters["cidr"])
+def _model_query(context, model, filters, fields=None):
+    filters = filters or {}
 
     # Inject the tenant id if none is set. We don't need unqualified queries.
     # This works even when a non-shared, other-tenant owned network is passed
@@ -122,10 +223,17 @@ def _model_query(context, model, filters, fields=None):
     if not filters and not context.is_admin:
         filters["tenant_id"] = [context.tenant_id]
 
-    if filters.get("tenant_id"):
-        model_filters.append(model.tenant_id.in_(filters["tenant_id"]))
+    def _active(key):
+        value = filters.get(key)
+        return value or key == "_deallocated" and value is not None
 
-    return model_filters
+    return [build(getattr(model, attr), filters[key])
+            for key, attr, build in _MODEL_FILTERS if _active(key)]
+
+
+def _exists(query):
+    """Probes for a matching row with LIMIT 1 rather than loading them all."""
+    return query.first() is not None
 
 
 def scoped(f):
@@ -177,6 +285,28 @@ def port_count_all(context, **filters):
     return query.filter(*model_filters).scalar()
 
 
+def port_find_nw_info(context, device_ids):
+    """Loads everything Nova's get_instance_nw_info needs for device_ids.
+
+    Ports and their addresses come back in one joined query; the addresses'
+    subnets, their routes and DNS nameservers, and the ports' security
+    groups are loaded by one set-based query each, regardless of the number
+    of devices.
+    """
+    ip_subnet = "ip_addresses.subnet"
+    query = context.session.query(models.Port).options(
+        orm.joinedload(models.Port.ip_addresses),
+        orm.subqueryload(models.Port.security_groups),
+        orm.subqueryload_all("%s.routes" % ip_subnet),
+        orm.subqueryload_all("%s.dns_nameservers" % ip_subnet))
+
+    model_filters = [models.Port.device_id.in_(device_ids)]
+    if not context.is_admin:
+        model_filters.append(models.Port.tenant_id == context.tenant_id)
+    return query.filter(*model_filters).order_by(
+        asc(models.Port.created_at)).all()
+
+
 def port_create(context, **port_dict):
     port = models.Port()
     port.update(port_dict)
@@ -218,6 +348,83 @@ def ip_address_create(context, **address_dict):
     return ip_address
 
 
+def ip_address_find_taken(context, network_id, subnet_id, addresses):
+    """Returns which of the readable addresses are allocated or reserved."""
+    allocated = context.session.query(models.IPAddress.address_readable).\
+        filter(models.IPAddress.network_id == network_id,
+               models.IPAddress.address_readable.in_(addresses))
+    reserved = context.session.query(models.IPAddressReservation.address).\
+        filter(models.IPAddressReservation.subnet_id == subnet_id,
+               models.IPAddressReservation.address.in_(addresses))
+    return set(row[0] for row in allocated.union(reserved))
+
+
+def ip_address_find_reusable(context, network_id, reuse_after, addresses):
+    """Returns, locked, which of the readable addresses can be reused."""
+    query = context.session.query(models.IPAddress).with_lockmode("update")
+    query = query.filter(models.IPAddress.network_id == network_id,
+                         models.IPAddress.address_readable.in_(addresses),
+                         models.IPAddress._deallocated == 1)
+    query = query.filter(_reuse_after_filter(models.IPAddress.deallocated_at,
+                                             reuse_after))
+    return query.all()
+
+
+def ip_address_find_next_reusable(context, subnet_ids, reuse_after,
+                                  exclude=None):
+    """Returns, locked, the lowest reusable address in any of subnet_ids.
+
+    Readable addresses in exclude are skipped.
+    """
+    query = context.session.query(models.IPAddress).with_lockmode("update")
+    query = query.filter(models.IPAddress.subnet_id.in_(subnet_ids),
+                         models.IPAddress._deallocated == 1)
+    query = query.filter(_reuse_after_filter(models.IPAddress.deallocated_at,
+                                             reuse_after))
+    if exclude:
+        query = query.filter(~models.IPAddress.address_readable.in_(exclude))
+    return query.order_by(models.IPAddress.address).first()
+
+
+def ip_address_count_cooling_down(context, subnet_ids, reuse_after):
+    """Counts deallocated addresses not yet past reuse_after per subnet."""
+    if not subnet_ids:
+        return {}
+    cutoff = timeutils.utcnow() - datetime.timedelta(seconds=reuse_after)
+    query = context.session.query(models.IPAddress.subnet_id,
+                                  sql_func.count(models.IPAddress.id))
+    query = query.filter(models.IPAddress.subnet_id.in_(subnet_ids))
+    query = query.filter(models.IPAddress._deallocated == 1)
+    query = query.filter(models.IPAddress.deallocated_at > cutoff)
+    query = query.group_by(models.IPAddress.subnet_id)
+    return dict(query.all())
+
+
+def ip_address_reservation_create(context, **reservation_dict):
+    reservation = models.IPAddressReservation()
+    reservation.update(reservation_dict)
+    context.session.add(reservation)
+    return reservation
+
+
+def ip_address_reservation_delete(context, subnet_id, address, owner):
+    query = context.session.query(models.IPAddressReservation)
+    query = query.filter(models.IPAddressReservation.subnet_id == subnet_id)
+    query = query.filter(models.IPAddressReservation.address == address)
+    query = query.filter(models.IPAddressReservation.owner == owner)
+    return query.delete(synchronize_session=False)
+
+
+def ip_address_reservation_delete_all(context, owner=None, expired_at=None):
+    query = context.session.query(models.IPAddressReservation)
+    if owner:
+        query = query.filter(models.IPAddressReservation.owner == owner)
+    if expired_at:
+        query = query.filter(
+            models.IPAddressReservation.expires_at <= expired_at)
+    return query.delete(synchronize_session=False)
+
+
 @scoped
 def ip_address_find(context, lock_mode=False, **filters):
     query = context.session.query(models.IPAddress)
@@ -248,6 +455,97 @@ def ip_address_find(context, lock_mode=False, **filters):
     return query.filter(*model_filters)
 
 
+def _archive_rows(context, model, history, columns, key, filters, limit):
+    query = context.session.query(*[getattr(model, column)
+                                    for column in columns])
+    query = query.with_lockmode("update").filter(*filters)
+    rows = [dict(zip(columns, row)) for row in query.limit(limit)]
+    if not rows:
+        return rows
+    archived_at = timeutils.utcnow()
+    for row in rows:
+        row["archived_at"] = archived_at
+    context.session.execute(history.__table__.insert(), rows)
+    keys = [row[key] for row in rows]
+    context.session.query(model).filter(getattr(model, key).in_(keys)).\
+        delete(synchronize_session=False)
+    return rows
+
+
+def ip_address_archive(context, before, limit):
+    """Moves up to limit addresses deallocated before `before` to history.
+
+    Returns the number of addresses moved.
+    """
+    columns = ("id", "created_at", "address_readable", "address",
+               "subnet_id", "network_id", "version", "used_by_tenant_id",
+               "allocated_at", "deallocated_at")
+    filters = [models.IPAddress._deallocated == 1,
+               models.IPAddress.deallocated_at < before,
+               ~models.IPAddress.ports.any()]
+    rows = _archive_rows(context, models.IPAddress, models.IPAddressHistory,
+                         columns, "id", filters, limit)
+    per_subnet = collections.defaultdict(int)
+    for row in rows:
+        per_subnet[row["subnet_id"]] += 1
+    connection = context.session.connection()
+    for subnet_id, count in per_subnet.items():
+        _bump_subnet_usage(connection, subnet_id, deallocated=-count)
+    return len(rows)
+
+
+def ip_address_event_create(context, **event_dict):
+    event = models.IPAddressEvent()
+    event.update(event_dict)
+    event["occurred_at"] = timeutils.utcnow()
+    context.session.add(event)
+    return event
+
+
+def ip_address_event_find(context, network_id, address, start=None,
+                          end=None, tenant_id=None):
+    """Returns the events of an address of the network between start and
+    end, oldest first.
+
+    The last event before start comes first, giving who held the address
+    when the range began.
+    """
+    query = context.session.query(models.IPAddressEvent)
+    query = query.filter(models.IPAddressEvent.network_id == network_id)
+    query = query.filter(models.IPAddressEvent.address_readable ==
+                         str(address))
+    if tenant_id:
+        query = query.filter(models.IPAddressEvent.tenant_id == tenant_id)
+    events = []
+    if start:
+        prior = query.filter(models.IPAddressEvent.occurred_at < start)
+        prior = prior.order_by(models.IPAddressEvent.occurred_at.desc(),
+                               models.IPAddressEvent.id.desc()).first()
+        if prior:
+            events.append(prior)
+        query = query.filter(models.IPAddressEvent.occurred_at >= start)
+    if end:
+        query = query.filter(models.IPAddressEvent.occurred_at <= end)
+    query = query.order_by(models.IPAddressEvent.occurred_at,
+                           models.IPAddressEvent.id)
+    return events + query.all()
+
+
+@scoped
+def ip_address_history_find(context, **filters):
+    query = context.session.query(models.IPAddressHistory)
+    if filters.get("network_id"):
+        query = query.filter(models.IPAddressHistory.network_id.in_(
+            filters["network_id"]))
+    if filters.get("subnet_id"):
+        query = query.filter(models.IPAddressHistory.subnet_id ==
+                             filters["subnet_id"])
+    if filters.get("ip_address"):
+        query = query.filter(models.IPAddressHistory.address_readable ==
+                             str(filters["ip_address"]))
+    return query.order_by(models.IPAddressHistory.archived_at)
+
+
 @scoped
 def mac_address_find(context, lock_mode=False, **filters):
     query = context.session.query(models.MacAddress)
@@ -257,10 +555,13 @@ def mac_address_find(context, lock_mode=False, **filters):
     return query.filter(*model_filters)
 
 
-def mac_address_range_find_allocation_counts(context, address=None):
+def mac_address_range_find_allocation_counts(context, address=None,
+                                             lock_mode=True):
     query = context.session.query(models.MacAddressRange,
                                   sql_func.count(models.MacAddress.address).
-                                  label("count")).with_lockmode("update")
+                                  label("count"))
+    if lock_mode:
+        query = query.with_lockmode("update")
     query = query.outerjoin(models.MacAddress)
     query = query.group_by(models.MacAddressRange)
     query = query.order_by("count DESC")
@@ -270,6 +571,40 @@ def mac_address_range_find_allocation_counts(context, address=None):
     return query
 
 
+def mac_address_range_find_next_auto_assign_mac(context, range_id):
+    query = context.session.query(models.MacAddressRange.next_auto_assign_mac)
+    return query.filter(models.MacAddressRange.id == range_id).scalar()
+
+
+def mac_address_range_update_next_auto_assign_mac(context, range_id,
+                                                  expected, value):
+    """Moves the range's cursor from expected to value.
+
+    Returns False, leaving the cursor untouched, when another allocation
+    moved it first.
+    """
+    query = context.session.query(models.MacAddressRange).filter(
+        models.MacAddressRange.id == range_id,
+        models.MacAddressRange.next_auto_assign_mac == expected)
+    updated = query.update({"next_auto_assign_mac": value},
+                           synchronize_session=False)
+    return updated == 1
+
+
+def mac_address_archive(context, before, limit):
+    """Moves up to limit MACs deallocated before `before` to history.
+
+    Returns the number of MAC addresses moved.
+    """
+    columns = ("address", "created_at", "tenant_id", "mac_address_range_id",
+               "deallocated_at")
+    filters = [models.MacAddress.deallocated == 1,
+               models.MacAddress.deallocated_at < before]
+    return len(_archive_rows(context, models.MacAddress,
+                             models.MacAddressHistory, columns, "address",
+                             filters, limit))
+
+
 @scoped
 def mac_address_range_find(context, **filters):
     query = context.session.query(models.MacAddressRange)
@@ -284,6 +619,13 @@ def mac_address_range_create(context, **range_dict):
     return new_range
 
 
+def mac_address_range_has_allocated_macs(context, mac_address_range_id):
+    query = context.session.query(models.MacAddress.address).filter(
+        models.MacAddress.mac_address_range_id == mac_address_range_id,
+        models.MacAddress.deallocated != 1)
+    return _exists(query)
+
+
 def mac_address_range_delete(context, mac_address_range):
     context.session.delete(mac_address_range)
 
@@ -366,15 +708,21 @@ def network_count_all(context):
         scalar()
 
 
+def network_has_ports(context, network_id):
+    query = context.session.query(models.Port.id).filter(
+        models.Port.network_id == network_id)
+    return _exists(query)
+
+
 def network_delete(context, network):
     context.session.delete(network)
 
 
-def subnet_find_allocation_counts(context, net_id, **filters):
-    query = context.session.query(models.Subnet,
-                                  sql_func.count(models.IPAddress.address).
-                                  label("count")).with_lockmode('update')
-    query = query.outerjoin(models.Subnet.generated_ips)
+def _subnet_count_query(context, count, join, net_id, lock_mode, filters):
+    query = context.session.query(models.Subnet, count.label("count"))
+    if lock_mode:
+        query = query.with_lockmode("update")
+    query = query.outerjoin(join)
     query = query.group_by(models.Subnet)
     query = query.order_by("count DESC")
 
@@ -384,6 +732,24 @@ def subnet_find_allocation_counts(context, net_id, **filters):
     return query
 
 
+def subnet_find_allocation_counts(context, net_id, lock_mode=True,
+                                  **filters):
+    """Returns (subnet, addresses ever allocated from it), fullest first.
+
+    Counts are read from the subnet usage rows. Networks with subnets that
+    predate those rows are counted from their addresses instead.
+    """
+    usage = models.SubnetUsage
+    results = _subnet_count_query(
+        context, sql_func.sum(usage.allocated + usage.deallocated),
+        models.Subnet.usage, net_id, lock_mode, filters).all()
+    if all(count is not None for subnet, count in results):
+        return results
+    return _subnet_count_query(
+        context, sql_func.count(models.IPAddress.address),
+        models.Subnet.generated_ips, net_id, lock_mode, filters).all()
+
+
 @scoped
 def subnet_find(context, **filters):
     if "shared" in filters and True in filters["shared"]:
@@ -403,6 +769,50 @@ def subnet_count_all(context, **filters):
     return query.scalar()
 
 
+def subnet_find_next_auto_assign_ip(context, subnet_id):
+    query = context.session.query(models.Subnet.next_auto_assign_ip)
+    return query.filter(models.Subnet.id == subnet_id).scalar()
+
+
+def subnet_update_next_auto_assign_ip(context, subnet_id, expected, value):
+    """Moves the subnet's cursor from expected to value.
+
+    Returns False, leaving the cursor untouched, when another allocation
+    moved it first.
+    """
+    query = context.session.query(models.Subnet).filter(
+        models.Subnet.id == subnet_id,
+        models.Subnet.next_auto_assign_ip == expected)
+    updated = query.update({"next_auto_assign_ip": value},
+                           synchronize_session=False)
+    return updated == 1
+
+
+def subnet_find_overlapping(context, first_ip, last_ip, network_id=None):
+    """Returns (id, cidr, first_ip, last_ip) of subnets touching the range.
+
+    first_ip and last_ip are the IPv6 integers Subnet stores, so the overlap
+    test is a single interval intersection instead of a CIDR per row. The
+    bounds compare exactly and the upper one is a range on the first_ip
+    index.
+    """
+    query = context.session.query(models.Subnet.id, models.Subnet._cidr,
+                                  models.Subnet.first_ip,
+                                  models.Subnet.last_ip)
+    query = query.filter(models.Subnet.first_ip <= last_ip,
+                         models.Subnet.last_ip >= first_ip)
+    if network_id:
+        query = query.filter(models.Subnet.network_id == network_id)
+    return query.all()
+
+
+def subnet_has_allocated_ips(context, subnet_id):
+    query = context.session.query(models.IPAddress.id).filter(
+        models.IPAddress.subnet_id == subnet_id,
+        models.IPAddress._deallocated != 1)
+    return _exists(query)
+
+
 def subnet_delete(context, subnet):
     context.session.delete(subnet)
 
@@ -415,6 +825,44 @@ def subnet_create(context, **subnet_dict):
     return subnet
 
 
+def subnet_usage_find(context, subnet_ids):
+    """Returns subnet_id -> (allocated, deallocated) summed over slots.
+
+    Subnets without usage rows are left out.
+    """
+    if not subnet_ids:
+        return {}
+    usage = models.SubnetUsage
+    query = context.session.query(usage.subnet_id,
+                                  sql_func.sum(usage.allocated),
+                                  sql_func.sum(usage.deallocated))
+    query = query.filter(usage.subnet_id.in_(subnet_ids))
+    query = query.group_by(usage.subnet_id)
+    return dict((subnet_id, (int(allocated), int(deallocated)))
+                for subnet_id, allocated, deallocated in query)
+
+
+def subnet_usage_rebuild(context, subnet_id):
+    """Recounts the subnet's addresses into a fresh set of usage rows."""
+    query = context.session.query(models.IPAddress._deallocated,
+                                  sql_func.count(models.IPAddress.id))
+    query = query.filter(models.IPAddress.subnet_id == subnet_id)
+    query = query.group_by(models.IPAddress._deallocated)
+    allocated = deallocated = 0
+    for is_deallocated, count in query:
+        if is_deallocated:
+            deallocated += count
+        else:
+            allocated += count
+    for slot in xrange(CONF.QUARK.subnet_usage_slots):
+        usage = models.SubnetUsage(subnet_id=subnet_id, slot=slot,
+                                   allocated=0, deallocated=0)
+        if slot == 0:
+            usage.update(dict(allocated=allocated, deallocated=deallocated))
+        context.session.add(usage)
+    return allocated, deallocated
+
+
 def subnet_update(context, subnet, **kwargs):
     subnet.update(kwargs)
     context.session.add(subnet)
@@ -428,6 +876,22 @@ def route_find(context, fields=None, **filters):
     return query.filter(*model_filters)
 
 
+def route_find_overlapping(context, subnet_id, first_ip, last_ip):
+    """Returns (id, first_ip, last_ip) of the subnet's routes in the range.
+
+    Default routes overlap everything and are left out. The bounds are
+    ordered text, so the comparisons are exact.
+    """
+    query = context.session.query(models.Route.id, models.Route.first_ip,
+                                  models.Route.last_ip)
+    model_filters = _model_query(context, models.Route,
+                                 dict(subnet_id=subnet_id))
+    return query.filter(models.Route.first_ip <= last_ip,
+                        models.Route.last_ip >= first_ip,
+                        models.Route.prefix != 0,
+                        *model_filters).all()
+
+
 def route_create(context, **route_dict):
     new_route = models.Route()
     new_route.update(route_dict)
@@ -482,6 +946,13 @@ def security_group_update(context, group, **kwargs):
     return group
 
 
+def security_group_has_ports(context, group_id):
+    association = models.port_group_association_table
+    query = context.session.query(association.c.port_id).filter(
+        association.c.group_id == group_id)
+    return _exists(query)
+
+
 def security_group_delete(context, group):
     context.session.delete(group)
 
@@ -541,5 +1012,112 @@ def ip_policy_update(context, ip_policy, **ip_policy_dict):
     return ip_policy
 
 
+def ip_policy_in_use(context, ip_policy_id):
+    """Whether any network or subnet uses the policy."""
+    for model in (models.Network, models.Subnet):
+        query = context.session.query(model.id).filter(
+            model.ip_policy_id == ip_policy_id)
+        if _exists(query):
+            return True
+    return False
+
+
 def ip_policy_delete(context, ip_policy):
     context.session.delete(ip_policy)
+
+
+def _quota_usage_count(context, resource, scope_ids):
+    column = QUOTA_USAGE_SCOPES[resource]
+    query = context.session.query(column, sql_func.count(column))
+    query = query.filter(column.in_(scope_ids)).group_by(column)
+    return dict(query.all())
+
+
+def quota_usage_find(context, resource, scope_id, lock_mode=False):
+    query = context.session.query(models.QuotaUsage).filter_by(
+        resource=resource, scope_id=scope_id)
+    if lock_mode:
+        query = query.with_lockmode("update")
+    return query.first()
+
+
+def quota_usage_create(context, resource, scope_id, tenant_id):
+    """Counts what scope_id holds of resource into a new usage row."""
+    in_use = _quota_usage_count(context, resource, [scope_id])
+    usage = models.QuotaUsage(resource=resource, scope_id=scope_id,
+                              tenant_id=tenant_id,
+                              in_use=in_use.get(scope_id, 0), reserved=0)
+    context.session.add(usage)
+    return usage
+
+
+def quota_usage_find_for_update(context, resource, scope_id, tenant_id):
+    """Returns the usage row of resource in scope_id, locked for update.
+
+    A missing row is inserted before anything is locked. A locking read
+    that finds nothing takes a gap lock on InnoDB, which the inserts of
+    racing requests would deadlock on.
+    """
+    exists = context.session.query(models.QuotaUsage.id).filter_by(
+        resource=resource, scope_id=scope_id).first()
+    if not exists:
+        try:
+            with context.session.begin_nested():
+                quota_usage_create(context, resource, scope_id, tenant_id)
+        except db_exception.DBDuplicateEntry:
+            # Another request counted it first
+            pass
+    return quota_usage_find(context, resource, scope_id, lock_mode=True)
+
+
+def quota_usage_refresh(context, resource):
+    """Recounts in_use of every usage row of resource in one query."""
+    usages = context.session.query(models.QuotaUsage).filter_by(
+        resource=resource).with_lockmode("update").all()
+    if not usages:
+        return 0
+    counts = _quota_usage_count(context, resource,
+                                [usage.scope_id for usage in usages])
+    for usage in usages:
+        in_use = counts.get(usage.scope_id, 0)
+        if usage.in_use != in_use:
+            LOG.info("Quota usage of %s in %s drifted from %d to %d" %
+                     (resource, usage.scope_id, usage.in_use, in_use))
+            usage.in_use = in_use
+    return len(usages)
+
+
+def quota_reservation_create(context, usage, delta, expires_at):
+    reservation = models.QuotaReservation(delta=delta, expires_at=expires_at)
+    usage.reserved += delta
+    usage.reservations.append(reservation)
+    context.session.add(reservation)
+    return reservation
+
+
+def quota_reservation_find_expired(context, now, usage_id=None):
+    query = context.session.query(models.QuotaReservation)
+    if usage_id:
+        query = query.filter(models.QuotaReservation.usage_id == usage_id)
+    return query.filter(models.QuotaReservation.expires_at <= now).all()
+
+
+def quota_reservation_delete(context, reservation_id):
+    """Gives back what the reservation held.
+
+    Returns False if it was released already. The usage row is locked
+    before the reservation, in the order quota checks take them.
+    """
+    query = context.session.query(models.QuotaReservation).filter_by(
+        id=reservation_id)
+    reservation = query.first()
+    if not reservation:
+        return False
+    usage = context.session.query(models.QuotaUsage).filter_by(
+        id=reservation.usage_id).with_lockmode("update").one()
+    reservation = query.with_lockmode("update").first()
+    if not reservation:
+        return False
+    usage.reserved -= reservation.delta
+    context.session.delete(reservation)
+    return True
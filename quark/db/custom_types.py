@@ -31,7 +31,8 @@ class INET(types.TypeDecorator):
             return value
 
         if dialect.name == 'sqlite':
-            return str(value)
+            # Zero padded so CHAR comparisons order like the integers
+            return str(value).zfill(39)
 
         return value
 
@@ -45,6 +46,29 @@ class INET(types.TypeDecorator):
         return value
 
 
+class OrderedINET(types.TypeDecorator):
+    """An IP stored as 39 zero padded digits on every backend.
+
+    INET is a BLOB on MySQL, which compares with integers as a double.
+    This text orders like the integers, so range comparisons are exact
+    and a plain index serves them.
+    """
+    impl = types.CHAR
+
+    def __init__(self):
+        super(OrderedINET, self).__init__(39)
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return value
+        return str(long(value)).zfill(39)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return value
+        return long(value)
+
+
 class MACAddress(types.TypeDecorator):
     impl = types.BigInteger
 
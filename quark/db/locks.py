@@ -0,0 +1,182 @@
+# Copyright 2013 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Named advisory locks around IPAM cursor advances
+
+The advisory allocation mode serializes the advance of each subnet and MAC
+range cursor on a lock named after it, rather than on row locks over every
+subnet of a network, so allocations from different subnets do not wait on
+one another. Every cursor update still compares and swaps, which keeps
+the cursors correct should a lock be lost or the manager only cover one
+process.
+
+Managers run the advancing transaction themselves and let go of the lock
+only once it committed, so the next holder always reads the new cursor.
+"""
+
+import contextlib
+import threading
+
+from neutron.common import exceptions
+from neutron.openstack.common.db import exception as db_exception
+from neutron.openstack.common import log as logging
+from oslo.config import cfg
+import sqlalchemy as sa
+
+from quark.db import models
+
+LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
+
+quark_opts = [
+    cfg.StrOpt('ipam_lock_driver',
+               default='table',
+               help=_("Lock manager of the advisory allocation mode. "
+                      "'mysql' uses GET_LOCK, 'table' row locks in "
+                      "quark_locks and 'local' locks of this process only, "
+                      "for SQLite and tests")),
+    cfg.IntOpt('ipam_lock_timeout',
+               default=10,
+               help=_("Seconds to wait on a MySQL advisory lock"))
+]
+CONF.register_opts(quark_opts, "QUARK")
+
+
+def subnet_lock_name(subnet_id):
+    return "quark_subnet_%s" % subnet_id
+
+
+def mac_range_lock_name(range_id):
+    return "quark_mac_range_%s" % range_id
+
+
+class LocalLockManager(object):
+    """Locks shared by the threads of this process only."""
+    @classmethod
+    def get_name(klass):
+        return "local"
+
+    def __init__(self):
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def begin(self, context, name):
+        with self._lock:
+            named_lock = self._locks.setdefault(name, threading.Lock())
+        with named_lock:
+            with context.session.begin():
+                yield
+
+
+class MySQLLockManager(object):
+    """MySQL user level locks.
+
+    GET_LOCK belongs to the connection that took it, so it is taken on a
+    connection of its own which outlives the transaction's.
+    """
+    @classmethod
+    def get_name(klass):
+        return "mysql"
+
+    @contextlib.contextmanager
+    def begin(self, context, name):
+        connection = context.session.get_bind().connect()
+        try:
+            acquired = connection.execute(
+                sa.text("SELECT GET_LOCK(:name, :timeout)"),
+                name=name, timeout=CONF.QUARK.ipam_lock_timeout).scalar()
+            if acquired != 1:
+                LOG.warning("Timed out waiting on lock %s" % name)
+                raise exceptions.Conflict()
+            try:
+                with context.session.begin():
+                    yield
+            finally:
+                connection.execute(sa.text("SELECT RELEASE_LOCK(:name)"),
+                                   name=name)
+        finally:
+            connection.close()
+
+
+class TableLockManager(object):
+    """Row locks on quark_locks, which the commit releases.
+
+    The rows are inserted along with the subnet or MAC range they are
+    named after. Older ones get theirs on first use, committed on its own
+    before the row is locked, so no transaction inserts while holding the
+    gap lock of a missed SELECT ... FOR UPDATE.
+    """
+    @classmethod
+    def get_name(klass):
+        return "table"
+
+    def _find(self, context, name):
+        query = context.session.query(models.Lock).with_lockmode("update")
+        return query.filter(models.Lock.name == name).first()
+
+    def _exists(self, context, name):
+        query = context.session.query(models.Lock.name)
+        return query.filter(models.Lock.name == name).first() is not None
+
+    @contextlib.contextmanager
+    def begin(self, context, name):
+        if not self._exists(context, name):
+            try:
+                with context.session.begin():
+                    context.session.add(models.Lock(name=name))
+            except db_exception.DBDuplicateEntry:
+                pass
+        with context.session.begin():
+            self._find(context, name)
+            yield
+
+
+class LockManagerRegistry(object):
+    def __init__(self):
+        self.managers = {
+            LocalLockManager.get_name(): LocalLockManager,
+            MySQLLockManager.get_name(): MySQLLockManager,
+            TableLockManager.get_name(): TableLockManager}
+
+    def get_manager(self, name):
+        if name not in self.managers:
+            raise exceptions.InvalidInput(
+                error_message="Unknown lock manager %s" % name)
+        return self.managers[name]()
+
+
+LOCK_MANAGER_REGISTRY = LockManagerRegistry()
+
+_LOCK_MANAGER = None
+_LOCK_MANAGER_LOCK = threading.Lock()
+
+
+def get_lock_manager():
+    """Returns the configured lock manager, built on first use."""
+    global _LOCK_MANAGER
+    if _LOCK_MANAGER is None:
+        with _LOCK_MANAGER_LOCK:
+            if _LOCK_MANAGER is None:
+                _LOCK_MANAGER = LOCK_MANAGER_REGISTRY.get_manager(
+                    CONF.QUARK.ipam_lock_driver)
+    return _LOCK_MANAGER
+
+
+def reset():
+    global _LOCK_MANAGER
+    with _LOCK_MANAGER_LOCK:
+        _LOCK_MANAGER = None
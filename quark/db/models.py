@@ -30,6 +30,7 @@ from neutron.openstack.common import timeutils
 from oslo.config import cfg
 
 from quark.db import custom_types
+from quark import formatters
 
 import json
 
@@ -41,7 +42,11 @@ CONF = cfg.CONF
 quark_opts = [
     cfg.StrOpt('default_ip_policy',
                default='{"exclude": [{"offset": -1, "length": 3}]}',
-               help=_("Default IP allocation policy"))
+               help=_("Default IP allocation policy")),
+    cfg.IntOpt('subnet_usage_slots',
+               default=8,
+               help=_("Rows each subnet's IP address counts are spread "
+                      "over"))
 ]
 CONF.register_opts(quark_opts, "QUARK")
 
@@ -136,7 +141,10 @@ class IPAddress(BASEV2, models.HasId):
     allocated_at = sa.Column(sa.DateTime())
     subnet = orm.relationship("Subnet", lazy="joined")
     # Need a constant to facilitate the indexed search for new IPs
-    _deallocated = sa.Column(sa.Boolean())
+    # NOTE(quark): active history loads the old value on change, which the
+    #              subnet usage counts need to see at flush
+    _deallocated = orm.column_property(sa.Column(sa.Boolean()),
+                                       active_history=True)
     # Legacy data
     used_by_tenant_id = sa.Column(sa.String(255))
 
@@ -158,20 +166,111 @@ class IPAddress(BASEV2, models.HasId):
         return IPAddress._deallocated
 
     def formatted(self):
-        ip = netaddr.IPAddress(self.address_readable)
-        if self.version == 4:
-            return str(ip.ipv4())
-        return str(ip.ipv6())
+        version = 4 if self.version == 4 else 6
+        if self.address is None:
+            return formatters.format_ip(self.address_readable, version)
+        return formatters.format_ip(self.address, version)
 
     deallocated_at = sa.Column(sa.DateTime())
 
+# NOTE(quark): address is a BLOB on MySQL, which is only indexed by a prefix.
+#              39 bytes hold the decimal text of any address, so the prefix
+#              is the whole value. address_readable is not unique per
+#              address, IPv6 has several spellings of each.
+_NETWORK_ADDRESS_INDEX = ("CREATE UNIQUE INDEX "
+                          "idx_ip_addresses_network_address "
+                          "ON quark_ip_addresses (network_id, address%s)")
+
+
+def _not_mysql(ddl, target, bind, **kwargs):
+    return bind.dialect.name != "mysql"
+
+
+sa.event.listen(IPAddress.__table__, "after_create",
+                sa.DDL(_NETWORK_ADDRESS_INDEX % "(39)").execute_if(
+                    dialect="mysql"))
+sa.event.listen(IPAddress.__table__, "after_create",
+                sa.DDL(_NETWORK_ADDRESS_INDEX % "").execute_if(
+                    callable_=_not_mysql))
+sa.Index("idx_ip_addresses_subnet_deallocated",
+         IPAddress.__table__.c.subnet_id,
+         IPAddress.__table__.c._deallocated,
+         IPAddress.__table__.c.deallocated_at)
+
+
+class IPAddressReservation(BASEV2, models.HasId):
+    """An address an API worker set aside to hand out from memory."""
+    __tablename__ = "quark_ip_address_reservations"
+    subnet_id = sa.Column(sa.String(36),
+                          sa.ForeignKey("quark_subnets.id",
+                                        ondelete="CASCADE"),
+                          nullable=False)
+    address = sa.Column(sa.String(64), nullable=False)
+    owner = sa.Column(sa.String(255), nullable=False, index=True)
+    expires_at = sa.Column(sa.DateTime(), nullable=False, index=True)
+
+sa.Index("idx_ip_address_reservations_subnet_address",
+         IPAddressReservation.__table__.c.subnet_id,
+         IPAddressReservation.__table__.c.address,
+         unique=True)
+
+
+class Lock(BASEV2):
+    """A name the table lock manager takes row locks on."""
+    __tablename__ = "quark_locks"
+    name = sa.Column(sa.String(255), primary_key=True)
+
+
+class SubnetUsage(BASEV2, models.HasId):
+    """One slot of a subnet's running IP address counts.
+
+    Allocations bump a random slot of their subnet, so concurrent writers
+    rarely wait on the same row. A subnet's counts are the sum of its
+    slots.
+    """
+    __tablename__ = "quark_subnet_usage"
+    subnet_id = sa.Column(sa.String(36),
+                          sa.ForeignKey("quark_subnets.id",
+                                        ondelete="CASCADE"),
+                          nullable=False)
+    slot = sa.Column(sa.Integer(), nullable=False)
+    allocated = sa.Column(sa.Integer(), nullable=False, default=0)
+    deallocated = sa.Column(sa.Integer(), nullable=False, default=0)
+
+sa.Index("idx_subnet_usage_subnet_slot",
+         SubnetUsage.__table__.c.subnet_id,
+         SubnetUsage.__table__.c.slot,
+         unique=True)
+
 
 class Route(BASEV2, models.HasTenant, models.HasId, IsHazTags):
     __tablename__ = "quark_routes"
-    cidr = sa.Column(sa.String(64))
+    _cidr = sa.Column("cidr", sa.String(64))
     gateway = sa.Column(sa.String(64))
     subnet_id = sa.Column(sa.String(36), sa.ForeignKey("quark_subnets.id",
                                                        ondelete="CASCADE"))
+    # Bounds of cidr, IPv4 mapped into IPv6 like the subnet ones, so
+    # conflicts and the default route are found without parsing cidr
+    first_ip = sa.Column(custom_types.OrderedINET())
+    last_ip = sa.Column(custom_types.OrderedINET())
+    prefix = sa.Column(sa.Integer())
+
+    @hybrid.hybrid_property
+    def cidr(self):
+        return self._cidr
+
+    @cidr.setter
+    def cidr(self, val):
+        self._cidr = val
+        preip = netaddr.IPNetwork(val)
+        self.prefix = preip.prefixlen
+        ip = preip.ipv6()
+        self.first_ip = ip.first
+        self.last_ip = ip.last
+
+    @cidr.expression
+    def cidr(cls):
+        return Route._cidr
 
 
 class DNSNameserver(BASEV2, models.HasTenant, models.HasId, IsHazTags):
@@ -220,8 +319,8 @@ class Subnet(BASEV2, models.HasId, IsHazTags):
     def cidr(cls):
         return Subnet._cidr
 
-    first_ip = sa.Column(custom_types.INET())
-    last_ip = sa.Column(custom_types.INET())
+    first_ip = sa.Column(custom_types.OrderedINET())
+    last_ip = sa.Column(custom_types.OrderedINET())
     ip_version = sa.Column(sa.Integer())
     next_auto_assign_ip = sa.Column(custom_types.INET())
 
@@ -242,9 +341,14 @@ class Subnet(BASEV2, models.HasId, IsHazTags):
         cascade='delete')
     ip_policy_id = sa.Column(sa.String(36),
                              sa.ForeignKey("quark_ip_policy.id"))
+    usage = orm.relationship(SubnetUsage,
+                             primaryjoin="SubnetUsage.subnet_id==Subnet.id",
+                             cascade="delete")
     # Legacy data
     do_not_use = sa.Column(sa.Boolean(), default=False)
 
+sa.Index("idx_subnets_first_ip", Subnet.__table__.c.first_ip)
+
 port_ip_association_table = sa.Table(
     "quark_port_ip_address_associations",
     BASEV2.metadata,
@@ -343,6 +447,65 @@ class MacAddress(BASEV2, models.HasTenant):
     orm.relationship(Port, backref="mac_address")
 
 
+class IPAddressEvent(BASEV2):
+    """Append-only log of IP address allocations and deallocations.
+
+    Answers who held an address when, without reading
+    quark_ip_addresses. Rows are keyed by occurred_at so the table can be
+    range partitioned on it.
+    """
+    __tablename__ = "quark_ip_address_events"
+    id = sa.Column(sa.Integer(), primary_key=True, autoincrement=True)
+    event = sa.Column(sa.String(16), nullable=False)
+    address_readable = sa.Column(sa.String(128), nullable=False)
+    ip_address_id = sa.Column(sa.String(36))
+    subnet_id = sa.Column(sa.String(36))
+    network_id = sa.Column(sa.String(36))
+    tenant_id = sa.Column(sa.String(255))
+    port_id = sa.Column(sa.String(36))
+    device_id = sa.Column(sa.String(255))
+    occurred_at = sa.Column(sa.DateTime(), nullable=False)
+
+sa.Index("idx_ip_address_events_network_address_occurred_at",
+         IPAddressEvent.__table__.c.network_id,
+         IPAddressEvent.__table__.c.address_readable,
+         IPAddressEvent.__table__.c.occurred_at)
+
+
+class IPAddressHistory(BASEV2):
+    """IP addresses moved out of quark_ip_addresses by quark.archiver.
+
+    Rows are only ever appended, keyed by archived_at, so the table can be
+    range partitioned on it.
+    """
+    __tablename__ = "quark_ip_addresses_history"
+    id = sa.Column(sa.String(36), primary_key=True)
+    address_readable = sa.Column(sa.String(128), nullable=False)
+    address = sa.Column(custom_types.INET(), nullable=False)
+    subnet_id = sa.Column(sa.String(36), index=True)
+    network_id = sa.Column(sa.String(36))
+    version = sa.Column(sa.Integer())
+    used_by_tenant_id = sa.Column(sa.String(255))
+    allocated_at = sa.Column(sa.DateTime())
+    deallocated_at = sa.Column(sa.DateTime())
+    archived_at = sa.Column(sa.DateTime(), nullable=False, index=True)
+
+sa.Index("idx_ip_addresses_history_network_address",
+         IPAddressHistory.__table__.c.network_id,
+         IPAddressHistory.__table__.c.address_readable)
+
+
+class MacAddressHistory(BASEV2):
+    """MAC addresses moved out of quark_mac_addresses by quark.archiver."""
+    __tablename__ = "quark_mac_addresses_history"
+    id = sa.Column(sa.Integer(), primary_key=True, autoincrement=True)
+    address = sa.Column(sa.BigInteger(), nullable=False, index=True)
+    tenant_id = sa.Column(sa.String(255))
+    mac_address_range_id = sa.Column(sa.String(36))
+    deallocated_at = sa.Column(sa.DateTime())
+    archived_at = sa.Column(sa.DateTime(), nullable=False, index=True)
+
+
 class MacAddressRange(BASEV2, models.HasId):
     __tablename__ = "quark_mac_address_ranges"
     cidr = sa.Column(sa.String(255), nullable=False)
@@ -374,15 +537,22 @@ class IPPolicy(BASEV2, models.HasId, models.HasTenant):
     description = sa.Column(sa.String(255), nullable=True)
 
     class JSONIPPolicy(object):
+        """Parsed on first use, so default_ip_policy comes from the config
+        files rather than whatever CONF held when this module was imported.
+        """
         def __init__(self, policy=None):
-            self.policy = {}
-            if not policy:
-                self._compile_policy(CONF.QUARK.default_ip_policy)
-            else:
-                self._compile_policy(policy)
+            self._source = policy
+            self._policy = None
+
+        @property
+        def policy(self):
+            if self._policy is None:
+                self._policy = self._compile_policy(
+                    self._source or CONF.QUARK.default_ip_policy)
+            return self._policy
 
         def _compile_policy(self, policy):
-            self.policy = json.loads(policy)
+            return json.loads(policy)
 
         def __getattr__(self, name):
             return getattr(self.policy, name)
@@ -436,5 +606,38 @@ class Network(BASEV2, models.HasId):
                              sa.ForeignKey("quark_ip_policy.id"))
     network_plugin = sa.Column(sa.String(36))
     ipam_strategy = sa.Column(sa.String(255))
+    subnet_selection = sa.Column(sa.String(255))
     max_allocation = sa.Column(sa.Integer())
     tenant_id = sa.Column(sa.String(255), index=True)
+
+
+class QuotaUsage(BASEV2, models.HasId, models.HasTenant):
+    """What a scope currently holds of a quota resource.
+
+    The scope is the network for ports_per_network, the security group for
+    security_rules_per_group and the tenant for networks and subnets.
+    in_use follows the counted rows as they are flushed, reserved is what
+    open reservations are holding on top of it.
+    """
+    __tablename__ = "quark_quota_usages"
+    resource = sa.Column(sa.String(255), nullable=False)
+    scope_id = sa.Column(sa.String(255), nullable=False)
+    in_use = sa.Column(sa.Integer(), nullable=False, default=0)
+    reserved = sa.Column(sa.Integer(), nullable=False, default=0)
+    reservations = orm.relationship("QuotaReservation", backref="usage",
+                                    cascade="delete")
+
+sa.Index("idx_quota_usages_resource_scope",
+         QuotaUsage.__table__.c.resource,
+         QuotaUsage.__table__.c.scope_id,
+         unique=True)
+
+
+class QuotaReservation(BASEV2, models.HasId):
+    __tablename__ = "quark_quota_reservations"
+    usage_id = sa.Column(sa.String(36),
+                         sa.ForeignKey("quark_quota_usages.id",
+                                       ondelete="CASCADE"),
+                         nullable=False)
+    delta = sa.Column(sa.Integer(), nullable=False)
+    expires_at = sa.Column(sa.DateTime(), nullable=False, index=True)
@@ -0,0 +1,100 @@
+# Copyright 2013 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Read replica session routing for Quark
+"""
+
+import time
+
+from neutron.openstack.common.db.sqlalchemy import session as neutron_session
+from neutron.openstack.common import log as logging
+from oslo.config import cfg
+
+LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
+
+quark_opts = [
+    cfg.StrOpt('read_replica_connection',
+               default=None,
+               help=_("SQLAlchemy connection string of a read-only database "
+                      "replica. List and diagnostics calls are routed to it "
+                      "when set.")),
+    cfg.IntOpt('read_replica_sticky_seconds',
+               default=0,
+               help=_("Seconds after a tenant's write during which that "
+                      "tenant's reads stay on the primary database. 0 "
+                      "disables read-your-writes stickiness."))
+]
+CONF.register_opts(quark_opts, "QUARK")
+
+_ENGINE = None
+_MAKER = None
+
+# NOTE(quark): tenant_id -> time of the last write made through this
+#              process. Stickiness is per API worker, which is enough to
+#              give a client its own writes back when it is pinned to a
+#              worker by a keepalive connection.
+_LAST_WRITE = {}
+
+
+def is_enabled():
+    return bool(CONF.QUARK.read_replica_connection)
+
+
+def get_engine():
+    global _ENGINE
+    if _ENGINE is None:
+        LOG.info("Creating read replica engine")
+        _ENGINE = neutron_session.create_engine(
+            CONF.QUARK.read_replica_connection)
+    return _ENGINE
+
+
+def get_session():
+    global _MAKER
+    if _MAKER is None:
+        _MAKER = neutron_session.get_maker(get_engine())
+    return _MAKER()
+
+
+def reset_pool():
+    """Forgets pooled connections, e.g. ones inherited across a fork."""
+    if _ENGINE is not None:
+        _ENGINE.pool = _ENGINE.pool.recreate()
+
+
+def record_write(context):
+    if CONF.QUARK.read_replica_sticky_seconds <= 0:
+        return
+    if context.tenant_id:
+        _LAST_WRITE[context.tenant_id] = time.time()
+
+
+def should_use_replica(context):
+    if not is_enabled():
+        return False
+
+    window = CONF.QUARK.read_replica_sticky_seconds
+    if window <= 0:
+        return True
+
+    last_write = _LAST_WRITE.get(context.tenant_id)
+    if last_write is None:
+        return True
+    if time.time() - last_write < window:
+        return False
+    _LAST_WRITE.pop(context.tenant_id, None)
+    return True
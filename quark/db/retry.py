@@ -0,0 +1,124 @@
+# Copyright 2013 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Replays transactions that lost a lock race
+
+InnoDB breaks a deadlock by rolling back one of the transactions in it,
+and gives up on a row lock after innodb_lock_wait_timeout. Either way the
+transaction only ran at a bad time, so the allocating calls are replayed
+after a jittered backoff instead of failing the request.
+"""
+
+import copy
+import random
+import threading
+import time
+
+from neutron.openstack.common.db import exception as db_exception
+from neutron.openstack.common import log as logging
+from oslo.config import cfg
+
+LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
+
+quark_opts = [
+    cfg.IntOpt('db_lock_retries',
+               default=5,
+               help=_("Times a transaction that deadlocked or timed out "
+                      "waiting for a lock is replayed. 0 disables "
+                      "replaying")),
+    cfg.FloatOpt('db_lock_retry_interval',
+                 default=0.05,
+                 help=_("Upper bound in seconds of the first random wait "
+                        "before a replay, doubled for each one after")),
+    cfg.FloatOpt('db_lock_retry_max_interval',
+                 default=1.0,
+                 help=_("Upper bound in seconds of any wait before a "
+                        "replay"))
+]
+CONF.register_opts(quark_opts, "QUARK")
+
+# NOTE(quark): MySQL's ER_LOCK_WAIT_TIMEOUT and ER_LOCK_DEADLOCK
+_LOCK_ERROR_CODES = (1205, 1213)
+_LOCK_ERROR_MESSAGES = ("Deadlock found", "Lock wait timeout exceeded")
+
+STATS = {"retried": 0, "exhausted": 0}
+_STATS_LOCK = threading.Lock()
+
+
+def _count(stat, value=1):
+    with _STATS_LOCK:
+        STATS[stat] += value
+
+
+def get_stats():
+    with _STATS_LOCK:
+        return dict(STATS)
+
+
+def is_lock_error(error):
+    """Whether error is a deadlock or lock wait timeout, however wrapped."""
+    deadlock = getattr(db_exception, "DBDeadlock", None)
+    if deadlock is not None and isinstance(error, deadlock):
+        return True
+    # NOTE(quark): DBError keeps the SQLAlchemy error, which keeps the
+    #              DBAPI one
+    error = getattr(error, "inner_exception", None) or error
+    error = getattr(error, "orig", None) or error
+    args = getattr(error, "args", ())
+    if args and args[0] in _LOCK_ERROR_CODES:
+        return True
+    message = str(error)
+    return any(m in message for m in _LOCK_ERROR_MESSAGES)
+
+
+def _backoff(attempt):
+    interval = min(CONF.QUARK.db_lock_retry_interval * 2 ** (attempt - 1),
+                   CONF.QUARK.db_lock_retry_max_interval)
+    return random.uniform(0, interval)
+
+
+def retry_on_lock_error(func):
+    """Replays func on lock errors. func must run its own transaction.
+
+    Calls made inside a caller's transaction are not replayed, since the
+    rollback undid the caller's work as well. Each replay gets a copy of
+    the original arguments, as the plugin functions pop from the request
+    bodies they are handed.
+    """
+    def _wrapped(context, *args, **kwargs):
+        retries = CONF.QUARK.db_lock_retries
+        if retries <= 0 or context.session.transaction is not None:
+            return func(context, *args, **kwargs)
+
+        pristine = copy.deepcopy((args, kwargs))
+        attempt = 0
+        while True:
+            try:
+                return func(context, *args, **kwargs)
+            except Exception as e:
+                if not is_lock_error(e):
+                    raise
+                if attempt >= retries:
+                    _count("exhausted")
+                    raise
+                attempt += 1
+                _count("retried")
+                LOG.warn("Replaying %s after lock error, attempt %d of %d: "
+                         "%s" % (func.__name__, attempt, retries, e))
+                time.sleep(_backoff(attempt))
+                args, kwargs = copy.deepcopy(pristine)
+    return _wrapped
@@ -36,6 +36,9 @@ class BaseDriver(object):
     def get_connection(self):
         LOG.info("get_connection")
 
+    def reset_connections(self):
+        LOG.info("reset_connections")
+
     def create_network(self, context, network_name, tags=None,
                        network_id=None, **kwargs):
         LOG.info("create_network %s %s %s" % (context, network_name,
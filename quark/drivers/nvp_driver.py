@@ -121,6 +121,14 @@ class NVPDriver(base.BaseDriver):
                                                        password=passwd)
         return conn["connection"]
 
+    def reset_connections(self):
+        """Drops the cached connections, e.g. ones inherited across a fork.
+
+        They are reopened on their next use.
+        """
+        for conn in self.nvp_connections:
+            conn.pop("connection", None)
+
     def create_network(self, context, network_name, tags=None,
                        network_id=None, **kwargs):
         return self._lswitch_create(context, network_name, tags,
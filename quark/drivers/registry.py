@@ -13,22 +13,54 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import threading
+
+import pkg_resources
+
 from quark.drivers import base
 from quark.drivers import optimized_nvp_driver as optnvp
 from quark.drivers import unmanaged
 
+# NOTE(quark): further drivers can be registered by other packages under
+#              this entry point group, named as their get_name()
+ENTRY_POINT_GROUP = "quark.drivers"
+
 
 class DriverRegistry(object):
+    """Maps network_plugin names to drivers, built on first use.
+
+    Constructing a driver reads its configuration, so only the backends a
+    process actually uses pay for it.
+    """
     def __init__(self):
-        self.drivers = {
-            base.BaseDriver.get_name(): base.BaseDriver(),
-            optnvp.OptimizedNVPDriver.get_name(): optnvp.OptimizedNVPDriver(),
-            unmanaged.UnmanagedDriver.get_name(): unmanaged.UnmanagedDriver()}
+        self.driver_classes = dict(
+            (klass.get_name(), klass)
+            for klass in (base.BaseDriver, optnvp.OptimizedNVPDriver,
+                          unmanaged.UnmanagedDriver))
+        self.drivers = {}
+        self._lock = threading.Lock()
 
-    def get_driver(self, driver_name):
-        if driver_name in self.drivers:
-            return self.drivers[driver_name]
+    def _find_driver_class(self, driver_name):
+        if driver_name in self.driver_classes:
+            return self.driver_classes[driver_name]
+        for entry_point in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP,
+                                                           driver_name):
+            return entry_point.load()
         raise Exception("Driver %s is not registered." % driver_name)
 
+    def get_driver(self, driver_name):
+        driver = self.drivers.get(driver_name)
+        if driver is None:
+            with self._lock:
+                driver = self.drivers.get(driver_name)
+                if driver is None:
+                    driver = self._find_driver_class(driver_name)()
+                    self.drivers[driver_name] = driver
+        return driver
+
+    def reset_connections(self):
+        for driver in self.drivers.values():
+            driver.reset_connections()
+
 
 DRIVER_REGISTRY = DriverRegistry()
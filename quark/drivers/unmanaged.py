@@ -39,6 +39,9 @@ class UnmanagedDriver(object):
     def get_connection(self):
         LOG.info("get_connection")
 
+    def reset_connections(self):
+        LOG.info("reset_connections")
+
     def create_network(self, context, network_name, tags=None,
                        network_id=None, **kwargs):
         LOG.info("create_network %s %s %s" % (context, network_name,
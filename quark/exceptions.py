@@ -57,6 +57,10 @@ class InvalidIpamStrategy(exceptions.BadRequest):
     message = _("IPAM Strategy %(strat)s is invalid.")
 
 
+class InvalidSubnetSelection(exceptions.BadRequest):
+    message = _("Subnet selection policy %(policy)s is invalid.")
+
+
 class ProvidernetParamError(exceptions.NeutronException):
     message = _("%(msg)s")
 
@@ -0,0 +1,170 @@
+# Copyright 2013 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Per-worker IP address leases for Quark
+
+Each API worker reserves a few free addresses of the subnets it allocates
+from and hands them out from memory, so a burst of allocations costs one
+insert each. Reservations are rows in quark_ip_address_reservations owned
+by host:pid. They are released when the worker exits and swept by any
+worker once they expire.
+"""
+
+import atexit
+import collections
+import datetime
+import os
+import socket
+import threading
+
+from neutron import context as neutron_context
+from neutron.openstack.common.db import exception as db_exception
+from neutron.openstack.common import log as logging
+from neutron.openstack.common import timeutils
+from oslo.config import cfg
+
+from quark.db import api as db_api
+from quark import utils
+
+LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
+
+quark_opts = [
+    cfg.IntOpt('ipam_lease_size',
+               default=0,
+               help=_("Free addresses an API worker reserves per subnet to "
+                      "hand out from memory. 0 disables leases")),
+    cfg.IntOpt('ipam_lease_ttl',
+               default=300,
+               help=_("Seconds an unused lease stays reserved"))
+]
+CONF.register_opts(quark_opts, "QUARK")
+
+
+def is_enabled():
+    return CONF.QUARK.ipam_lease_size > 0
+
+
+def get_owner():
+    return "%s:%d" % (socket.gethostname(), os.getpid())
+
+
+class LeasePool(object):
+    def __init__(self):
+        # NOTE(quark): subnet_id -> deque of (address, expires_at)
+        self._leases = {}
+        # NOTE(quark): subnet_id -> dict of id, network_id and ip_version
+        self._subnets = {}
+        self._lock = threading.Lock()
+        self._release_registered = False
+
+    def take(self, subnet_id):
+        """Pops an unexpired lease of the subnet, or None."""
+        now = timeutils.utcnow()
+        with self._lock:
+            leases = self._leases.get(subnet_id)
+            while leases:
+                address, expires_at = leases.popleft()
+                if expires_at > now:
+                    return address
+        return None
+
+    def take_from_network(self, network_id, version=None):
+        """Pops an unexpired lease of any subnet of the network leased
+        before, restricted to one IP version if given.
+
+        Returns (subnet, address), subnet carrying only id, network_id and
+        ip_version, or None.
+        """
+        with self._lock:
+            subnets = [subnet for subnet in self._subnets.values()
+                       if subnet["network_id"] == network_id and
+                       (not version or subnet["ip_version"] == version)]
+        for subnet in subnets:
+            address = self.take(subnet["id"])
+            if address is not None:
+                return subnet, address
+        return None
+
+    def add(self, subnet_id, addresses, expires_at):
+        with self._lock:
+            leases = self._leases.setdefault(subnet_id, collections.deque())
+            leases.extend([(address, expires_at) for address in addresses])
+
+    def clear(self):
+        with self._lock:
+            self._leases.clear()
+            self._subnets.clear()
+
+    def refill(self, context, subnet, candidates):
+        """Reserves the candidates that are neither allocated nor reserved.
+
+        Runs in its own transaction, sweeping expired reservations on the
+        way. Returns the number of leases added.
+        """
+        now = timeutils.utcnow()
+        expires_at = now + datetime.timedelta(
+            seconds=CONF.QUARK.ipam_lease_ttl)
+        lease_context = utils.detached_context(context)
+        try:
+            with lease_context.session.begin():
+                db_api.ip_address_reservation_delete_all(lease_context,
+                                                         expired_at=now)
+                taken = db_api.ip_address_find_taken(
+                    lease_context, subnet["network_id"], subnet["id"],
+                    [str(address) for address in candidates])
+                free = [address for address in candidates
+                        if str(address) not in taken]
+                owner = get_owner()
+                for address in free:
+                    db_api.ip_address_reservation_create(
+                        lease_context, subnet_id=subnet["id"],
+                        address=str(address), owner=owner,
+                        expires_at=expires_at)
+        except db_exception.DBDuplicateEntry:
+            LOG.debug("Lost a lease race on subnet %s" % subnet["id"])
+            return 0
+        finally:
+            lease_context.session.close()
+
+        with self._lock:
+            self._subnets[subnet["id"]] = dict(
+                id=subnet["id"], network_id=subnet["network_id"],
+                ip_version=subnet["ip_version"])
+        self.add(subnet["id"], free, expires_at)
+        self._register_release()
+        return len(free)
+
+    def _register_release(self):
+        if not self._release_registered:
+            self._release_registered = True
+            atexit.register(self.release)
+
+    def release(self):
+        """Returns this worker's unused leases to the pool."""
+        self.clear()
+        context = neutron_context.get_admin_context()
+        try:
+            with context.session.begin():
+                db_api.ip_address_reservation_delete_all(context,
+                                                         owner=get_owner())
+        except Exception:
+            LOG.exception("Failed to release IP address leases")
+        finally:
+            context.session.close()
+
+
+LEASES = LeasePool()
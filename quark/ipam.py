@@ -17,22 +17,218 @@
 Quark Pluggable IPAM
 """
 
+import collections
+import contextlib
+import hashlib
+import hmac
+import random
+import threading
+
 import netaddr
 
 from neutron.common import exceptions
+from neutron.openstack.common.db import exception as db_exception
+from neutron.openstack.common import importutils
 from neutron.openstack.common import log as logging
-from neutron.openstack.common.notifier import api as notifier_api
 from neutron.openstack.common import timeutils
+from neutron.openstack.common import uuidutils
 
 from oslo.config import cfg
 
 from quark.db import api as db_api
+from quark.db import locks
 from quark.db import models
+from quark import ip_leases
+from quark import notifications
+from quark import utils
 
 
 LOG = logging.getLogger(__name__)
 CONF = cfg.CONF
 
+quark_opts = [
+    cfg.StrOpt('ipam_allocation_mode',
+               default='locking',
+               help=_("How new IPs are picked. 'locking' locks the subnets "
+                      "of the network while walking their cursors, "
+                      "'optimistic' claims blocks of the cursor with a "
+                      "compare-and-swap and retries inserts on conflict, "
+                      "'advisory' claims blocks like 'optimistic' does but "
+                      "under a named lock per subnet and MAC range")),
+    cfg.IntOpt('ipam_cursor_block_size',
+               default=16,
+               help=_("Addresses claimed per cursor advance in optimistic "
+                      "and advisory allocation modes")),
+    cfg.IntOpt('ipam_cursor_claim_retries',
+               default=10,
+               help=_("Attempts at advancing a cursor in optimistic and "
+                      "advisory allocation modes before giving up")),
+    cfg.StrOpt('ipam_v6_hash_key',
+               default='',
+               secret=True,
+               help=_("Key of the hash IPv6 addresses are derived from by "
+                      "the BOTH_DERIVED strategy")),
+    cfg.IntOpt('ipam_v6_hash_attempts',
+               default=3,
+               help=_("Hashed IPv6 addresses tried per allocation by the "
+                      "BOTH_DERIVED strategy before walking the subnet "
+                      "cursor")),
+    cfg.StrOpt('default_subnet_selection',
+               default='fill_first',
+               help=_("How a subnet is picked among those with room for "
+                      "networks that do not set subnet_selection. One of "
+                      "fill_first, spread, least_contended and "
+                      "weighted_random"))
+]
+CONF.register_opts(quark_opts, "QUARK")
+
+
+def _is_optimistic():
+    return CONF.QUARK.ipam_allocation_mode == "optimistic"
+
+
+def _is_advisory():
+    return CONF.QUARK.ipam_allocation_mode == "advisory"
+
+
+def _is_locking():
+    return not (_is_optimistic() or _is_advisory())
+
+
+def _begin_cursor_claim(context, lock_name):
+    """Begins the transaction advancing a cursor.
+
+    Advisory allocation mode runs it under the cursor's named lock.
+    """
+    if _is_advisory():
+        return locks.get_lock_manager().begin(context, lock_name)
+    return context.session.begin()
+
+
+def eui64_interface_id(mac_address):
+    """Returns the modified EUI-64 interface identifier of a MAC."""
+    mac = netaddr.EUI(mac_address).value
+    interface_id = (mac >> 24) << 40 | 0xfffe << 24 | mac & 0xffffff
+    return interface_id ^ 1 << 57
+
+
+class SubnetSelectionFillFirst(object):
+    """Packs the fullest subnet first, keeping the others contiguous."""
+    @classmethod
+    def get_name(self):
+        return "fill_first"
+
+    def choose(self, candidates):
+        # NOTE(quark): candidates come ordered fullest first from the db
+        return candidates[0][0]
+
+
+class SubnetSelectionSpread(object):
+    """Picks the emptiest subnet, spreading allocators across subnets."""
+    @classmethod
+    def get_name(self):
+        return "spread"
+
+    def choose(self, candidates):
+        return max(candidates, key=lambda candidate: candidate[1])[0]
+
+
+class SubnetSelectionLeastContended(object):
+    """Picks the subnet this worker is allocating from the least.
+
+    Ties go to the emptiest subnet.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = collections.defaultdict(int)
+
+    @classmethod
+    def get_name(self):
+        return "least_contended"
+
+    def choose(self, candidates):
+        with self._lock:
+            in_flight = dict(self._in_flight)
+        return min(candidates,
+                   key=lambda candidate: (in_flight.get(candidate[0]["id"], 0),
+                                          -candidate[1]))[0]
+
+    def allocating(self, subnet_id):
+        with self._lock:
+            self._in_flight[subnet_id] += 1
+
+    def allocated(self, subnet_id):
+        with self._lock:
+            self._in_flight[subnet_id] -= 1
+            if self._in_flight[subnet_id] <= 0:
+                del self._in_flight[subnet_id]
+
+
+class SubnetSelectionWeightedRandom(object):
+    """Picks a subnet at random, weighted by its free addresses."""
+    @classmethod
+    def get_name(self):
+        return "weighted_random"
+
+    def choose(self, candidates):
+        point = random.random() * sum(free for subnet, free in candidates)
+        for subnet, free in candidates:
+            point -= free
+            if point < 0:
+                return subnet
+        return candidates[-1][0]
+
+
+class SubnetSelectionRegistry(object):
+    def __init__(self):
+        self.policies = {
+            SubnetSelectionFillFirst.get_name(): SubnetSelectionFillFirst(),
+            SubnetSelectionSpread.get_name(): SubnetSelectionSpread(),
+            SubnetSelectionLeastContended.get_name():
+            SubnetSelectionLeastContended(),
+            SubnetSelectionWeightedRandom.get_name():
+            SubnetSelectionWeightedRandom()}
+
+    def is_valid_policy(self, policy_name):
+        return policy_name in self.policies
+
+    def get_policy(self, policy_name=None):
+        policy_name = policy_name or CONF.QUARK.default_subnet_selection
+        if self.is_valid_policy(policy_name):
+            return self.policies[policy_name]
+        LOG.warn("Subnet selection policy %s not found, using fill_first" %
+                 policy_name)
+        return self.policies[SubnetSelectionFillFirst.get_name()]
+
+
+SUBNET_SELECTION_REGISTRY = SubnetSelectionRegistry()
+
+
+def log_ip_event(context, address, event, port=None):
+    """Appends an allocate or deallocate event to the IP address audit log."""
+    port = port or {}
+    with context.session.begin(subtransactions=True):
+        db_api.ip_address_event_create(
+            context, event=event,
+            address_readable=address.get("address_readable"),
+            ip_address_id=address.get("id"),
+            subnet_id=address.get("subnet_id"),
+            network_id=address.get("network_id"),
+            tenant_id=port.get("tenant_id") or context.tenant_id,
+            port_id=port.get("id"), device_id=port.get("device_id"))
+
+
+@contextlib.contextmanager
+def _allocating_from(subnet):
+    """Tells the least_contended policy an allocation is in progress."""
+    policy = SUBNET_SELECTION_REGISTRY.policies[
+        SubnetSelectionLeastContended.get_name()]
+    policy.allocating(subnet["id"])
+    try:
+        yield
+    finally:
+        policy.allocated(subnet["id"])
+
 
 class QuarkIpam(object):
     def allocate_mac_address(self, context, net_id, port_id, reuse_after,
@@ -51,24 +247,20 @@ class QuarkIpam(object):
 
         with context.session.begin(subtransactions=True):
             ranges = db_api.mac_address_range_find_allocation_counts(
-                context, address=mac_address)
+                context, address=mac_address, lock_mode=not _is_advisory())
             for result in ranges:
                 rng, addr_count = result
                 last = rng["last_address"]
                 first = rng["first_address"]
                 if last - first <= addr_count:
                     continue
-                next_address = None
                 if mac_address:
                     next_address = mac_address
                 else:
-                    address = True
-                    while address:
-                        next_address = rng["next_auto_assign_mac"]
-                        rng["next_auto_assign_mac"] = next_address + 1
-                        address = db_api.mac_address_find(
-                            context, tenant_id=context.tenant_id,
-                            scope=db_api.ONE, address=next_address)
+                    next_address = self._find_free_mac_address(
+                        context, rng, net_id)
+                    if next_address is None:
+                        continue
 
                 address = db_api.mac_address_create(
                     context, address=next_address,
@@ -77,6 +269,59 @@ class QuarkIpam(object):
 
         raise exceptions.MacAddressGenerationFailure(net_id=net_id)
 
+    def _find_free_mac_address(self, context, rng, net_id):
+        """Walks the range cursor to an address no MAC is stored under.
+
+        The cursor wraps to the start of the range, where archived
+        addresses become free again. Returns None after a full pass.
+        """
+        first = rng["first_address"]
+        last = rng["last_address"]
+        candidates_left = last - first
+        while candidates_left > 0:
+            candidates_left -= 1
+            if _is_advisory():
+                next_address = self._claim_mac_address(context, rng, net_id)
+            else:
+                next_address = rng["next_auto_assign_mac"]
+                if not first <= next_address < last:
+                    next_address = first
+                rng["next_auto_assign_mac"] = next_address + 1
+            address = db_api.mac_address_find(
+                context, tenant_id=context.tenant_id, scope=db_api.ONE,
+                address=next_address)
+            if not address:
+                return next_address
+        return None
+
+    def _claim_mac_address(self, context, rng, net_id):
+        """Advances the range cursor past one address under its lock.
+
+        Like the plain path, a cursor at or past last_address wraps to the
+        start of the range.
+        """
+        first = rng["first_address"]
+        last = rng["last_address"]
+        claim_context = utils.detached_context(context)
+        lock_name = locks.mac_range_lock_name(rng["id"])
+        try:
+            for attempt in xrange(CONF.QUARK.ipam_cursor_claim_retries):
+                with _begin_cursor_claim(claim_context, lock_name):
+                    cursor = (db_api.
+                              mac_address_range_find_next_auto_assign_mac(
+                                  claim_context, rng["id"]))
+                    address = cursor
+                    if not first <= address < last:
+                        address = first
+                    if db_api.mac_address_range_update_next_auto_assign_mac(
+                            claim_context, rng["id"], cursor, address + 1):
+                        return address
+        finally:
+            claim_context.session.close()
+        LOG.warning("Gave up claiming addresses from MAC range %s" %
+                    rng["id"])
+        raise exceptions.MacAddressGenerationFailure(net_id=net_id)
+
     def attempt_to_reallocate_ip(self, context, net_id, port_id, reuse_after,
                                  version=None, ip_address=None):
         version = version or [4, 6]
@@ -115,40 +360,261 @@ class QuarkIpam(object):
     def is_strategy_satisfied(self, ip_addresses):
         return ip_addresses
 
-    def _iterate_until_available_ip(self, context, subnet, network_id,
-                                    ip_policy_rules):
-        address = True
-        while address:
+    def _check_requested_ips(self, net_id, ip_addresses):
+        """Lets a strategy refuse the addresses a batch allocated.
+
+        The batch allocates exactly what was requested, so strategies that
+        require addresses of their own raise rather than add them.
+        """
+        pass
+
+    def _derive_v6_ips(self, subnet, port_id, mac_address):
+        """Yields addresses computed from the port rather than the cursor.
+
+        The base strategies derive nothing and always walk the cursor.
+        """
+        return []
+
+    def _create_derived_ip(self, context, subnet, network_id, port_id,
+                           mac_address, ip_policy_rules):
+        ipnet = netaddr.IPNetwork(subnet["cidr"])
+        first_ip = int(subnet["first_ip"])
+        last_ip = int(subnet["last_ip"])
+        for next_ip in self._derive_v6_ips(subnet, port_id, mac_address):
+            if next_ip.value == ipnet.first:
+                continue
+            if not first_ip <= next_ip.value <= last_ip:
+                continue
+            if ip_policy_rules and next_ip in ip_policy_rules:
+                continue
+            address = self._try_create_ip(context, subnet, network_id,
+                                          next_ip)
+            if address:
+                return address
+
+    def _create_next_available_ip(self, context, subnet, network_id,
+                                  ip_policy_rules):
+        """Walks the subnet cursor, inserting until an address sticks.
+
+        The unique index over (network_id, address) rejects addresses that
+        are already allocated, so no probe query is needed per candidate.
+        The cursor wraps to first_ip, where archived addresses become free
+        again, and gives up after a full pass.
+        """
+        first_ip = int(subnet["first_ip"])
+        last_ip = int(subnet["last_ip"])
+        candidates_left = last_ip - first_ip + 1
+        while candidates_left > 0:
+            candidates_left -= 1
             next_ip_int = int(subnet["next_auto_assign_ip"])
-            next_ip = netaddr.IPAddress(next_ip_int)
+            if next_ip_int < first_ip or next_ip_int > last_ip:
+                next_ip_int = first_ip
+            subnet["next_auto_assign_ip"] = next_ip_int + 1
+            for next_ip in self._iter_ip_block(subnet, next_ip_int,
+                                               next_ip_int + 1,
+                                               ip_policy_rules):
+                address = self._try_create_ip(context, subnet, network_id,
+                                              next_ip)
+                if address:
+                    return address
+        raise exceptions.IpAddressGenerationFailure(net_id=network_id)
+
+    def _claim_ip_block(self, context, subnet, block_size=None):
+        """Advances the subnet cursor past a block of candidate addresses.
+
+        The claim commits in its own transaction, so concurrent allocations
+        only wait on one another, if at all, for the advance itself;
+        addresses claimed by a request that later fails are picked up again
+        once the cursor wraps around.
+        """
+        first_ip = int(subnet["first_ip"])
+        last_ip = int(subnet["last_ip"])
+        block_size = block_size or CONF.QUARK.ipam_cursor_block_size
+        claim_context = utils.detached_context(context)
+        lock_name = locks.subnet_lock_name(subnet["id"])
+        try:
+            for attempt in xrange(CONF.QUARK.ipam_cursor_claim_retries):
+                with _begin_cursor_claim(claim_context, lock_name):
+                    cursor = db_api.subnet_find_next_auto_assign_ip(
+                        claim_context, subnet["id"])
+                    start = int(cursor)
+                    if start < first_ip or start > last_ip:
+                        start = first_ip
+                    end = min(start + block_size, last_ip + 1)
+                    if db_api.subnet_update_next_auto_assign_ip(
+                            claim_context, subnet["id"], cursor, end):
+                        return start, end
+        finally:
+            claim_context.session.close()
+        LOG.warning("Gave up claiming addresses from subnet %s" %
+                    subnet["id"])
+        raise exceptions.IpAddressGenerationFailure(
+            net_id=subnet["network_id"])
+
+    def _iter_ip_block(self, subnet, start, end, ip_policy_rules):
+        ip_int = start
+        while ip_int < end:
+            next_ip = netaddr.IPAddress(ip_int)
+            ip_int += 1
             if subnet["ip_version"] == 4:
                 next_ip = next_ip.ipv4()
-            subnet["next_auto_assign_ip"] = next_ip_int + 1
             if ip_policy_rules and next_ip in ip_policy_rules:
                 continue
-            address = db_api.ip_address_find(
-                context, network_id=network_id, ip_address=next_ip,
-                used_by_tenant_id=context.tenant_id, scope=db_api.ONE)
-
+            yield next_ip
+
+    def _try_create_ip(self, context, subnet, network_id, next_ip):
+        """Inserts next_ip, returning None if it is already allocated."""
+        try:
+            with context.session.begin_nested():
+                return db_api.ip_address_create(
+                    context, address=next_ip, subnet_id=subnet["id"],
+                    version=subnet["ip_version"], network_id=network_id)
+        except db_exception.DBDuplicateEntry:
+            LOG.debug("Address %s taken in subnet %s, retrying" %
+                      (next_ip, subnet["id"]))
+
+    def _insert_next_available_ip(self, context, subnet, network_id,
+                                  ip_policy_rules):
+        """Allocates an address without locking the subnet.
+
+        Walks claimed cursor blocks, relying on the unique index over
+        (network_id, address) to reject addresses that are already taken.
+        """
         ipnet = netaddr.IPNetwork(subnet["cidr"])
-        next_addr = netaddr.IPAddress(
-            subnet["next_auto_assign_ip"])
-        if ipnet.is_ipv4_mapped() or ipnet.version == 4:
-            next_addr = next_addr.ipv4()
-        return next_ip
+        candidates_left = ipnet.size
+        while candidates_left > 0:
+            start, end = self._claim_ip_block(context, subnet)
+            candidates_left -= end - start
+            for next_ip in self._iter_ip_block(subnet, start, end,
+                                               ip_policy_rules):
+                address = self._try_create_ip(context, subnet, network_id,
+                                              next_ip)
+                if address:
+                    return address
+        raise exceptions.IpAddressGenerationFailure(net_id=network_id)
+
+    def _allocate_from_leases(self, context, subnet, network_id,
+                              ip_policy_rules):
+        """Hands out an address this worker reserved ahead of time.
+
+        Returns None when no lease could be had, leaving the caller to fall
+        back to its regular allocation path.
+        """
+        refilled = False
+        while True:
+            next_ip = ip_leases.LEASES.take(subnet["id"])
+            if next_ip is None:
+                if refilled:
+                    return None
+                refilled = True
+                start, end = self._claim_ip_block(
+                    context, subnet, block_size=CONF.QUARK.ipam_lease_size)
+                ip_leases.LEASES.refill(
+                    context, subnet, list(self._iter_ip_block(
+                        subnet, start, end, ip_policy_rules)))
+                continue
+            address = self._use_lease(context, subnet, network_id, next_ip)
+            if address:
+                return address
+
+    def _use_lease(self, context, subnet, network_id, next_ip):
+        """Inserts a leased address in place of its reservation.
+
+        A lease whose reservation is gone was swept after expiring or went
+        with its subnet, so it is dropped rather than inserted.
+        """
+        if not db_api.ip_address_reservation_delete(
+                context, subnet["id"], str(next_ip), ip_leases.get_owner()):
+            return None
+        return self._try_create_ip(context, subnet, network_id, next_ip)
+
+    def _lease_versions(self, version):
+        """IP versions allocate_ip_address takes a lease of each from."""
+        return [version]
+
+    def _allocate_from_network_leases(self, context, net_id, versions):
+        """Allocates an address per version from this worker's leases.
+
+        Neither counts nor locks the network's subnets. Returns an empty
+        list, having allocated nothing, unless every version was served.
+        """
+        if not versions:
+            return []
+        savepoint = context.session.begin_nested()
+        addresses = []
+        for version in versions:
+            address = None
+            while not address:
+                lease = ip_leases.LEASES.take_from_network(net_id, version)
+                if lease is None:
+                    savepoint.rollback()
+                    return []
+                address = self._use_lease(context, lease[0], net_id,
+                                          lease[1])
+            address["deallocated"] = 0
+            addresses.append(address)
+        savepoint.commit()
+        return addresses
+
+    def _allocate_from_subnet(self, context, elevated, subnet, net_id,
+                              port_id, ip_address, mac_address,
+                              ip_policy_rules=None):
+        if ip_policy_rules is None and not ip_address:
+            ip_policy_rules = models.IPPolicy.get_ip_policy_rule_set(subnet)
+        address = None
+        if ip_address:
+            address = self._try_create_ip(elevated, subnet, net_id,
+                                          ip_address)
+            if not address:
+                raise exceptions.IpAddressGenerationFailure(net_id=net_id)
+        elif subnet["ip_version"] == 6:
+            address = self._create_derived_ip(
+                elevated, subnet, net_id, port_id, mac_address,
+                ip_policy_rules)
+
+        if not address and not ip_address and ip_leases.is_enabled():
+            address = self._allocate_from_leases(
+                elevated, subnet, net_id, ip_policy_rules)
+
+        if not address and not _is_locking():
+            address = self._insert_next_available_ip(
+                elevated, subnet, net_id, ip_policy_rules)
+        elif not address:
+            context.session.add(subnet)
+            address = self._create_next_available_ip(
+                elevated, subnet, net_id, ip_policy_rules)
+        address["deallocated"] = 0
+        return address
 
     def allocate_ip_address(self, context, net_id, port_id, reuse_after,
-                            version=None, ip_address=None):
+                            version=None, ip_address=None, mac_address=None,
+                            device_id=None):
         elevated = context.elevated()
+        port = dict(id=port_id, device_id=device_id)
         if ip_address:
             ip_address = netaddr.IPAddress(ip_address)
 
+        # NOTE(quark): While this worker holds leases on the network they
+        # are handed out before deallocated addresses are reused, sparing
+        # the subnet count. Reuse picks up once the leases run dry.
+        if not ip_address and ip_leases.is_enabled():
+            with context.session.begin(subtransactions=True):
+                leased = self._allocate_from_network_leases(
+                    elevated, net_id, self._lease_versions(version))
+                for addr in leased:
+                    log_ip_event(context, addr, "allocate", port)
+            if leased:
+                self._notify_allocated(context, leased)
+                return leased
+
         new_addresses = []
         realloc_ips = self.attempt_to_reallocate_ip(context, net_id,
                                                     port_id, reuse_after,
                                                     version=None,
                                                     ip_address=None)
         if self.is_strategy_satisfied(realloc_ips):
+            for addr in realloc_ips:
+                log_ip_event(context, addr, "allocate", port)
             return realloc_ips
         new_addresses.extend(realloc_ips)
         with context.session.begin(subtransactions=True):
@@ -156,62 +622,161 @@ class QuarkIpam(object):
                 elevated, net_id, version, ip_address=ip_address,
                 reallocated_ips=realloc_ips)
             for subnet in subnets:
-                ip_policy_rules = models.IPPolicy.get_ip_policy_rule_set(
-                    subnet)
-                # Creating this IP for the first time
-                next_ip = None
-                if ip_address:
-                    next_ip = ip_address
-                    address = db_api.ip_address_find(
-                        elevated, network_id=net_id, ip_address=next_ip,
-                        used_by_tenant_id=elevated.tenant_id, scope=db_api.ONE)
-                    if address:
-                        raise exceptions.IpAddressGenerationFailure(
-                            net_id=net_id)
-                else:
-                    next_ip = self._iterate_until_available_ip(
-                        elevated, subnet, net_id, ip_policy_rules)
-
-                context.session.add(subnet)
-                address = db_api.ip_address_create(
-                    elevated, address=next_ip, subnet_id=subnet["id"],
-                    version=subnet["ip_version"], network_id=net_id)
-                address["deallocated"] = 0
+                with _allocating_from(subnet):
+                    address = self._allocate_from_subnet(
+                        context, elevated, subnet, net_id, port_id,
+                        ip_address, mac_address)
                 new_addresses.append(address)
+            for addr in new_addresses:
+                log_ip_event(context, addr, "allocate", port)
 
-        for addr in new_addresses:
+        self._notify_allocated(context, new_addresses)
+        return new_addresses
+
+    def _notify_allocated(self, context, addresses):
+        for addr in addresses:
             payload = dict(used_by_tenant_id=addr["used_by_tenant_id"],
                            ip_block_id=addr["subnet_id"],
                            ip_address=addr["address_readable"],
                            device_ids=[p["device_id"] for p in addr["ports"]],
                            created_at=addr["created_at"])
-            notifier_api.notify(context,
-                                notifier_api.publisher_id("network"),
-                                "ip_block.address.create",
-                                notifier_api.CONF.default_notification_level,
-                                payload)
+            notifications.record(context, "ip_block.address.create",
+                                 payload)
+
+    def _parse_ip_request(self, request):
+        ip_address = request.get("ip_address")
+        if ip_address:
+            ip_address = netaddr.IPAddress(ip_address)
+        return dict(ip_address=ip_address or None,
+                    subnet_id=request.get("subnet_id"),
+                    version=(ip_address.version if ip_address
+                             else request.get("version")))
+
+    def _choose_request_subnet(self, subnet_counts, request, policy_rules,
+                               allocated):
+        """Picks the subnet a request allocates from, or None.
+
+        Requested addresses go to the subnet holding them, and must be in
+        the subnet requested with them. Other requests go through the
+        network's subnet selection policy, with the counts topped up by
+        what this batch already allocated.
+        """
+        candidates = []
+        for subnet, ips_in_subnet in subnet_counts:
+            if request["subnet_id"] and subnet["id"] != request["subnet_id"]:
+                continue
+            ipnet = netaddr.IPNetwork(subnet["cidr"])
+            if request["ip_address"]:
+                if request["ip_address"] in ipnet:
+                    return subnet
+                if request["subnet_id"]:
+                    raise exceptions.BadRequest(
+                        resource="fixed_ips",
+                        msg="ip_address %s is not in subnet %s" %
+                            (request["ip_address"], request["subnet_id"]))
+                continue
+            if request["version"] and \
+                    subnet["ip_version"] != request["version"]:
+                continue
+            if subnet["id"] not in policy_rules:
+                policy_rules[subnet["id"]] = \
+                    models.IPPolicy.get_ip_policy_rule_set(subnet)
+            free = (ipnet.size - int(ips_in_subnet) - allocated[subnet["id"]] -
+                    policy_rules[subnet["id"]].size)
+            if free > 0:
+                candidates.append((subnet, free))
+        return self._choose_subnet(candidates)
+
+    def allocate_ip_addresses(self, context, net_id, port_id, reuse_after,
+                              requests, mac_address=None, device_id=None):
+        """Allocates an address for each request in one pass.
+
+        A request is a dict of any of ip_address, subnet_id and version,
+        as the fixed_ips of a port are. Requested addresses deallocated
+        long enough ago are reused with a single query, other requests
+        reuse the lowest such address of the subnets they may draw from.
+        The subnets of the network are counted and their policies compiled
+        once for all requests, rather than once per allocate_ip_address
+        call.
+        """
+        elevated = context.elevated()
+        port = dict(id=port_id, device_id=device_id)
+        requests = [self._parse_ip_request(request) for request in requests]
+        fixed = [str(r["ip_address"]) for r in requests if r["ip_address"]]
+        walks_cursor = len(fixed) < len(requests)
+
+        new_addresses = []
+        with context.session.begin(subtransactions=True):
+            reusable = {}
+            if fixed:
+                for address in db_api.ip_address_find_reusable(
+                        elevated, net_id, reuse_after, fixed):
+                    reusable[address["address_readable"]] = address
+            subnet_counts = db_api.subnet_find_allocation_counts(
+                elevated, net_id, lock_mode=walks_cursor and _is_locking(),
+                scope=db_api.ALL)
+            policy_rules = {}
+            allocated = collections.defaultdict(int)
+            for request in requests:
+                if request["ip_address"]:
+                    address = reusable.pop(str(request["ip_address"]), None)
+                else:
+                    address = self._reallocate_for_request(
+                        elevated, subnet_counts, request, reuse_after, fixed)
+                if not address or request["ip_address"]:
+                    subnet = self._choose_request_subnet(
+                        subnet_counts, request, policy_rules, allocated)
+                    if not subnet:
+                        raise exceptions.IpAddressGenerationFailure(
+                            net_id=net_id)
+                if address:
+                    address = db_api.ip_address_update(
+                        elevated, address, deallocated=False,
+                        deallocated_at=None, allocated_at=timeutils.utcnow())
+                else:
+                    with _allocating_from(subnet):
+                        address = self._allocate_from_subnet(
+                            context, elevated, subnet, net_id, port_id,
+                            request["ip_address"], mac_address,
+                            ip_policy_rules=policy_rules.get(subnet["id"]))
+                    allocated[subnet["id"]] += 1
+                new_addresses.append(address)
+            self._check_requested_ips(net_id, new_addresses)
+            for addr in new_addresses:
+                log_ip_event(context, addr, "allocate", port)
+
+        self._notify_allocated(context, new_addresses)
         return new_addresses
 
-    def _deallocate_ip_address(self, context, address):
+    def _reallocate_for_request(self, context, subnet_counts, request,
+                                reuse_after, fixed):
+        subnet_ids = [subnet["id"] for subnet, _ in subnet_counts
+                      if (not request["subnet_id"] or
+                          subnet["id"] == request["subnet_id"]) and
+                      (not request["version"] or
+                       subnet["ip_version"] == request["version"])]
+        if not subnet_ids:
+            return None
+        return db_api.ip_address_find_next_reusable(
+            context, subnet_ids, reuse_after, exclude=fixed)
+
+    def _deallocate_ip_address(self, context, address, port=None):
         address["deallocated"] = 1
+        log_ip_event(context, address, "deallocate", port)
         payload = dict(used_by_tenant_id=address["used_by_tenant_id"],
                        ip_block_id=address["subnet_id"],
                        ip_address=address["address_readable"],
                        device_ids=[p["device_id"] for p in address["ports"]],
                        created_at=address["created_at"],
                        deleted_at=timeutils.utcnow())
-        notifier_api.notify(context,
-                            notifier_api.publisher_id("network"),
-                            "ip_block.address.delete",
-                            notifier_api.CONF.default_notification_level,
-                            payload)
+        notifications.record(context, "ip_block.address.delete", payload)
 
     def deallocate_ip_address(self, context, port, **kwargs):
         with context.session.begin(subtransactions=True):
             for addr in port["ip_addresses"]:
                 # Note: only deallocate ip if this is the only port mapped
                 if len(addr["ports"]) == 1:
-                    self._deallocate_ip_address(context, addr)
+                    self._deallocate_ip_address(context, addr, port)
             port["ip_addresses"] = []
 
     def deallocate_mac_address(self, context, address):
@@ -224,10 +789,11 @@ class QuarkIpam(object):
             db_api.mac_address_update(context, mac, deallocated=True,
                                       deallocated_at=timeutils.utcnow())
 
-    def select_subnet(self, context, net_id, ip_address, **filters):
-        subnets = db_api.subnet_find_allocation_counts(context, net_id,
-                                                       scope=db_api.ALL,
-                                                       **filters)
+    def _subnet_candidates(self, context, net_id, ip_address, **filters):
+        subnets = db_api.subnet_find_allocation_counts(
+            context, net_id, lock_mode=_is_locking(),
+            scope=db_api.ALL, **filters)
+        candidates = []
         for subnet, ips_in_subnet in subnets:
             ipnet = netaddr.IPNetwork(subnet["cidr"])
             if ip_address and ip_address not in ipnet:
@@ -237,8 +803,35 @@ class QuarkIpam(object):
                 ip_policy_rules = models.IPPolicy.get_ip_policy_rule_set(
                     subnet)
             policy_size = ip_policy_rules.size if ip_policy_rules else 0
-            if ipnet.size > (ips_in_subnet + policy_size):
-                return subnet
+            free = ipnet.size - int(ips_in_subnet) - policy_size
+            if free > 0:
+                candidates.append((subnet, free))
+        return candidates
+
+    def _choose_subnet(self, candidates):
+        if not candidates:
+            return None
+        network = candidates[0][0].get("network") or {}
+        policy = SUBNET_SELECTION_REGISTRY.get_policy(
+            network.get("subnet_selection"))
+        return policy.choose(candidates)
+
+    def select_subnet(self, context, net_id, ip_address, **filters):
+        return self._choose_subnet(
+            self._subnet_candidates(context, net_id, ip_address, **filters))
+
+    def select_subnets(self, context, net_id, ip_address, versions):
+        """Picks a subnet per IP version out of one count of the network."""
+        if not versions:
+            return []
+        candidates = self._subnet_candidates(context, net_id, ip_address)
+        subnets = []
+        for version in versions:
+            subnet = self._choose_subnet(
+                [c for c in candidates if c[0]["ip_version"] == version])
+            if subnet:
+                subnets.append(subnet)
+        return subnets
 
 
 class QuarkIpamANY(QuarkIpam):
@@ -262,10 +855,13 @@ class QuarkIpamBOTH(QuarkIpam):
     def get_name(self):
         return "BOTH"
 
+    def _lease_versions(self, version):
+        return [4, 6]
+
     def is_strategy_satisfied(self, reallocated_ips):
         req = [4, 6]
         for ip in reallocated_ips:
-            if ip is not None:
+            if ip is not None and ip["version"] in req:
                 req.remove(ip["version"])
         if len(req) == 0:
             return True
@@ -284,18 +880,12 @@ class QuarkIpamBOTH(QuarkIpam):
 
     def _choose_available_subnet(self, context, net_id, version=None,
                                  ip_address=None, reallocated_ips=None):
-        both_subnet_versions = []
         need_versions = [4, 6]
         for i in reallocated_ips:
             if i["version"] in need_versions:
                 need_versions.remove(i["version"])
-        filters = {}
-        for ver in need_versions:
-            filters["ip_version"] = ver
-            sub = self.select_subnet(context, net_id, ip_address, **filters)
-
-            if sub:
-                both_subnet_versions.append(sub)
+        both_subnet_versions = self.select_subnets(context, net_id,
+                                                   ip_address, need_versions)
         if not reallocated_ips and not both_subnet_versions:
             raise exceptions.IpAddressGenerationFailure(net_id=net_id)
 
@@ -316,26 +906,90 @@ class QuarkIpamBOTHREQ(QuarkIpamBOTH):
             raise exceptions.IpAddressGenerationFailure(net_id=net_id)
         return subnets
 
+    def _check_requested_ips(self, net_id, ip_addresses):
+        if not self.is_strategy_satisfied(ip_addresses):
+            raise exceptions.IpAddressGenerationFailure(net_id=net_id)
+
+
+class QuarkIpamBOTHDERIVED(QuarkIpamBOTH):
+    """Allocates IPv6 addresses without walking the subnet cursor.
+
+    The address is the EUI-64 of the port's MAC when the prefix allows it,
+    then a few keyed hashes of the port. Only when all of those are taken
+    does allocation fall back to the cursor, so most IPv6 allocations cost
+    a single insert checked by the unique address index.
+    """
+    @classmethod
+    def get_name(self):
+        return "BOTH_DERIVED"
+
+    def _lease_versions(self, version):
+        # NOTE(quark): IPv6 addresses derive from the port, not leases.
+        return []
+
+    def _derive_v6_ips(self, subnet, port_id, mac_address):
+        ipnet = netaddr.IPNetwork(subnet["cidr"])
+        if mac_address is not None:
+            mac_address = netaddr.EUI(mac_address).value
+            if ipnet.prefixlen <= 64:
+                yield netaddr.IPAddress(
+                    ipnet.first | eui64_interface_id(mac_address), 6)
+
+        seed = mac_address or port_id or uuidutils.generate_uuid()
+        for attempt in xrange(CONF.QUARK.ipam_v6_hash_attempts):
+            digest = hmac.new(CONF.QUARK.ipam_v6_hash_key,
+                              "%s:%s:%d" % (subnet["id"], seed, attempt),
+                              hashlib.sha256).hexdigest()
+            yield netaddr.IPAddress(
+                ipnet.first + int(digest, 16) % ipnet.size, 6)
+
 
 class IpamRegistry(object):
+    """Maps ipam_strategy names to strategies, built on first use."""
     def __init__(self):
-        self.strategies = {
-            QuarkIpamANY.get_name(): QuarkIpamANY(),
-            QuarkIpamBOTH.get_name(): QuarkIpamBOTH(),
-            QuarkIpamBOTHREQ.get_name(): QuarkIpamBOTHREQ()}
+        self.strategy_classes = dict(
+            (klass.get_name(), klass)
+            for klass in (QuarkIpamANY, QuarkIpamBOTH, QuarkIpamBOTHREQ,
+                          QuarkIpamBOTHDERIVED))
+        self.strategies = {}
+        self._lock = threading.Lock()
 
     def is_valid_strategy(self, strategy_name):
-        if strategy_name in self.strategies:
+        if strategy_name in self.strategy_classes:
             return True
         return False
 
+    def _get(self, strategy_name):
+        strategy = self.strategies.get(strategy_name)
+        if strategy is None:
+            with self._lock:
+                strategy = self.strategies.get(strategy_name)
+                if strategy is None:
+                    strategy = self.strategy_classes[strategy_name]()
+                    self.strategies[strategy_name] = strategy
+        return strategy
+
     def get_strategy(self, strategy_name):
         if self.is_valid_strategy(strategy_name):
-            return self.strategies[strategy_name]
+            return self._get(strategy_name)
         fallback = CONF.QUARK.default_ipam_strategy
         LOG.warn("IPAM strategy %s not found, "
                  "using default %s" % (strategy_name, fallback))
-        return self.strategies[fallback]
+        return self._get(fallback)
 
 
 IPAM_REGISTRY = IpamRegistry()
+
+_IPAM_DRIVER = None
+_IPAM_DRIVER_LOCK = threading.Lock()
+
+
+def get_ipam_driver():
+    """Returns this process' CONF.QUARK.ipam_driver, built on first use."""
+    global _IPAM_DRIVER
+    if _IPAM_DRIVER is None:
+        with _IPAM_DRIVER_LOCK:
+            if _IPAM_DRIVER is None:
+                _IPAM_DRIVER = importutils.import_class(
+                    CONF.QUARK.ipam_driver)()
+    return _IPAM_DRIVER
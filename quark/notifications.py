@@ -0,0 +1,223 @@
+# Copyright 2013 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Transaction aware notification buffer for Quark
+
+Notifications recorded inside a transaction are held on its session and
+handed to a background sender once the outermost transaction commits.
+Rolled back transactions, including rolled back savepoints, discard the
+notifications recorded within them.
+"""
+
+import Queue
+import threading
+import weakref
+
+from neutron.openstack.common import log as logging
+from neutron.openstack.common.notifier import api as notifier_api
+from oslo.config import cfg
+from sqlalchemy import event
+
+LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
+
+quark_opts = [
+    cfg.BoolOpt('notification_async',
+                default=True,
+                help=_("Send notifications from a background thread instead "
+                       "of the API request")),
+    cfg.IntOpt('notification_queue_size',
+               default=1000,
+               help=_("Maximum notifications waiting to be sent")),
+    cfg.IntOpt('notification_batch_size',
+               default=50,
+               help=_("Maximum notifications the sender drains per wakeup")),
+    cfg.FloatOpt('notification_enqueue_timeout',
+                 default=0.1,
+                 help=_("Seconds a request waits for room in a full "
+                        "notification queue before the notification is "
+                        "dropped"))
+]
+CONF.register_opts(quark_opts, "QUARK")
+
+STATS = {"queued": 0, "sent": 0, "dropped": 0, "blocked": 0, "failed": 0}
+_STATS_LOCK = threading.Lock()
+
+# NOTE(quark): session -> [(transaction, notification)]. Sessions are
+#              request scoped, so entries go away with their request.
+_PENDING = weakref.WeakKeyDictionary()
+_PENDING_LOCK = threading.Lock()
+
+_SENDER = None
+_SENDER_LOCK = threading.Lock()
+
+
+def _count(stat, value=1):
+    with _STATS_LOCK:
+        STATS[stat] += value
+
+
+def get_stats():
+    with _STATS_LOCK:
+        return dict(STATS)
+
+
+class Notification(object):
+    def __init__(self, context, event_type, payload):
+        self.context = context
+        self.event_type = event_type
+        self.payload = payload
+
+    def send(self):
+        notifier_api.notify(self.context,
+                            notifier_api.publisher_id("network"),
+                            self.event_type,
+                            notifier_api.CONF.default_notification_level,
+                            self.payload)
+
+
+class NotificationSender(object):
+    """Sends queued notifications from a daemon thread, in batches."""
+    def __init__(self):
+        self.queue = Queue.Queue(CONF.QUARK.notification_queue_size)
+        self.thread = threading.Thread(target=self._run,
+                                       name="quark-notifications")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, notification):
+        try:
+            self.queue.put_nowait(notification)
+        except Queue.Full:
+            _count("blocked")
+            try:
+                self.queue.put(notification,
+                               timeout=CONF.QUARK.notification_enqueue_timeout)
+            except Queue.Full:
+                _count("dropped")
+                LOG.warning("Notification queue full, dropping %s" %
+                            notification.event_type)
+                return
+        _count("queued")
+
+    def _batch(self):
+        batch = [self.queue.get()]
+        while len(batch) < CONF.QUARK.notification_batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except Queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            for notification in self._batch():
+                _send(notification)
+
+
+def _send(notification):
+    try:
+        notification.send()
+        _count("sent")
+    except Exception:
+        _count("failed")
+        LOG.exception("Failed to send %s notification" %
+                      notification.event_type)
+
+
+def get_sender():
+    global _SENDER
+    if _SENDER is None:
+        with _SENDER_LOCK:
+            if _SENDER is None:
+                _SENDER = NotificationSender()
+    return _SENDER
+
+
+def reset():
+    """Forgets the sender, e.g. after a fork where its thread is gone."""
+    global _SENDER
+    with _SENDER_LOCK:
+        _SENDER = None
+
+
+def _emit(notifications):
+    if not CONF.QUARK.notification_async:
+        for notification in notifications:
+            _send(notification)
+        return
+    sender = get_sender()
+    for notification in notifications:
+        sender.put(notification)
+
+
+def _within(transaction, ancestor):
+    while transaction is not None:
+        if transaction is ancestor:
+            return True
+        transaction = transaction._parent
+    return False
+
+
+def _after_commit(session):
+    # NOTE(quark): a released savepoint also dispatches after_commit, but
+    #              its changes are only durable once the root commits.
+    if session.transaction is not None and session.transaction.nested:
+        return
+    with _PENDING_LOCK:
+        pending = _PENDING.pop(session, [])
+    _emit([notification for _txn, notification in pending])
+
+
+def _after_soft_rollback(session, previous_transaction):
+    if previous_transaction._parent is not None and \
+            not previous_transaction.nested:
+        # NOTE(quark): a subtransaction; the enclosing real transaction
+        #              dispatches its own rollback
+        return
+    with _PENDING_LOCK:
+        pending = _PENDING.get(session)
+        if pending:
+            pending[:] = [(txn, notification) for txn, notification in pending
+                          if not _within(txn, previous_transaction)]
+
+
+def _listen(session):
+    event.listen(session, "after_commit", _after_commit)
+    event.listen(session, "after_soft_rollback", _after_soft_rollback)
+
+
+def record(context, event_type, payload):
+    """Records a notification to send once the current transaction commits.
+
+    Outside of a transaction the notification is sent right away. The
+    payload must be built by the caller while its objects are still
+    attached to the session.
+    """
+    notification = Notification(context, event_type, payload)
+    session = context.session
+    transaction = session.transaction
+    if transaction is None:
+        _emit([notification])
+        return
+
+    with _PENDING_LOCK:
+        if session not in _PENDING:
+            _PENDING[session] = []
+            if not getattr(session, "_quark_notifications", False):
+                session._quark_notifications = True
+                _listen(session)
+        _PENDING[session].append((transaction, notification))
@@ -24,7 +24,10 @@ from neutron import neutron_plugin_base_v2
 from neutron import quota
 
 from quark.api import extensions
+from quark.api import request_session
+from quark import archiver
 from quark.db import models
+from quark.db import replica
 from quark.plugin_modules import ip_addresses
 from quark.plugin_modules import ip_policies
 from quark.plugin_modules import mac_address_ranges
@@ -33,6 +36,8 @@ from quark.plugin_modules import ports
 from quark.plugin_modules import routes
 from quark.plugin_modules import security_groups
 from quark.plugin_modules import subnets
+from quark import quota_driver
+from quark import workers
 
 CONF = cfg.CONF
 
@@ -69,16 +74,49 @@ quota.QUOTAS.register_resources(quark_resources)
 
 def sessioned(func):
     def _wrapped(self, context, *args, **kwargs):
+        workers.check_fork()
         res = func(self, context, *args, **kwargs)
-        context.session.close()
+        if not getattr(func, "read_only", False):
+            replica.record_write(context)
+        if request_session.is_request_scoped(context):
+            # NOTE(quark): the request's later calls reuse it, the
+            #              middleware closes it
+            return res
 
         #NOTE(mdietz): Forces neutron to get a fresh session
         #              if it needs it after our call
-        context._session = None
+        request_session.close_session(context)
         return res
     return _wrapped
 
 
+def read_only(func):
+    """Marks a call that writes nothing, so it does not pin the tenant to
+    the primary. Must be applied beneath sessioned.
+    """
+    func.read_only = True
+    return func
+
+
+def replicated(func):
+    """Runs a read-only call against the read replica, if configured.
+
+    Must be applied beneath sessioned.
+    """
+    def _wrapped(self, context, *args, **kwargs):
+        if not replica.should_use_replica(context):
+            return func(self, context, *args, **kwargs)
+
+        primary_session = context._session
+        context._session = replica.get_session()
+        try:
+            return func(self, context, *args, **kwargs)
+        finally:
+            context._session.close()
+            context._session = primary_session
+    return read_only(_wrapped)
+
+
 class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
              sg_ext.SecurityGroupPluginBase):
     supported_extension_aliases = ["mac_address_ranges", "routes",
@@ -86,17 +124,22 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
                                    "security-group", "diagnostics",
                                    "subnets_quark", "provider",
                                    "ip_policies", "quotas",
-                                   "networks_quark"]
+                                   "networks_quark", "nw_info",
+                                   "subnet_usage", "ip_address_events"]
 
     def __init__(self):
         neutron_db_api.configure_db()
         neutron_db_api.register_models(base=models.BASEV2)
+        archiver.start()
+        quota_driver.start()
 
     @sessioned
+    @read_only
     def get_mac_address_range(self, context, id, fields=None):
         return mac_address_ranges.get_mac_address_range(context, id, fields)
 
     @sessioned
+    @read_only
     def get_mac_address_ranges(self, context):
         return mac_address_ranges.get_mac_address_ranges(context)
 
@@ -137,14 +180,17 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
         security_groups.delete_security_group_rule(context, id, net_driver)
 
     @sessioned
+    @read_only
     def get_security_group(self, context, id, fields=None):
         return security_groups.get_security_group(context, id, fields)
 
     @sessioned
+    @read_only
     def get_security_group_rule(self, context, id, fields=None):
         return security_groups.get_security_group_rule(context, id, fields)
 
     @sessioned
+    @read_only
     def get_security_groups(self, context, filters=None, fields=None,
                             sorts=None, limit=None, marker=None,
                             page_reverse=False):
@@ -153,6 +199,7 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
                                                    page_reverse)
 
     @sessioned
+    @read_only
     def get_security_group_rules(self, context, filters=None, fields=None,
                                  sorts=None, limit=None, marker=None,
                                  page_reverse=False):
@@ -173,10 +220,12 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
         return ip_policies.create_ip_policy(context, ip_policy)
 
     @sessioned
+    @read_only
     def get_ip_policy(self, context, id):
         return ip_policies.get_ip_policy(context, id)
 
     @sessioned
+    @read_only
     def get_ip_policies(self, context, **filters):
         return ip_policies.get_ip_policies(context, **filters)
 
@@ -189,10 +238,12 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
         return ip_policies.delete_ip_policy(context, id)
 
     @sessioned
+    @replicated
     def get_ip_addresses(self, context, **filters):
         return ip_addresses.get_ip_addresses(context, **filters)
 
     @sessioned
+    @read_only
     def get_ip_address(self, context, id):
         return ip_addresses.get_ip_address(context, id)
 
@@ -204,6 +255,14 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
     def update_ip_address(self, context, id, ip_address):
         return ip_addresses.update_ip_address(context, id, ip_address)
 
+    @sessioned
+    @replicated
+    def get_ip_address_events(self, context, network_id, ip_address,
+                              start=None, end=None):
+        return ip_addresses.get_ip_address_events(context, network_id,
+                                                  ip_address, start=start,
+                                                  end=end)
+
     @sessioned
     def create_port(self, context, port):
         return ports.create_port(context, port)
@@ -213,6 +272,7 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
         return ports.post_update_port(context, id, port)
 
     @sessioned
+    @read_only
     def get_port(self, context, id, fields=None):
         return ports.get_port(context, id, fields)
 
@@ -221,13 +281,20 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
         return ports.update_port(context, id, port)
 
     @sessioned
+    @replicated
     def get_ports(self, context, filters=None, fields=None):
         return ports.get_ports(context, filters, fields)
 
     @sessioned
+    @replicated
     def get_ports_count(self, context, filters=None):
         return ports.get_ports_count(context, filters)
 
+    @sessioned
+    @replicated
+    def get_ports_nw_info(self, context, device_ids):
+        return ports.get_ports_nw_info(context, device_ids)
+
     @sessioned
     def delete_port(self, context, id):
         return ports.delete_port(context, id)
@@ -237,14 +304,17 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
         return ports.disassociate_port(context, id, ip_address_id)
 
     @sessioned
+    @replicated
     def diagnose_port(self, context, id, fields):
         return ports.diagnose_port(context, id, fields)
 
     @sessioned
+    @read_only
     def get_route(self, context, id):
         return routes.get_route(context, id)
 
     @sessioned
+    @read_only
     def get_routes(self, context):
         return routes.get_routes(context)
 
@@ -265,22 +335,31 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
         return subnets.update_subnet(context, id, subnet)
 
     @sessioned
+    @read_only
     def get_subnet(self, context, id, fields=None):
         return subnets.get_subnet(context, id, fields)
 
     @sessioned
+    @replicated
     def get_subnets(self, context, filters=None, fields=None):
         return subnets.get_subnets(context, filters, fields)
 
     @sessioned
+    @replicated
     def get_subnets_count(self, context, filters=None):
         return subnets.get_subnets_count(context, filters)
 
+    @sessioned
+    @replicated
+    def get_subnets_usage(self, context, filters=None):
+        return subnets.get_subnets_usage(context, filters)
+
     @sessioned
     def delete_subnet(self, context, id):
         return subnets.delete_subnet(context, id)
 
     @sessioned
+    @replicated
     def diagnose_subnet(self, context, id, fields):
         return subnets.diagnose_subnet(context, id, fields)
 
@@ -293,14 +372,17 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
         return networks.update_network(context, id, network)
 
     @sessioned
+    @read_only
     def get_network(self, context, id, fields=None):
         return networks.get_network(context, id, fields)
 
     @sessioned
+    @replicated
     def get_networks(self, context, filters=None, fields=None):
         return networks.get_networks(context, filters, fields)
 
     @sessioned
+    @replicated
     def get_networks_count(self, context, filters=None):
         return networks.get_networks_count(context, filters)
 
@@ -309,5 +391,6 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
         return networks.delete_network(context, id)
 
     @sessioned
+    @replicated
     def diagnose_network(self, context, id, fields):
         return networks.diagnose_network(context, id, fields)
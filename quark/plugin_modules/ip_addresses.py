@@ -14,18 +14,19 @@
 #    under the License.
 
 from neutron.common import exceptions
-from neutron.openstack.common import importutils
 from neutron.openstack.common import log as logging
+from neutron.openstack.common import timeutils
 from oslo.config import cfg
 
 from quark.db import api as db_api
+from quark.db import retry
 from quark import exceptions as quark_exceptions
+from quark import ipam
 from quark import plugin_views as v
 
 
 CONF = cfg.CONF
 LOG = logging.getLogger(__name__)
-ipam_driver = (importutils.import_class(CONF.QUARK.ipam_driver))()
 
 
 def get_ip_addresses(context, **filters):
@@ -44,6 +45,7 @@ def get_ip_address(context, id):
     return v._make_ip_dict(addr)
 
 
+@retry.retry_on_lock_error
 def create_ip_address(context, ip_address):
     LOG.info("create_ip_address for tenant %s" % context.tenant_id)
 
@@ -78,13 +80,15 @@ def create_ip_address(context, ip_address):
             raise exceptions.PortNotFound(port_id=port_ids,
                                           net_id=network_id)
 
-        address = ipam_driver.allocate_ip_address(
+        address = ipam.get_ipam_driver().allocate_ip_address(
             context,
             port['network_id'],
             port['id'],
             CONF.QUARK.ipam_reuse_after,
             ip_version,
-            ip_address)
+            ip_address,
+            mac_address=port.get("mac_address"),
+            device_id=port.get("device_id"))
 
         for port in ports:
             port["ip_addresses"].append(address)
@@ -126,5 +130,34 @@ def update_ip_address(context, id, ip_address):
                 port['ip_addresses'].extend([address])
         else:
             address["deallocated"] = 1
+            ipam.log_ip_event(context, address, "deallocate")
 
     return v._make_ip_dict(address)
+
+
+def _parse_event_time(name, value):
+    if not value:
+        return None
+    try:
+        return timeutils.normalize_time(timeutils.parse_isotime(value))
+    except ValueError:
+        raise exceptions.BadRequest(
+            resource="ip_address_events",
+            msg="%s must be an ISO 8601 timestamp, got %s" % (name, value))
+
+
+def get_ip_address_events(context, network_id, ip_address, start=None,
+                          end=None):
+    """Returns who held ip_address on the network between start and end.
+
+    Tenants only see the events of their own allocations.
+    """
+    LOG.info("get_ip_address_events %s on network %s for tenant %s" %
+             (ip_address, network_id, context.tenant_id))
+    start = _parse_event_time("start", start)
+    end = _parse_event_time("end", end)
+    tenant_id = None if context.is_admin else context.tenant_id
+    events = db_api.ip_address_event_find(context, network_id, ip_address,
+                                          start=start, end=end,
+                                          tenant_id=tenant_id)
+    return [v._make_ip_address_event_dict(e) for e in events]
@@ -17,6 +17,7 @@ from neutron.common import exceptions
 from neutron.openstack.common import log as logging
 from oslo.config import cfg
 
+from quark import cache
 from quark.db import api as db_api
 from quark import exceptions as quark_exceptions
 from quark import plugin_views as v
@@ -64,6 +65,7 @@ def create_ip_policy(context, ip_policy):
                     id=model["ip_policy"]["id"], n_id=model["id"])
             model["ip_policy"] = db_api.ip_policy_create(context, **ipp)
 
+    cache.invalidate_all()
     return v._make_ip_policy_dict(model["ip_policy"])
 
 
@@ -120,6 +122,7 @@ def update_ip_policy(context, id, ip_policy):
             model["ip_policy"] = ipp_db
 
         ipp_db = db_api.ip_policy_update(context, ipp_db, **ipp)
+    cache.invalidate_all()
     return v._make_ip_policy_dict(ipp_db)
 
 
@@ -129,6 +132,6 @@ def delete_ip_policy(context, id):
         ipp = db_api.ip_policy_find(context, id=id, scope=db_api.ONE)
         if not ipp:
             raise quark_exceptions.IPPolicyNotFound(id=id)
-        if ipp["networks"] or ipp["subnets"]:
+        if db_api.ip_policy_in_use(context, id):
             raise quark_exceptions.IPPolicyInUse(id=id)
         db_api.ip_policy_delete(context, ipp)
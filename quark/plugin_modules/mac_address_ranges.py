@@ -90,7 +90,8 @@ def create_mac_address_range(context, mac_range):
 
 
 def _delete_mac_address_range(context, mac_address_range):
-    if mac_address_range.allocated_macs:
+    if db_api.mac_address_range_has_allocated_macs(
+            context, mac_address_range["id"]):
         raise quark_exceptions.MacAddressRangeInUse(
             mac_address_range_id=mac_address_range["id"])
     db_api.mac_address_range_delete(context, mac_address_range)
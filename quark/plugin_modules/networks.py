@@ -17,11 +17,11 @@ import netaddr
 
 from neutron.common import exceptions
 from neutron.extensions import providernet as pnet
-from neutron.openstack.common import importutils
 from neutron.openstack.common import log as logging
 from neutron.openstack.common import uuidutils
 from oslo.config import cfg
 
+from quark import cache
 from quark.db import api as db_api
 from quark.drivers import registry
 from quark import exceptions as q_exc
@@ -30,6 +30,7 @@ from quark import network_strategy
 from quark.plugin_modules import ports
 from quark.plugin_modules import subnets
 from quark import plugin_views as v
+from quark import quota_driver
 from quark import utils
 
 CONF = cfg.CONF
@@ -37,8 +38,6 @@ DEFAULT_ROUTE = netaddr.IPNetwork("0.0.0.0/0")
 LOG = logging.getLogger(__name__)
 STRATEGY = network_strategy.STRATEGY
 
-ipam_driver = (importutils.import_class(CONF.QUARK.ipam_driver))()
-
 
 def _adapt_provider_nets(context, network):
     #TODO(mdietz) going to ignore all the boundary and network
@@ -62,7 +61,12 @@ def create_network(context, network):
     """
     LOG.info("create_network for tenant %s" % context.tenant_id)
 
-    with context.session.begin():
+    quotas = [("network", context.tenant_id, 1)]
+    subs = network["network"].pop("subnets", [])
+    if subs:
+        quotas.append(("subnet", context.tenant_id, len(subs)))
+
+    with quota_driver.reserving(context, *quotas) as reservations:
         # Generate a uuid that we're going to hand to the backend and db
         net_attrs = network["network"]
         net_uuid = utils.pop_param(net_attrs, "id", None)
@@ -87,6 +91,13 @@ def create_network(context, network):
             raise q_exc.InvalidIpamStrategy(strat=ipam_strategy)
         net_attrs["ipam_strategy"] = ipam_strategy
 
+        subnet_selection = utils.pop_param(net_attrs, "subnet_selection")
+        selections = ipam.SUBNET_SELECTION_REGISTRY
+        if subnet_selection and not \
+                selections.is_valid_policy(subnet_selection):
+            raise q_exc.InvalidSubnetSelection(policy=subnet_selection)
+        net_attrs["subnet_selection"] = subnet_selection or None
+
         # NOTE(mdietz) I think ideally we would create the providernet
         # elsewhere as a separate driver step that could be
         # kept in a plugin and completely removed if desired. We could
@@ -99,8 +110,6 @@ def create_network(context, network):
                                   network_id=net_uuid, phys_type=pnet_type,
                                   phys_net=phys_net, segment_id=seg_id)
 
-        subs = net_attrs.pop("subnets", [])
-
         net_attrs["id"] = net_uuid
         net_attrs["tenant_id"] = context.tenant_id
         net_attrs["network_plugin"] = default_net_type
@@ -113,11 +122,14 @@ def create_network(context, network):
             s = db_api.subnet_create(context, **sub["subnet"])
             new_subnets.append(s)
         new_net["subnets"] = new_subnets
+        for reservation in reservations:
+            quota_driver.QuarkQuotaDriver.commit(context, reservation)
 
         #if not security_groups.get_security_groups(
         #        context,
         #        filters={"id": security_groups.DEFAULT_SG_UUID}):
         #    security_groups._create_default_security_group(context)
+    cache.invalidate(context, new_net.get("tenant_id"), net_uuid)
     return v._make_network_dict(new_net)
 
 
@@ -139,6 +151,7 @@ def update_network(context, id, network):
             raise exceptions.NetworkNotFound(net_id=id)
         net = db_api.network_update(context, net, **network["network"])
 
+    cache.invalidate(context, net.get("tenant_id"), id)
     return v._make_network_dict(net)
 
 
@@ -162,6 +175,7 @@ def get_network(context, id, fields=None):
     return v._make_network_dict(network)
 
 
+@cache.cached("networks")
 def get_networks(context, filters=None, fields=None):
     """Retrieve a list of networks.
 
@@ -221,13 +235,14 @@ def delete_network(context, id):
         net = db_api.network_find(context, id=id, scope=db_api.ONE)
         if not net:
             raise exceptions.NetworkNotFound(net_id=id)
-        if net.ports:
+        if db_api.network_has_ports(context, id):
             raise exceptions.NetworkInUse(net_id=id)
         net_driver = registry.DRIVER_REGISTRY.get_driver(net["network_plugin"])
         net_driver.delete_network(context, id)
         for subnet in net["subnets"]:
             subnets._delete_subnet(context, subnet)
         db_api.network_delete(context, net)
+    cache.invalidate(context, net.get("tenant_id"), id)
 
 
 def _diag_network(context, network, fields):
@@ -16,16 +16,19 @@
 import netaddr
 
 from neutron.common import exceptions
+from neutron.openstack.common import excutils
 from neutron.openstack.common import log as logging
 from neutron.openstack.common import uuidutils
-from neutron import quota
 from oslo.config import cfg
 
 from quark.db import api as db_api
+from quark.db import retry
 from quark.drivers import registry
 from quark import ipam
 from quark import network_strategy
+from quark.plugin_modules import routes
 from quark import plugin_views as v
+from quark import quota_driver
 from quark import utils
 
 CONF = cfg.CONF
@@ -33,6 +36,7 @@ LOG = logging.getLogger(__name__)
 STRATEGY = network_strategy.STRATEGY
 
 
+@retry.retry_on_lock_error
 def create_port(context, port):
     """Create a port
 
@@ -52,68 +56,92 @@ def create_port(context, port):
     net_id = port_attrs["network_id"]
     addresses = []
 
-    with context.session.begin():
-        port_id = uuidutils.generate_uuid()
-
-        net = db_api.network_find(context, id=net_id,
-                                  segment_id=segment_id, scope=db_api.ONE)
+    net = db_api.network_find(context, id=net_id, segment_id=segment_id,
+                              scope=db_api.ONE)
+    if not net:
+        # Maybe it's a tenant network
+        net = db_api.network_find(context, id=net_id, scope=db_api.ONE)
         if not net:
-            # Maybe it's a tenant network
-            net = db_api.network_find(context, id=net_id, scope=db_api.ONE)
-            if not net:
-                raise exceptions.NetworkNotFound(net_id=net_id)
-
-        if not STRATEGY.is_parent_network(net_id):
-            quota.QUOTAS.limit_check(
-                context, context.tenant_id,
-                ports_per_network=len(net.get('ports', [])) + 1)
-
-        ipam_driver = ipam.IPAM_REGISTRY.get_strategy(net["ipam_strategy"])
-        if fixed_ips:
-            for fixed_ip in fixed_ips:
-                subnet_id = fixed_ip.get("subnet_id")
-                ip_address = fixed_ip.get("ip_address")
-                if not (subnet_id and ip_address):
-                    raise exceptions.BadRequest(
-                        resource="fixed_ips",
-                        msg="subnet_id and ip_address required")
+            raise exceptions.NetworkNotFound(net_id=net_id)
+
+    quotas = []
+    if not STRATEGY.is_parent_network(net_id):
+        quotas.append(("ports_per_network", net_id, 1))
+
+    # NOTE(quark): the backend port is created inside the transaction, so
+    #              should that fail, and be replayed on a lock error, the
+    #              backend port has to go with it.
+    backend_port = None
+    try:
+        with quota_driver.reserving(context, *quotas) as reservations:
+            port_id = uuidutils.generate_uuid()
+
+            ipam_driver = ipam.IPAM_REGISTRY.get_strategy(net["ipam_strategy"])
+            # NOTE(quark): the MAC comes first so strategies can derive IPv6
+            #              addresses from it.
+            mac = ipam_driver.allocate_mac_address(context, net["id"], port_id,
+                                                   CONF.QUARK.ipam_reuse_after,
+                                                   mac_address=mac_address)
+            if fixed_ips:
+                for fixed_ip in fixed_ips:
+                    subnet_id = fixed_ip.get("subnet_id")
+                    ip_address = fixed_ip.get("ip_address")
+                    if not (subnet_id and ip_address):
+                        raise exceptions.BadRequest(
+                            resource="fixed_ips",
+                            msg="subnet_id and ip_address required")
+                addresses.extend(ipam_driver.allocate_ip_addresses(
+                    context, net["id"], port_id, CONF.QUARK.ipam_reuse_after,
+                    fixed_ips, mac_address=mac["address"],
+                    device_id=port_attrs.get("device_id")))
+            else:
                 addresses.extend(ipam_driver.allocate_ip_address(
                     context, net["id"], port_id, CONF.QUARK.ipam_reuse_after,
-                    ip_address=ip_address))
-        else:
-            addresses.extend(ipam_driver.allocate_ip_address(
-                context, net["id"], port_id, CONF.QUARK.ipam_reuse_after))
+                    mac_address=mac["address"],
+                    device_id=port_attrs.get("device_id")))
 
-        group_ids, security_groups = v.make_security_group_list(
-            context, port["port"].pop("security_groups", None))
-        mac = ipam_driver.allocate_mac_address(context, net["id"], port_id,
-                                               CONF.QUARK.ipam_reuse_after,
-                                               mac_address=mac_address)
-        mac_address_string = str(netaddr.EUI(mac['address'],
-                                             dialect=netaddr.mac_unix))
-        address_pairs = [{'mac_address': mac_address_string,
-                          'ip_address': address.get('address_readable', '')}
-                         for address in addresses]
-        net_driver = registry.DRIVER_REGISTRY.get_driver(net["network_plugin"])
-        backend_port = net_driver.create_port(context, net["id"],
-                                              port_id=port_id,
-                                              security_groups=group_ids,
-                                              allowed_pairs=address_pairs)
-
-        port_attrs["network_id"] = net["id"]
-        port_attrs["id"] = port_id
-        port_attrs["security_groups"] = security_groups
-
-        LOG.info("Including extra plugin attrs: %s" % backend_port)
-        port_attrs.update(backend_port)
-        new_port = db_api.port_create(
-            context, addresses=addresses, mac_address=mac["address"],
-            backend_key=backend_port["uuid"], **port_attrs)
-
-        # Include any driver specific bits
+            group_ids, security_groups = v.make_security_group_list(
+                context, port["port"].pop("security_groups", None))
+            mac_address_string = str(netaddr.EUI(mac['address'],
+                                                 dialect=netaddr.mac_unix))
+            address_pairs = [
+                {'mac_address': mac_address_string,
+                 'ip_address': address.get('address_readable', '')}
+                for address in addresses]
+            net_driver = registry.DRIVER_REGISTRY.get_driver(
+                net["network_plugin"])
+            backend_port = net_driver.create_port(
+                context, net["id"], port_id=port_id,
+                security_groups=group_ids, allowed_pairs=address_pairs)
+
+            port_attrs["network_id"] = net["id"]
+            port_attrs["id"] = port_id
+            port_attrs["security_groups"] = security_groups
+
+            LOG.info("Including extra plugin attrs: %s" % backend_port)
+            port_attrs.update(backend_port)
+            new_port = db_api.port_create(
+                context, addresses=addresses, mac_address=mac["address"],
+                backend_key=backend_port["uuid"], **port_attrs)
+            for reservation in reservations:
+                quota_driver.QuarkQuotaDriver.commit(context, reservation)
+    except Exception:
+        with excutils.save_and_reraise_exception():
+            if backend_port is not None:
+                _delete_backend_port(context, net_driver,
+                                     backend_port["uuid"])
+
+    # Include any driver specific bits
     return v._make_port_dict(new_port)
 
 
+def _delete_backend_port(context, net_driver, backend_key):
+    try:
+        net_driver.delete_port(context, backend_key)
+    except Exception:
+        LOG.exception("Failed to delete backend port %s" % backend_key)
+
+
 def update_port(context, id, port):
     """Update values of a port.
 
@@ -137,7 +165,6 @@ def update_port(context, id, port):
                 port_db["network"]["ipam_strategy"])
             ipam_driver.deallocate_ip_address(
                 context, port_db, ipam_reuse_after=CONF.QUARK.ipam_reuse_after)
-            addresses = []
             for fixed_ip in fixed_ips:
                 subnet_id = fixed_ip.get("subnet_id")
                 ip_address = fixed_ip.get("ip_address")
@@ -145,11 +172,11 @@ def update_port(context, id, port):
                     raise exceptions.BadRequest(
                         resource="fixed_ips",
                         msg="subnet_id and ip_address required")
-                # Note: we don't allow overlapping subnets, thus subnet_id is
-                #       ignored.
-                addresses.append(ipam_driver.allocate_ip_address(
-                    context, port_db["network_id"], id,
-                    CONF.QUARK.ipam_reuse_after, ip_address=ip_address))
+            addresses = ipam_driver.allocate_ip_addresses(
+                context, port_db["network_id"], id,
+                CONF.QUARK.ipam_reuse_after, fixed_ips,
+                mac_address=port_db["mac_address"],
+                device_id=port_db["device_id"])
             port["port"]["addresses"] = addresses
             mac_address_string = str(netaddr.EUI(port_db.mac_address,
                                                  dialect=netaddr.mac_unix))
@@ -205,12 +232,17 @@ def post_update_port(context, id, port):
                             address = ipam_driver.allocate_ip_address(
                                 context, port_db["network_id"], id,
                                 CONF.QUARK.ipam_reuse_after,
-                                ip_address=ip_address)
+                                ip_address=ip_address,
+                                device_id=port_db["device_id"])
                 else:
                     address = ipam_driver.allocate_ip_address(
                         context, port_db["network_id"], id,
-                        CONF.QUARK.ipam_reuse_after)
+                        CONF.QUARK.ipam_reuse_after,
+                        mac_address=port_db["mac_address"],
+                        device_id=port_db["device_id"])
 
+            if address["deallocated"]:
+                ipam.log_ip_event(context, address, "allocate", port_db)
             address["deallocated"] = 0
 
             already_contained = False
@@ -294,6 +326,22 @@ def get_ports_count(context, filters=None):
     return db_api.port_count_all(context, **filters)
 
 
+def get_ports_nw_info(context, device_ids):
+    """Retrieve the network info of every port on the given devices.
+
+    Returns each port with its fixed IPs and the subnets, routes, gateway
+    and DNS nameservers of those IPs, using a fixed number of queries.
+    : param context: neutron api request context
+    : param device_ids: a list of device ids, typically Nova instance uuids
+    """
+    LOG.info("get_ports_nw_info for tenant %s devices %s" %
+             (context.tenant_id, device_ids))
+    if not device_ids:
+        return []
+    ports = db_api.port_find_nw_info(context, device_ids)
+    return v._make_nw_info_list(ports, default_route=routes.DEFAULT_ROUTE)
+
+
 def delete_port(context, id):
     """Delete a port.
 
@@ -345,6 +393,7 @@ def disassociate_port(context, id, ip_address_id):
 
         if len(the_address["ports"]) == 0:
             the_address["deallocated"] = 1
+            ipam.log_ip_event(context, the_address, "deallocate", port)
     return v._make_port_dict(port)
 
 
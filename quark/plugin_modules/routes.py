@@ -16,10 +16,10 @@
 import netaddr
 
 from neutron.common import exceptions
-from neutron.openstack.common import importutils
 from neutron.openstack.common import log as logging
 from oslo.config import cfg
 
+from quark import cache
 from quark.db import api as db_api
 from quark import exceptions as quark_exceptions
 from quark import plugin_views as v
@@ -28,8 +28,6 @@ CONF = cfg.CONF
 DEFAULT_ROUTE = netaddr.IPNetwork("0.0.0.0/0")
 LOG = logging.getLogger(__name__)
 
-ipam_driver = (importutils.import_class(CONF.QUARK.ipam_driver))()
-
 
 def get_route(context, id):
     LOG.info("get_route %s for tenant %s" % (id, context.tenant_id))
@@ -54,19 +52,15 @@ def create_route(context, route):
         if not subnet:
             raise exceptions.SubnetNotFound(subnet_id=subnet_id)
 
-        # TODO(anyone): May want to denormalize the cidr values into columns
-        #               to achieve single db lookup on conflict check
         route_cidr = netaddr.IPNetwork(route["cidr"])
-        subnet_routes = db_api.route_find(context, subnet_id=subnet_id,
-                                          scope=db_api.ALL)
-        for sub_route in subnet_routes:
-            sub_route_cidr = netaddr.IPNetwork(sub_route["cidr"])
-            if sub_route_cidr.value == DEFAULT_ROUTE.value:
-                continue
-            if route_cidr in sub_route_cidr or sub_route_cidr in route_cidr:
-                raise quark_exceptions.RouteConflict(
-                    route_id=sub_route["id"], cidr=str(route_cidr))
+        bounds = route_cidr.ipv6()
+        conflicts = db_api.route_find_overlapping(context, subnet_id,
+                                                  bounds.first, bounds.last)
+        if conflicts:
+            raise quark_exceptions.RouteConflict(
+                route_id=conflicts[0][0], cidr=str(route_cidr))
         new_route = db_api.route_create(context, **route)
+    cache.invalidate_all()
     return v._make_route_dict(new_route)
 
 
@@ -80,3 +74,4 @@ def delete_route(context, id):
         if not route:
             raise quark_exceptions.RouteNotFound(route_id=id)
         db_api.route_delete(context, route)
+    cache.invalidate_all()
@@ -17,11 +17,11 @@ from neutron.common import exceptions
 from neutron.extensions import securitygroup as sg_ext
 from neutron.openstack.common import log as logging
 from neutron.openstack.common import uuidutils
-from neutron import quota
 from oslo.config import cfg
 
 from quark.db import api as db_api
 from quark import plugin_views as v
+from quark import quota_driver
 
 
 CONF = cfg.CONF
@@ -123,25 +123,24 @@ def create_security_group_rule(context, security_group_rule, net_driver):
     LOG.info("create_security_group for tenant %s" %
             (context.tenant_id))
 
-    with context.session.begin():
-        rule = _validate_security_group_rule(
-            context, security_group_rule["security_group_rule"])
-        rule["id"] = uuidutils.generate_uuid()
+    rule = _validate_security_group_rule(
+        context, security_group_rule["security_group_rule"])
+    rule["id"] = uuidutils.generate_uuid()
 
-        group_id = rule["security_group_id"]
-        group = db_api.security_group_find(context, id=group_id,
-                                           scope=db_api.ONE)
-        if not group:
-            raise sg_ext.SecurityGroupNotFound(group_id=group_id)
-
-        quota.QUOTAS.limit_check(
-            context, context.tenant_id,
-            security_rules_per_group=len(group.get("rules", [])) + 1)
+    group_id = rule["security_group_id"]
+    group = db_api.security_group_find(context, id=group_id,
+                                       scope=db_api.ONE)
+    if not group:
+        raise sg_ext.SecurityGroupNotFound(group_id=group_id)
 
+    with quota_driver.reserving(
+            context, ("security_rules_per_group", group_id, 1)) as \
+            reservations:
         net_driver.create_security_group_rule(context, group_id, rule)
+        new_rule = db_api.security_group_rule_create(context, **rule)
+        quota_driver.QuarkQuotaDriver.commit(context, reservations[0])
 
-    return v._make_security_group_rule_dict(
-        db_api.security_group_rule_create(context, **rule))
+    return v._make_security_group_rule_dict(new_rule)
 
 
 def delete_security_group(context, id, net_driver):
@@ -156,7 +155,7 @@ def delete_security_group(context, id, net_driver):
             raise sg_ext.SecurityGroupNotFound(group_id=id)
         if id == DEFAULT_SG_UUID or group.name == "default":
             raise sg_ext.SecurityGroupCannotRemoveDefault()
-        if group.ports:
+        if db_api.security_group_has_ports(context, id):
             raise sg_ext.SecurityGroupInUse(id=id)
         net_driver.delete_security_group(context, id)
         db_api.security_group_delete(context, group)
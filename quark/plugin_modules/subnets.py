@@ -17,17 +17,19 @@ import netaddr
 
 from neutron.common import config as neutron_cfg
 from neutron.common import exceptions
-from neutron.openstack.common import importutils
+from neutron.openstack.common.db import exception as db_exception
 from neutron.openstack.common import log as logging
 from neutron.openstack.common.notifier import api as notifier_api
 from neutron.openstack.common import timeutils
 
 from oslo.config import cfg
 
+from quark import cache
 from quark.db import api as db_api
 from quark import network_strategy
 from quark.plugin_modules import routes
 from quark import plugin_views as v
+from quark import quota_driver
 from quark import utils
 
 CONF = cfg.CONF
@@ -35,8 +37,6 @@ DEFAULT_ROUTE = netaddr.IPNetwork("0.0.0.0/0")
 LOG = logging.getLogger(__name__)
 STRATEGY = network_strategy.STRATEGY
 
-ipam_driver = (importutils.import_class(CONF.QUARK.ipam_driver))()
-
 
 def _validate_subnet_cidr(context, network_id, new_subnet_cidr):
     """Validate the CIDR for a subnet.
@@ -46,29 +46,31 @@ def _validate_subnet_cidr(context, network_id, new_subnet_cidr):
     CIDR if overlapping IPs are disabled.
 
     """
-    if neutron_cfg.cfg.CONF.allow_overlapping_ips:
-        return
+    new_subnet = netaddr.IPNetwork(new_subnet_cidr).ipv6()
+    first_ip, last_ip = new_subnet.first, new_subnet.last
 
-    new_subnet_ipset = netaddr.IPSet([new_subnet_cidr])
+    scope_network_id = network_id
+    if not neutron_cfg.cfg.CONF.allow_overlapping_ips:
+        scope_network_id = None
 
     # Using admin context here, in case we actually share networks later
-    subnet_list = db_api.subnet_find(context.elevated(),
-                                     network_id=network_id)
-    for subnet in subnet_list:
-        if (netaddr.IPSet([subnet.cidr]) & new_subnet_ipset):
-            # don't give out details of the overlapping subnet
-            err_msg = (_("Requested subnet with cidr: %(cidr)s for "
-                         "network: %(network_id)s overlaps with another "
-                         "subnet") %
-                       {'cidr': new_subnet_cidr,
-                        'network_id': network_id})
-            LOG.error(_("Validation for CIDR: %(new_cidr)s failed - "
-                        "overlaps with subnet %(subnet_id)s "
-                        "(CIDR: %(cidr)s)"),
-                      {'new_cidr': new_subnet_cidr,
-                       'subnet_id': subnet.id,
-                       'cidr': subnet.cidr})
-            raise exceptions.InvalidInput(error_message=err_msg)
+    overlapping = db_api.subnet_find_overlapping(context.elevated(),
+                                                 first_ip, last_ip,
+                                                 network_id=scope_network_id)
+    for subnet_id, cidr, sub_first, sub_last in overlapping:
+        # don't give out details of the overlapping subnet
+        err_msg = (_("Requested subnet with cidr: %(cidr)s for "
+                     "network: %(network_id)s overlaps with another "
+                     "subnet") %
+                   {'cidr': new_subnet_cidr,
+                    'network_id': network_id})
+        LOG.error(_("Validation for CIDR: %(new_cidr)s failed - "
+                    "overlaps with subnet %(subnet_id)s "
+                    "(CIDR: %(cidr)s)"),
+                  {'new_cidr': new_subnet_cidr,
+                   'subnet_id': subnet_id,
+                   'cidr': cidr})
+        raise exceptions.InvalidInput(error_message=err_msg)
 
 
 def create_subnet(context, subnet):
@@ -85,7 +87,8 @@ def create_subnet(context, subnet):
     LOG.info("create_subnet for tenant %s" % context.tenant_id)
     net_id = subnet["subnet"]["network_id"]
 
-    with context.session.begin():
+    with quota_driver.reserving(
+            context, ("subnet", context.tenant_id, 1)) as reservations:
         net = db_api.network_find(context, id=net_id, scope=db_api.ONE)
         if not net:
             raise exceptions.NetworkNotFound(net_id=net_id)
@@ -102,6 +105,7 @@ def create_subnet(context, subnet):
         sub_attrs["network"] = net
 
         new_subnet = db_api.subnet_create(context, **sub_attrs)
+        quota_driver.QuarkQuotaDriver.commit(context, reservations[0])
 
         default_route = None
         for route in host_routes:
@@ -137,6 +141,7 @@ def create_subnet(context, subnet):
     subnet_dict = v._make_subnet_dict(new_subnet,
                                       default_route=routes.DEFAULT_ROUTE)
     subnet_dict["gateway_ip"] = gateway_ip
+    cache.invalidate(context, net.get("tenant_id"), net_id)
 
     notifier_api.notify(context,
                         notifier_api.publisher_id("network"),
@@ -206,6 +211,8 @@ def update_subnet(context, id, subnet):
                 context, cidr=route["destination"], gateway=route["nexthop"]))
 
         subnet = db_api.subnet_update(context, subnet_db, **s)
+    cache.invalidate(context, subnet.get("tenant_id"),
+                     subnet.get("network_id"))
     return v._make_subnet_dict(subnet, default_route=routes.DEFAULT_ROUTE)
 
 
@@ -233,6 +240,7 @@ def get_subnet(context, id, fields=None):
     return v._make_subnet_dict(subnet, default_route=routes.DEFAULT_ROUTE)
 
 
+@cache.cached("subnets")
 def get_subnets(context, filters=None, fields=None):
     """Retrieve a list of subnets.
 
@@ -281,8 +289,50 @@ def get_subnets_count(context, filters=None):
     return db_api.subnet_count_all(context, **filters)
 
 
+def _rebuild_subnet_usage(context, subnet_ids):
+    usage = {}
+    usage_context = utils.detached_context(context)
+    try:
+        for subnet_id in subnet_ids:
+            try:
+                with usage_context.session.begin():
+                    usage[subnet_id] = db_api.subnet_usage_rebuild(
+                        usage_context, subnet_id)
+            except db_exception.DBDuplicateEntry:
+                # Another worker rebuilt it first
+                usage.update(db_api.subnet_usage_find(usage_context,
+                                                      [subnet_id]))
+    finally:
+        usage_context.session.close()
+    return usage
+
+
+def get_subnets_usage(context, filters=None):
+    """Report how much of each subnet is in use.
+
+    Counts come from the per-subnet usage rows kept up to date on every
+    IP address flush, so no allocation lock is taken. Subnets created
+    before those rows existed get them rebuilt on first request.
+    : param context: neutron api request context
+    : param filters: a dictionary of subnet filters, such as id or
+        network_id.
+    """
+    LOG.info("get_subnets_usage for tenant %s with filters %s" %
+             (context.tenant_id, filters))
+    subnets = db_api.subnet_find(context, **(filters or {}))
+    subnet_ids = [subnet["id"] for subnet in subnets]
+    usage = db_api.subnet_usage_find(context, subnet_ids)
+    missing = [subnet_id for subnet_id in subnet_ids
+               if subnet_id not in usage]
+    if missing:
+        usage.update(_rebuild_subnet_usage(context, missing))
+    cooling_down = db_api.ip_address_count_cooling_down(
+        context, subnet_ids, CONF.QUARK.ipam_reuse_after)
+    return v._make_subnet_usage(subnets, usage, cooling_down)
+
+
 def _delete_subnet(context, subnet):
-    if subnet.allocated_ips:
+    if db_api.subnet_has_allocated_ips(context, subnet["id"]):
         raise exceptions.SubnetInUse(subnet_id=subnet["id"])
     db_api.subnet_delete(context, subnet)
 
@@ -311,6 +361,8 @@ def delete_subnet(context, id):
                             "ip_block.delete",
                             notifier_api.CONF.default_notification_level,
                             payload)
+    cache.invalidate(context, subnet.get("tenant_id"),
+                     subnet.get("network_id"))
 
 
 def diagnose_subnet(context, id, fields):
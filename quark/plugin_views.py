@@ -24,6 +24,7 @@ from neutron.openstack.common import log as logging
 
 from quark.db import api as db_api
 from quark.db import models
+from quark import formatters
 from quark import network_strategy
 from quark import utils
 
@@ -38,6 +39,7 @@ def _make_network_dict(network, fields=None):
            "tenant_id": network.get("tenant_id"),
            "admin_state_up": None,
            "ipam_strategy": network.get("ipam_strategy"),
+           "subnet_selection": network.get("subnet_selection"),
            "status": "ACTIVE",
            "shared": shared_net,
            #TODO(mdietz): this is the expected return. Then the client
@@ -70,7 +72,7 @@ def _pools_from_cidr(cidr):
 
 
 def _make_subnet_dict(subnet, default_route=None, fields=None):
-    dns_nameservers = [str(netaddr.IPAddress(dns["ip"]))
+    dns_nameservers = [formatters.format_ip(dns["ip"])
                        for dns in subnet.get("dns_nameservers")]
     net_id = STRATEGY.get_parent_network(subnet["network_id"])
 
@@ -96,15 +98,14 @@ def _make_subnet_dict(subnet, default_route=None, fields=None):
                 "nexthop": route["gateway"]}
 
     res["host_routes"] = [_host_route(r) for r in subnet["routes"]]
+    res["gateway_ip"] = _default_gateway(subnet, default_route)
+    return res
+
 
-    #TODO(mdietz): really inefficient, should go away
-    res["gateway_ip"] = None
+def _default_gateway(subnet, default_route):
     for route in subnet["routes"]:
-        netroute = netaddr.IPNetwork(route["cidr"])
-        if netroute.value == default_route.value:
-            res["gateway_ip"] = route["gateway"]
-            break
-    return res
+        if route["prefix"] == default_route.prefixlen:
+            return route["gateway"]
 
 
 def _make_security_group_dict(security_group, fields=None):
@@ -145,8 +146,7 @@ def _port_dict(port, fields=None):
            "device_owner": port.get("device_owner")}
 
     if "mac_address" in res and res["mac_address"]:
-        mac = str(netaddr.EUI(res["mac_address"])).replace('-', ':')
-        res["mac_address"] = mac
+        res["mac_address"] = formatters.format_mac(res["mac_address"])
 
     #NOTE(mdietz): more pythonic key in dict check fails here. Leave as get
     if port.get("bridge"):
@@ -176,6 +176,41 @@ def _make_ports_list(query, fields=None):
     return ports
 
 
+def _make_nw_info_subnet_dict(subnet, default_route=None):
+    """Subnet view for nw_info, without the allocation pools.
+
+    Nova never consumes the pools and computing them pulls in IP policies.
+    """
+    res = {"id": subnet["id"],
+           "network_id": STRATEGY.get_parent_network(subnet["network_id"]),
+           "cidr": subnet["cidr"],
+           "ip_version": subnet["ip_version"],
+           "gateway_ip": _default_gateway(subnet, default_route),
+           "dns_nameservers": [formatters.format_ip(dns["ip"])
+                               for dns in subnet["dns_nameservers"]],
+           "host_routes": [{"destination": route["cidr"],
+                            "nexthop": route["gateway"]}
+                           for route in subnet["routes"]]}
+    return res
+
+
+def _make_nw_info_list(ports, default_route=None):
+    nw_info = []
+    for port in ports:
+        port_dict = _make_port_dict(port)
+        seen = set()
+        port_dict["subnets"] = []
+        for address in port.ip_addresses:
+            subnet = address.subnet
+            if subnet is None or subnet["id"] in seen:
+                continue
+            seen.add(subnet["id"])
+            port_dict["subnets"].append(_make_nw_info_subnet_dict(
+                subnet, default_route=default_route))
+        nw_info.append(port_dict)
+    return nw_info
+
+
 def _make_subnets_list(query, default_route=None, fields=None):
     subnets = []
     for subnet in query:
@@ -185,6 +220,42 @@ def _make_subnets_list(query, default_route=None, fields=None):
     return subnets
 
 
+def _make_subnet_usage_dict(subnet, usage, cooling_down):
+    allocated, deallocated = usage
+    policy_excluded = models.IPPolicy.get_ip_policy_rule_set(subnet).size
+    total = netaddr.IPNetwork(subnet["cidr"]).size
+    return {"subnet_id": subnet["id"],
+            "network_id": STRATEGY.get_parent_network(subnet["network_id"]),
+            "total": total,
+            "allocated": allocated,
+            "reusable": deallocated - cooling_down,
+            "cooling_down": cooling_down,
+            "policy_excluded": policy_excluded,
+            "available": max(total - allocated - deallocated -
+                             policy_excluded, 0)}
+
+
+def _make_subnet_usage(subnets, usage, cooling_down):
+    """Per-subnet usage, plus the same counts summed per network."""
+    counters = ("total", "allocated", "reusable", "cooling_down",
+                "policy_excluded", "available")
+    subnet_usage = []
+    network_usage = {}
+    for subnet in subnets:
+        subnet_dict = _make_subnet_usage_dict(
+            subnet, usage.get(subnet["id"], (0, 0)),
+            cooling_down.get(subnet["id"], 0))
+        subnet_usage.append(subnet_dict)
+        network_id = subnet_dict["network_id"]
+        network_dict = network_usage.setdefault(
+            network_id, dict([("network_id", network_id)] +
+                             [(counter, 0) for counter in counters]))
+        for counter in counters:
+            network_dict[counter] += subnet_dict[counter]
+    return {"subnet_usage": subnet_usage,
+            "network_usage": network_usage.values()}
+
+
 def _make_mac_range_dict(mac_range):
     return {"id": mac_range["id"],
             "cidr": mac_range["cidr"]}
@@ -211,6 +282,18 @@ def _make_ip_dict(address):
             "shared": len(address["ports"]) > 1}
 
 
+def _make_ip_address_event_dict(event):
+    return {"event": event["event"],
+            "address": event["address_readable"],
+            "ip_address_id": event["ip_address_id"],
+            "subnet_id": event["subnet_id"],
+            "network_id": STRATEGY.get_parent_network(event["network_id"]),
+            "tenant_id": event["tenant_id"],
+            "port_id": event["port_id"],
+            "device_id": event["device_id"],
+            "occurred_at": event["occurred_at"]}
+
+
 def _make_ip_policy_dict(ipp):
     excludes = [dict(offset=range["offset"], length=range["length"])
                 for range in ipp["exclude"]]
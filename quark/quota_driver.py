@@ -15,7 +15,39 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import contextlib
+import datetime
+import threading
+import time
+
+from neutron.common import exceptions
+from neutron import context as neutron_context
 from neutron.db import quota_db
+from neutron.openstack.common import excutils
+from neutron.openstack.common import log as logging
+from neutron.openstack.common import timeutils
+from neutron import quota
+from oslo.config import cfg
+
+from quark.db import api as db_api
+
+LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
+
+quark_opts = [
+    cfg.IntOpt('quota_reservation_expire',
+               default=300,
+               help=_("Seconds an uncommitted quota reservation holds "
+                      "capacity before it is dropped")),
+    cfg.IntOpt('quota_usage_resync_interval',
+               default=0,
+               help=_("Seconds between recounts of the tracked quota usage. "
+                      "0 disables the periodic resync"))
+]
+CONF.register_opts(quark_opts, "QUOTAS")
+
+_RESYNC = None
+_RESYNC_LOCK = threading.Lock()
 
 
 class QuarkQuotaDriver(quota_db.DbQuotaDriver):
@@ -23,8 +55,87 @@ class QuarkQuotaDriver(quota_db.DbQuotaDriver):
     information.
 
     The default driver utilizes the local database.
+
+    Usage of the resources in db_api.QUOTA_USAGE_SCOPES is tracked in
+    quark_quota_usages, so checking them is a single locked row read
+    rather than a count of the live tables. The check commits a
+    reservation before the transaction creating the resources begins, so
+    the row is not held locked while they are built on the backends.
     """
 
+    @staticmethod
+    def reserve(context, tenant_id, resource, scope_id, delta=1):
+        """Holds delta of resource in scope_id against the tenant's limit.
+
+        Checks and reserves in a transaction of its own, which drops the
+        scope's expired reservations on the way, so the usage row is only
+        locked for the check. It runs on the context's session and must
+        not be called inside a transaction; see reserving(). Returns the id
+        of the reservation to commit in the transaction creating the
+        resources, None if the resource isn't tracked.
+        """
+        if resource not in db_api.QUOTA_USAGE_SCOPES or \
+                resource not in quota.QUOTAS.resources:
+            return None
+        with context.session.begin():
+            usage = db_api.quota_usage_find_for_update(
+                context, resource, scope_id, tenant_id)
+            now = timeutils.utcnow()
+            for expired in db_api.quota_reservation_find_expired(
+                    context, now, usage_id=usage["id"]):
+                db_api.quota_reservation_delete(context, expired["id"])
+            limit = QuarkQuotaDriver.get_tenant_quotas(
+                context, quota.QUOTAS.resources, tenant_id)[resource]
+            if limit >= 0 and \
+                    usage["in_use"] + usage["reserved"] + delta > limit:
+                raise exceptions.OverQuota(overs=[resource])
+            expires_at = now + datetime.timedelta(
+                seconds=CONF.QUOTAS.quota_reservation_expire)
+            reservation = db_api.quota_reservation_create(
+                context, usage, delta, expires_at)
+        return reservation["id"]
+
+    @staticmethod
+    def commit(context, reservation):
+        """Releases a reservation once its resources exist.
+
+        Belongs in the transaction creating them: in_use follows the rows
+        themselves, so the reserved amount is given back as they land.
+        """
+        if reservation is None:
+            return
+        with context.session.begin(subtransactions=True):
+            db_api.quota_reservation_delete(context, reservation)
+
+    @staticmethod
+    def rollback(context, reservation):
+        """Releases a reservation whose resources were never created.
+
+        Runs in a transaction of its own on the context's session, once
+        the failed one is over. Should that fail too, the reservation is
+        dropped when it expires.
+        """
+        if reservation is None:
+            return
+        try:
+            with context.session.begin():
+                db_api.quota_reservation_delete(context, reservation)
+        except Exception:
+            LOG.exception("Failed to release quota reservation %s" %
+                          reservation)
+
+    @staticmethod
+    def resync(context):
+        """Drops expired reservations and recounts all tracked usage."""
+        with context.session.begin():
+            expired = db_api.quota_reservation_find_expired(
+                context, timeutils.utcnow())
+            for reservation in expired:
+                db_api.quota_reservation_delete(context, reservation["id"])
+            for resource in db_api.QUOTA_USAGE_SCOPES:
+                db_api.quota_usage_refresh(context, resource)
+        return len(expired)
+
     @staticmethod
     def delete_tenant_quota(context, tenant_id):
         """Delete the quota entries for a given tenant_id.
@@ -47,3 +158,64 @@ class QuarkQuotaDriver(quota_db.DbQuotaDriver):
                                           resource=resource,
                                           limit=limit)
             context.session.add(tenant_quota)
+
+
+@contextlib.contextmanager
+def reserving(context, *requests):
+    """Reserves quota, then runs the transaction creating the resources.
+
+    Each request is a (resource, scope_id, delta) tuple, reserved for the
+    context's tenant before the transaction begins, on the same session.
+    Yields the reservation ids in request order for the transaction to
+    commit. They are rolled back should it, or a later reservation, fail.
+    """
+    reservations = []
+    try:
+        for resource, scope_id, delta in requests:
+            reservations.append(QuarkQuotaDriver.reserve(
+                context, context.tenant_id, resource, scope_id, delta))
+        with context.session.begin():
+            yield reservations
+    except Exception:
+        with excutils.save_and_reraise_exception():
+            for reservation in reservations:
+                QuarkQuotaDriver.rollback(context, reservation)
+
+
+class QuotaUsageResync(object):
+    """Runs QuarkQuotaDriver.resync() from a daemon thread."""
+    def __init__(self):
+        self.thread = threading.Thread(target=self._run,
+                                       name="quark-quota-resync")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(CONF.QUOTAS.quota_usage_resync_interval)
+            context = neutron_context.get_admin_context()
+            try:
+                QuarkQuotaDriver.resync(context)
+            except Exception:
+                LOG.exception("Failed to resync quota usage")
+            finally:
+                context.session.close()
+
+
+def start():
+    """Starts this process' quota usage resync if one is configured."""
+    global _RESYNC
+    if CONF.QUOTAS.quota_usage_resync_interval <= 0:
+        return None
+    if _RESYNC is None:
+        with _RESYNC_LOCK:
+            if _RESYNC is None:
+                _RESYNC = QuotaUsageResync()
+    return _RESYNC
+
+
+def reset():
+    """Forgets the resync thread, e.g. after a fork where it is gone."""
+    global _RESYNC
+    with _RESYNC_LOCK:
+        _RESYNC = None
@@ -0,0 +1,121 @@
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from neutron import context
+from neutron.db import api as neutron_db_api
+from neutron.openstack.common.db.sqlalchemy import session as neutron_session
+import netaddr
+from oslo.config import cfg
+import unittest2
+
+from quark.db import api as db_api
+from quark.db import locks
+from quark.db import models
+
+
+class QuarkDBAPIFunctionalTest(unittest2.TestCase):
+    def setUp(self):
+        self.context = context.Context('fake', 'fake', is_admin=False)
+        super(QuarkDBAPIFunctionalTest, self).setUp()
+
+        cfg.CONF.set_override('connection', 'sqlite://', 'database')
+        neutron_db_api.configure_db()
+        models.BASEV2.metadata.create_all(neutron_session._ENGINE)
+
+    def tearDown(self):
+        neutron_db_api.clear_db()
+
+
+class QuarkFindOverlappingSubnets(QuarkDBAPIFunctionalTest):
+    def _create_subnets(self, *cidrs):
+        with self.context.session.begin():
+            for cidr in cidrs:
+                network = db_api.network_create(
+                    self.context, name="public", tenant_id="fake",
+                    network_plugin="BASE")
+                db_api.subnet_create(self.context, network=network,
+                                     cidr=cidr, tenant_id="fake")
+
+    def _find(self, cidr, network_id=None):
+        bounds = netaddr.IPNetwork(cidr).ipv6()
+        return [row[1] for row in db_api.subnet_find_overlapping(
+            self.context, bounds.first, bounds.last, network_id=network_id)]
+
+    def test_overlaps_across_networks(self):
+        self._create_subnets("10.0.0.0/24", "192.168.0.0/24")
+        self.assertEqual(self._find("10.0.0.128/25"), ["10.0.0.0/24"])
+
+    def test_overlaps_scoped_to_network(self):
+        self._create_subnets("10.0.0.0/24")
+        self.assertEqual(self._find("10.0.0.0/16", network_id="other"), [])
+
+    def test_neighbouring_ipv6_ranges_do_not_overlap(self):
+        self._create_subnets("2001:db8::/64", "2001:db8:0:2::/64")
+        self.assertEqual(self._find("2001:db8:0:1::/64"), [])
+        self.assertEqual(self._find("2001:db8:0:1::/63"), ["2001:db8::/64"])
+
+
+class QuarkFindOverlappingRoutes(QuarkDBAPIFunctionalTest):
+    def test_neighbouring_ipv6_routes_do_not_overlap(self):
+        with self.context.session.begin():
+            network = db_api.network_create(
+                self.context, name="public", tenant_id="fake",
+                network_plugin="BASE")
+            subnet = db_api.subnet_create(self.context, network=network,
+                                          cidr="2001:db8::/32",
+                                          tenant_id="fake")
+            for cidr in ("2001:db8::/64", "2001:db8:0:2::/64", "::/0"):
+                db_api.route_create(self.context, subnet_id=subnet["id"],
+                                    cidr=cidr, gateway="2001:db8::1")
+        bounds = netaddr.IPNetwork("2001:db8:0:1::/64").ipv6()
+        self.assertEqual(db_api.route_find_overlapping(
+            self.context, subnet["id"], bounds.first, bounds.last), [])
+        bounds = netaddr.IPNetwork("2001:db8::/63").ipv6()
+        routes = db_api.route_find_overlapping(
+            self.context, subnet["id"], bounds.first, bounds.last)
+        self.assertEqual(len(routes), 1)
+
+
+class QuarkLockRows(QuarkDBAPIFunctionalTest):
+    def _lock_names(self):
+        return sorted(row[0] for row in
+                      self.context.session.query(models.Lock.name))
+
+    def test_lock_rows_follow_subnets_and_mac_ranges(self):
+        with self.context.session.begin():
+            network = db_api.network_create(
+                self.context, name="public", tenant_id="fake",
+                network_plugin="BASE")
+            subnet = db_api.subnet_create(self.context, network=network,
+                                          cidr="10.0.0.0/24",
+                                          tenant_id="fake")
+            rng = db_api.mac_address_range_create(
+                self.context, cidr="AA:BB:CC/24", first_address=0,
+                last_address=255, next_auto_assign_mac=0)
+        self.assertEqual(self._lock_names(), sorted(
+            [locks.subnet_lock_name(subnet["id"]),
+             locks.mac_range_lock_name(rng["id"])]))
+
+        with self.context.session.begin():
+            db_api.subnet_delete(self.context, subnet)
+            db_api.mac_address_range_delete(self.context, rng)
+        self.assertEqual(self._lock_names(), [])
+
+    def test_table_lock_manager_creates_missing_row(self):
+        with locks.TableLockManager().begin(self.context, "quark_old"):
+            pass
+        with locks.TableLockManager().begin(self.context, "quark_old"):
+            pass
+        self.assertEqual(self._lock_names(), ["quark_old"])
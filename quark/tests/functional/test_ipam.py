@@ -14,11 +14,15 @@
 # limitations under the License.
 
 import contextlib
+import datetime
 
+import netaddr
 from neutron import context
 from neutron.db import api as neutron_db_api
 from neutron.openstack.common.db.sqlalchemy import session as neutron_session
+from neutron.openstack.common import timeutils
 from oslo.config import cfg
+from sqlalchemy import event
 import unittest2
 
 from quark.db import api as db_api
@@ -33,8 +37,22 @@ class QuarkIpamBaseFunctionalTest(unittest2.TestCase):
 
         cfg.CONF.set_override('connection', 'sqlite://', 'database')
         neutron_db_api.configure_db()
+        self._enable_savepoints(neutron_session._ENGINE)
         models.BASEV2.metadata.create_all(neutron_session._ENGINE)
 
+    def _enable_savepoints(self, engine):
+        # NOTE(quark): pysqlite commits on its own ahead of a SAVEPOINT,
+        #              which loses the allocation savepoints. Let
+        #              SQLAlchemy emit BEGIN itself instead.
+        def _checkout(dbapi_connection, connection_record, proxy):
+            dbapi_connection.isolation_level = None
+
+        def _begin(connection):
+            connection.execute("BEGIN")
+
+        event.listen(engine, "checkout", _checkout)
+        event.listen(engine, "begin", _begin)
+
     def tearDown(self):
         neutron_db_api.clear_db()
 
@@ -62,3 +80,26 @@ class QuarkIPAddressAllocate(QuarkIpamBaseFunctionalTest):
                                                       0, 0)
             self.assertIsNotNone(ipaddress[0]['id'])
             self.assertEqual(ipaddress[0]['address'], 2)
+
+    def test_allocate_batch_reuses_deallocated_for_auto_requests(self):
+        network = dict(name="public", tenant_id="fake")
+        subnet = dict(id=1, ip_version=4, next_auto_assign_ip=2,
+                      cidr="0.0.0.0/24", first_ip=0, last_ip=255,
+                      ip_policy=None, tenant_id="fake")
+        with self._stubs(network, subnet) as net:
+            deallocated_at = timeutils.utcnow() - datetime.timedelta(days=1)
+            with self.context.session.begin():
+                for addr in ("0.0.0.5", "0.0.0.7"):
+                    address = db_api.ip_address_create(
+                        self.context, address=netaddr.IPAddress(addr),
+                        subnet_id=1, network_id=net["id"], version=4)
+                    db_api.ip_address_update(
+                        self.context, address, deallocated=True,
+                        deallocated_at=deallocated_at)
+            requests = [dict(version=4), dict(ip_address="0.0.0.5"),
+                        dict(version=4)]
+            addresses = self.ipam.allocate_ip_addresses(
+                self.context, net["id"], 0, 0, requests)
+            self.assertEqual([a["address_readable"] for a in addresses],
+                             ["0.0.0.7", "0.0.0.5", "0.0.0.2"])
+            self.assertFalse(any(a["_deallocated"] for a in addresses))
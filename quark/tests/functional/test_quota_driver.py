@@ -0,0 +1,105 @@
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+
+import mock
+from neutron.common import exceptions
+from neutron import context
+from neutron.db import api as neutron_db_api
+from neutron.openstack.common.db.sqlalchemy import session as neutron_session
+from oslo.config import cfg
+from sqlalchemy import event
+import unittest2
+
+from quark.db import api as db_api
+from quark.db import models
+from quark import quota_driver
+
+
+class QuarkQuotaDriverFunctionalTest(unittest2.TestCase):
+    def setUp(self):
+        self.context = context.Context('fake', 'fake', is_admin=False)
+        super(QuarkQuotaDriverFunctionalTest, self).setUp()
+
+        cfg.CONF.set_override('connection', 'sqlite://', 'database')
+        neutron_db_api.configure_db()
+        self._enable_savepoints(neutron_session._ENGINE)
+        models.BASEV2.metadata.create_all(neutron_session._ENGINE)
+        self.driver = quota_driver.QuarkQuotaDriver
+
+    def _enable_savepoints(self, engine):
+        # NOTE(quark): pysqlite commits on its own ahead of a SAVEPOINT,
+        #              which loses the usage row savepoint. Let
+        #              SQLAlchemy emit BEGIN itself instead.
+        def _checkout(dbapi_connection, connection_record, proxy):
+            dbapi_connection.isolation_level = None
+
+        def _begin(connection):
+            connection.execute("BEGIN")
+
+        event.listen(engine, "checkout", _checkout)
+        event.listen(engine, "begin", _begin)
+
+    def tearDown(self):
+        neutron_db_api.clear_db()
+
+    @contextlib.contextmanager
+    def _stubs(self, limit=1):
+        with contextlib.nested(
+            mock.patch("neutron.quota.QUOTAS"),
+            mock.patch("quark.quota_driver.QuarkQuotaDriver."
+                       "get_tenant_quotas")
+        ) as (quotas, get_quotas):
+            quotas.resources = {"ports_per_network": None}
+            get_quotas.return_value = {"ports_per_network": limit}
+            yield
+
+    def _usage(self):
+        self.context.session.expire_all()
+        return db_api.quota_usage_find(self.context, "ports_per_network",
+                                       "net")
+
+
+class QuarkQuotaReserve(QuarkQuotaDriverFunctionalTest):
+    def test_reserve_counts_unseen_scope(self):
+        with self._stubs():
+            reservation = self.driver.reserve(self.context, "fake",
+                                              "ports_per_network", "net")
+        self.assertFalse(self.context.session.is_active)
+        usage = self._usage()
+        self.assertEqual(usage["in_use"], 0)
+        self.assertEqual(usage["reserved"], 1)
+        self.assertEqual(usage.reservations[0]["id"], reservation)
+
+    def test_reserve_counts_unseen_scope_once(self):
+        with self._stubs():
+            self.driver.reserve(self.context, "fake", "ports_per_network",
+                                "net")
+            with self.assertRaises(exceptions.OverQuota):
+                self.driver.reserve(self.context, "fake",
+                                    "ports_per_network", "net")
+        usage = self._usage()
+        self.assertEqual(usage["reserved"], 1)
+        self.assertEqual(len(usage.reservations), 1)
+
+    def test_rollback_releases_reservation(self):
+        with self._stubs():
+            reservation = self.driver.reserve(self.context, "fake",
+                                              "ports_per_network", "net")
+            self.driver.rollback(self.context, reservation)
+        usage = self._usage()
+        self.assertEqual(usage["reserved"], 0)
+        self.assertEqual(usage.reservations, [])
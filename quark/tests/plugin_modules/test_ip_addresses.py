@@ -14,6 +14,7 @@
 #  under the License.
 
 import contextlib
+import datetime
 
 import mock
 from neutron.common import exceptions
@@ -232,3 +233,48 @@ class TestQuarkGetIpAddresses(test_quark_plugin.TestQuarkPlugin):
         with self._stubs(ips=None, ports=[port]):
             with self.assertRaises(quark_exceptions.IpAddressNotFound):
                 self.plugin.get_ip_address(self.context, 1)
+
+
+class TestQuarkGetIpAddressEvents(test_quark_plugin.TestQuarkPlugin):
+    @contextlib.contextmanager
+    def _stubs(self, events):
+        with mock.patch("quark.db.api.ip_address_event_find") as event_find:
+            event_models = []
+            for event in events:
+                event_mod = models.IPAddressEvent()
+                event_mod.update(event)
+                event_models.append(event_mod)
+            event_find.return_value = event_models
+            yield event_find
+
+    def test_get_ip_address_events(self):
+        event = dict(id=1, event="allocate", address_readable="192.168.1.100",
+                     ip_address_id=1, subnet_id=1, network_id=2,
+                     tenant_id="fake", port_id=100, device_id="foobar",
+                     occurred_at=datetime.datetime(2013, 10, 1))
+        with self._stubs([event]) as event_find:
+            res = self.plugin.get_ip_address_events(
+                self.context, 2, "192.168.1.100",
+                start="2013-09-01T00:00:00Z")
+            event_find.assert_called_once_with(
+                self.context, 2, "192.168.1.100",
+                start=datetime.datetime(2013, 9, 1), end=None,
+                tenant_id=self.context.tenant_id)
+            self.assertEqual(len(res), 1)
+            self.assertEqual(res[0]["event"], "allocate")
+            self.assertEqual(res[0]["address"], "192.168.1.100")
+            self.assertEqual(res[0]["device_id"], "foobar")
+
+    def test_get_ip_address_events_admin_sees_all_tenants(self):
+        with self._stubs([]) as event_find:
+            self.context.is_admin = True
+            res = self.plugin.get_ip_address_events(self.context, 2,
+                                                    "192.168.1.100")
+            self.assertEqual(res, [])
+            self.assertIsNone(event_find.call_args[1]["tenant_id"])
+
+    def test_get_ip_address_events_bad_time_fails(self):
+        with self._stubs([]):
+            with self.assertRaises(exceptions.BadRequest):
+                self.plugin.get_ip_address_events(
+                    self.context, 2, "192.168.1.100", end="yesterday")
@@ -270,8 +270,12 @@ class TestQuarkDeleteIpPolicies(test_quark_plugin.TestQuarkPlugin):
         with contextlib.nested(
             mock.patch("%s.ip_policy_find" % db_mod),
             mock.patch("%s.ip_policy_delete" % db_mod),
-        ) as (ip_policy_find, ip_policy_delete):
+            mock.patch("%s.ip_policy_in_use" % db_mod)
+        ) as (ip_policy_find, ip_policy_delete, in_use):
             ip_policy_find.return_value = ip_policy
+            in_use.return_value = bool(ip_policy and
+                                       (ip_policy.get("networks") or
+                                        ip_policy.get("subnets")))
             yield ip_policy_find, ip_policy_delete
 
     def test_delete_ip_policy_not_found(self):
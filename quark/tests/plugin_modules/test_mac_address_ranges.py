@@ -122,13 +122,15 @@ class TestQuarkCreateMacAddressRanges(test_quark_plugin.TestQuarkPlugin):
 
 class TestQuarkDeleteMacAddressRanges(test_quark_plugin.TestQuarkPlugin):
     @contextlib.contextmanager
-    def _stubs(self, mac_range):
+    def _stubs(self, mac_range, in_use=False):
         db_mod = "quark.db.api"
         with contextlib.nested(
             mock.patch("%s.mac_address_range_find" % db_mod),
             mock.patch("%s.mac_address_range_delete" % db_mod),
-        ) as (mar_find, mar_delete):
+            mock.patch("%s.mac_address_range_has_allocated_macs" % db_mod)
+        ) as (mar_find, mar_delete, has_macs):
             mar_find.return_value = mac_range
+            has_macs.return_value = in_use
             yield mar_delete
 
     def test_mac_address_range_delete_not_found(self):
@@ -139,15 +141,13 @@ class TestQuarkDeleteMacAddressRanges(test_quark_plugin.TestQuarkPlugin):
     def test_mac_address_range_delete_in_use(self):
         mar = mock.MagicMock()
         mar.id = 1
-        mar.allocated_macs = 1
-        with self._stubs(mar):
+        with self._stubs(mar, in_use=True):
             with self.assertRaises(quark_exceptions.MacAddressRangeInUse):
                 self.plugin.delete_mac_address_range(self.context, 1)
 
     def test_mac_address_range_delete_success(self):
         mar = mock.MagicMock()
         mar.id = 1
-        mar.allocated_macs = 0
         with self._stubs(mar) as mar_delete:
             resp = self.plugin.delete_mac_address_range(self.context, 1)
             self.assertIsNone(resp)
@@ -203,9 +203,12 @@ class TestQuarkDeleteNetwork(test_quark_plugin.TestQuarkPlugin):
             mock.patch("%s.network_find" % db_mod),
             mock.patch("%s.network_delete" % db_mod),
             mock.patch("quark.drivers.base.BaseDriver.delete_network"),
-            mock.patch("%s.subnet_delete" % db_mod)
-        ) as (net_find, net_delete, driver_net_delete, subnet_del):
+            mock.patch("%s.subnet_delete" % db_mod),
+            mock.patch("%s.network_has_ports" % db_mod)
+        ) as (net_find, net_delete, driver_net_delete, subnet_del,
+              has_ports):
             net_find.return_value = net_mod
+            has_ports.return_value = bool(port_mods)
             yield net_delete
 
     def test_delete_network(self):
@@ -269,7 +272,7 @@ class TestQuarkCreateNetwork(test_quark_plugin.TestQuarkPlugin):
         with self._stubs(net=net) as net_create:
             net = self.plugin.create_network(self.context, dict(network=net))
             self.assertTrue(net_create.called)
-            self.assertEqual(len(net.keys()), 8)
+            self.assertEqual(len(net.keys()), 9)
             self.assertIsNotNone(net["id"])
             self.assertEqual(net["name"], "public")
             self.assertIsNone(net["admin_state_up"])
@@ -287,7 +290,7 @@ class TestQuarkCreateNetwork(test_quark_plugin.TestQuarkPlugin):
             net.update(dict(subnets=[dict(subnet=subnet)]))
             net = self.plugin.create_network(self.context, dict(network=net))
             self.assertTrue(net_create.called)
-            self.assertEqual(len(net.keys()), 8)
+            self.assertEqual(len(net.keys()), 9)
             self.assertIsNotNone(net["id"])
             self.assertEqual(net["name"], "public")
             self.assertIsNone(net["admin_state_up"])
@@ -336,6 +339,21 @@ class TestQuarkCreateNetwork(test_quark_plugin.TestQuarkPlugin):
             with self.assertRaises(q_exc.InvalidIpamStrategy):
                 self.plugin.create_network(self.context, dict(network=net))
 
+    def test_create_network_with_subnet_selection(self):
+        net = dict(id="abcdef", name="public", admin_state_up=True,
+                   tenant_id=0, subnet_selection="spread")
+        with self._stubs(net=net) as net_create:
+            self.plugin.create_network(self.context, dict(network=net))
+            self.assertEqual(net_create.call_args[1]["subnet_selection"],
+                             "spread")
+
+    def test_create_network_with_bad_subnet_selection_raises(self):
+        net = dict(id="abcdef", name="public", admin_state_up=True,
+                   tenant_id=0, subnet_selection="BUSTED")
+        with self._stubs(net=net):
+            with self.assertRaises(q_exc.InvalidSubnetSelection):
+                self.plugin.create_network(self.context, dict(network=net))
+
 
 class TestQuarkDiagnoseNetworks(test_quark_plugin.TestQuarkPlugin):
     @contextlib.contextmanager
@@ -137,6 +137,70 @@ class TestQuarkGetPorts(test_quark_plugin.TestQuarkPlugin):
                 self.plugin.get_port(self.context, 1)
 
 
+class TestQuarkGetPortsNwInfo(test_quark_plugin.TestQuarkPlugin):
+    @contextlib.contextmanager
+    def _stubs(self, ports, routes=None):
+        subnet = models.Subnet(id=1, network_id=2, cidr="192.168.1.0/24")
+        if routes is None:
+            routes = [("0.0.0.0/0", "192.168.1.1"),
+                      ("10.0.0.0/8", "192.168.1.254")]
+        subnet.routes = [models.Route(cidr=cidr, gateway=gateway)
+                         for cidr, gateway in routes]
+        subnet.dns_nameservers = [models.DNSNameserver(ip=134744072)]
+
+        port_models = []
+        for port in ports:
+            port_model = models.Port()
+            port_model.update(port)
+            for addr in ("192.168.1.100", "192.168.1.101"):
+                ip = models.IPAddress(address_readable=addr, subnet_id=1,
+                                      network_id=2, version=4)
+                ip.subnet = subnet
+                port_model.ip_addresses.append(ip)
+            port_models.append(port_model)
+
+        with mock.patch("quark.db.api.port_find_nw_info") as nw_info_find:
+            nw_info_find.return_value = port_models
+            yield nw_info_find
+
+    def test_nw_info_no_devices(self):
+        with self._stubs(ports=[]) as nw_info_find:
+            self.assertEqual(self.plugin.get_ports_nw_info(self.context, []),
+                             [])
+            self.assertFalse(nw_info_find.called)
+
+    def test_nw_info(self):
+        port = dict(mac_address="AA:BB:CC:DD:EE:FF", network_id=2,
+                    tenant_id=self.context.tenant_id, device_id="dev")
+        with self._stubs(ports=[port]) as nw_info_find:
+            nw_info = self.plugin.get_ports_nw_info(self.context, ["dev"])
+            nw_info_find.assert_called_once_with(self.context, ["dev"])
+
+        self.assertEqual(len(nw_info), 1)
+        self.assertEqual(nw_info[0]["device_id"], "dev")
+        self.assertEqual(nw_info[0]["mac_address"], "AA:BB:CC:DD:EE:FF")
+        self.assertEqual([ip["ip_address"] for ip in nw_info[0]["fixed_ips"]],
+                         ["192.168.1.100", "192.168.1.101"])
+        self.assertEqual(nw_info[0]["subnets"], [
+            {"id": 1, "network_id": 2, "cidr": "192.168.1.0/24",
+             "ip_version": 4, "gateway_ip": "192.168.1.1",
+             "dns_nameservers": ["8.8.8.8"],
+             "host_routes": [
+                 {"destination": "0.0.0.0/0", "nexthop": "192.168.1.1"},
+                 {"destination": "10.0.0.0/8",
+                  "nexthop": "192.168.1.254"}]}])
+
+    def test_nw_info_gateway_is_first_default_route(self):
+        port = dict(mac_address="AA:BB:CC:DD:EE:FF", network_id=2,
+                    tenant_id=self.context.tenant_id, device_id="dev")
+        routes = [("0.0.0.0/0", "192.168.1.1"),
+                  ("0.0.0.0/0", "192.168.1.2")]
+        with self._stubs(ports=[port], routes=routes):
+            nw_info = self.plugin.get_ports_nw_info(self.context, ["dev"])
+        self.assertEqual(nw_info[0]["subnets"][0]["gateway_ip"],
+                         "192.168.1.1")
+
+
 class TestQuarkCreatePort(test_quark_plugin.TestQuarkPlugin):
     @contextlib.contextmanager
     def _stubs(self, port=None, network=None, addr=None, mac=None):
@@ -153,11 +217,13 @@ class TestQuarkCreatePort(test_quark_plugin.TestQuarkPlugin):
             mock.patch("%s.port_create" % db_mod),
             mock.patch("%s.network_find" % db_mod),
             mock.patch("%s.allocate_ip_address" % ipam),
+            mock.patch("%s.allocate_ip_addresses" % ipam),
             mock.patch("%s.allocate_mac_address" % ipam),
-        ) as (port_create, net_find, alloc_ip, alloc_mac):
+        ) as (port_create, net_find, alloc_ip, alloc_ips, alloc_mac):
             port_create.return_value = port_models
             net_find.return_value = network
             alloc_ip.return_value = addr
+            alloc_ips.return_value = [addr]
             alloc_mac.return_value = mac
             yield port_create
 
@@ -255,17 +321,38 @@ class TestQuarkCreatePort(test_quark_plugin.TestQuarkPlugin):
                 self.plugin.create_port(self.context, port)
 
     def test_create_port_net_at_max(self):
-        network = dict(id=1, ports=[models.Port()])
+        network = dict(id=1)
         mac = dict(address="AA:BB:CC:DD:EE:FF")
         port_name = "foobar"
         ip = dict()
         port = dict(port=dict(mac_address=mac["address"], network_id=1,
                               tenant_id=self.context.tenant_id, device_id=2,
                               name=port_name))
-        with self._stubs(port=port["port"], network=network, addr=ip, mac=mac):
+        with contextlib.nested(
+            self._stubs(port=port["port"], network=network, addr=ip, mac=mac),
+            mock.patch("quark.db.api.quota_usage_find_for_update")
+        ) as (port_create, usage_find):
+            usage_find.return_value = models.QuotaUsage(in_use=1, reserved=0)
             with self.assertRaises(exceptions.OverQuota):
                 self.plugin.create_port(self.context, port)
 
+    def test_create_port_failure_deletes_backend_port(self):
+        network = dict(id=1)
+        mac = dict(address="AA:BB:CC:DD:EE:FF")
+        port = dict(port=dict(mac_address=mac["address"], network_id=1,
+                              tenant_id=self.context.tenant_id, device_id=2))
+        with contextlib.nested(
+            self._stubs(port=port["port"], network=network, addr=dict(),
+                        mac=mac),
+            mock.patch("quark.drivers.base.BaseDriver.delete_port")
+        ) as (port_create, delete_port):
+            port_create.side_effect = ValueError
+            with self.assertRaises(ValueError):
+                self.plugin.create_port(self.context, port)
+            backend_key = delete_port.call_args[0][1]
+            self.assertEqual(backend_key,
+                             port_create.call_args[1]["backend_key"])
+
     def test_create_port_security_groups(self, groups=[1]):
         network = dict(id=1)
         mac = dict(address="AA:BB:CC:DD:EE:FF")
@@ -315,7 +402,7 @@ class TestQuarkUpdatePort(test_quark_plugin.TestQuarkPlugin):
         with contextlib.nested(
             mock.patch("quark.db.api.port_find"),
             mock.patch("quark.db.api.port_update"),
-            mock.patch("quark.ipam.QuarkIpam.allocate_ip_address"),
+            mock.patch("quark.ipam.QuarkIpam.allocate_ip_addresses"),
             mock.patch("quark.ipam.QuarkIpam.deallocate_ip_address")
         ) as (port_find, port_update, alloc_ip, dealloc_ip):
             port_find.return_value = port_model
@@ -19,6 +19,7 @@ import mock
 from neutron.common import exceptions
 
 from quark.db import api as db_api
+from quark.db import models
 from quark import exceptions as quark_exceptions
 from quark.tests import test_quark_plugin
 
@@ -56,28 +57,32 @@ class TestQuarkCreateRoutes(test_quark_plugin.TestQuarkPlugin):
     @contextlib.contextmanager
     def _stubs(self, create_route, find_routes, subnet):
         db_mod = "quark.db.api"
+        overlapping = []
+        for route in find_routes:
+            r = models.Route(id=route["id"], cidr=route["cidr"])
+            overlapping.append((r.id, r.first_ip, r.last_ip))
         with contextlib.nested(
             mock.patch("%s.route_create" % db_mod),
-            mock.patch("%s.route_find" % db_mod),
+            mock.patch("%s.route_find_overlapping" % db_mod),
             mock.patch("%s.subnet_find" % db_mod)
-        ) as (route_create, route_find, subnet_find):
+        ) as (route_create, route_find_overlapping, subnet_find):
             route_create.return_value = create_route
-            route_find.return_value = find_routes
+            route_find_overlapping.return_value = overlapping
             subnet_find.return_value = subnet
-            yield
+            yield route_find_overlapping
 
     def test_create_route(self):
         subnet = dict(id=2)
         create_route = dict(id=1, cidr="172.16.0.0/24", gateway="172.16.0.1",
                             subnet_id=subnet["id"])
-        route = dict(id=1, cidr="0.0.0.0/0", gateway="192.168.0.1",
-                     subnet_id=subnet["id"])
-        with self._stubs(create_route=create_route, find_routes=[route],
-                         subnet=subnet):
+        with self._stubs(create_route=create_route, find_routes=[],
+                         subnet=subnet) as route_find_overlapping:
             res = self.plugin.create_route(self.context,
                                            dict(route=create_route))
             for key in create_route.keys():
                 self.assertEqual(res[key], create_route[key])
+            route_find_overlapping.assert_called_once_with(
+                mock.ANY, subnet["id"], 0xffffac100000, 0xffffac1000ff)
 
     def test_create_route_no_subnet_fails(self):
         subnet = dict(id=2)
@@ -216,9 +216,12 @@ class TestQuarkDeleteSecurityGroup(test_quark_plugin.TestQuarkPlugin):
             mock.patch("quark.db.api.security_group_find"),
             mock.patch("quark.db.api.security_group_delete"),
             mock.patch(
-                "quark.drivers.base.BaseDriver.delete_security_group")
-        ) as (group_find, db_group_delete, driver_group_delete):
+                "quark.drivers.base.BaseDriver.delete_security_group"),
+            mock.patch("quark.db.api.security_group_has_ports")
+        ) as (group_find, db_group_delete, driver_group_delete, has_ports):
             group_find.return_value = dbgroup
+            has_ports.return_value = bool(security_group and
+                                          security_group.get("ports"))
             db_group_delete.return_value = dbgroup
             yield db_group_delete, driver_group_delete
 
@@ -289,9 +292,13 @@ class TestQuarkCreateSecurityGroupRule(test_quark_plugin.TestQuarkPlugin):
         with contextlib.nested(
                 mock.patch("quark.db.api.security_group_find"),
                 mock.patch("quark.db.api.security_group_rule_find"),
-                mock.patch("quark.db.api.security_group_rule_create")
-        ) as (group_find, rule_find, rule_create):
+                mock.patch("quark.db.api.security_group_rule_create"),
+                mock.patch("quark.db.api.quota_usage_find_for_update")
+        ) as (group_find, rule_find, rule_create, usage_find):
             group_find.return_value = dbgroup
+            usage_find.return_value = models.QuotaUsage(
+                in_use=len(group.get('rules', [])) if group else 0,
+                reserved=0)
             rule_find.return_value.count.return_value = group.get(
                 'port_rules', None) if group else 0
             rule_create.return_value = dbrule
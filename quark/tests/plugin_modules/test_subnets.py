@@ -19,6 +19,7 @@ import time
 import uuid
 
 import mock
+import netaddr
 from neutron.api.v2 import attributes as neutron_attrs
 from neutron.common import exceptions
 from neutron.openstack.common.notifier import api as notifier_api
@@ -122,28 +123,28 @@ class TestQuarkCreateSubnetOverlapping(test_quark_plugin.TestQuarkPlugin):
     def _stubs(self, subnets=None):
         if subnets is None:
             subnets = []
-        subnet_models = []
+        overlapping = []
         for subnet in subnets:
-            s = models.Subnet()
-            s.update(subnet)
-            subnet_models.append(s)
+            cidr = netaddr.IPNetwork(subnet["cidr"]).ipv6()
+            overlapping.append((subnet.get("id", 2), subnet["cidr"],
+                                cidr.first, cidr.last))
         network = models.Network()
-        network.update(dict(id=1, subnets=subnet_models))
+        network.update(dict(id=1, subnets=[]))
         with contextlib.nested(
             mock.patch("quark.db.api.network_find"),
-            mock.patch("quark.db.api.subnet_find"),
+            mock.patch("quark.db.api.subnet_find_overlapping"),
             mock.patch("quark.db.api.subnet_create")
-        ) as (net_find, subnet_find, subnet_create):
+        ) as (net_find, subnet_find_overlapping, subnet_create):
             net_find.return_value = network
-            subnet_find.return_value = subnet_models
+            subnet_find_overlapping.return_value = overlapping
             subnet_create.return_value = models.Subnet(
                 network=models.Network(),
                 cidr="192.168.1.1/24")
-            yield subnet_create
+            yield subnet_create, subnet_find_overlapping
 
     def test_create_subnet_overlapping_true(self):
         cfg.CONF.set_override('allow_overlapping_ips', True)
-        with self._stubs() as subnet_create:
+        with self._stubs() as (subnet_create, subnet_find_overlapping):
             s = dict(subnet=dict(
                 gateway_ip=neutron_attrs.ATTR_NOT_SPECIFIED,
                 dns_nameservers=neutron_attrs.ATTR_NOT_SPECIFIED,
@@ -151,10 +152,13 @@ class TestQuarkCreateSubnetOverlapping(test_quark_plugin.TestQuarkPlugin):
                 network_id=1))
             self.plugin.create_subnet(self.context, s)
             self.assertEqual(subnet_create.call_count, 1)
+            cidr = netaddr.IPNetwork("192.168.1.1/8").ipv6()
+            subnet_find_overlapping.assert_called_once_with(
+                mock.ANY, cidr.first, cidr.last, network_id=1)
 
     def test_create_subnet_overlapping_false(self):
         cfg.CONF.set_override('allow_overlapping_ips', False)
-        with self._stubs() as subnet_create:
+        with self._stubs() as (subnet_create, subnet_find_overlapping):
             s = dict(subnet=dict(
                 gateway_ip=neutron_attrs.ATTR_NOT_SPECIFIED,
                 dns_nameservers=neutron_attrs.ATTR_NOT_SPECIFIED,
@@ -162,6 +166,8 @@ class TestQuarkCreateSubnetOverlapping(test_quark_plugin.TestQuarkPlugin):
                 network_id=1))
             self.plugin.create_subnet(self.context, s)
             self.assertEqual(subnet_create.call_count, 1)
+            self.assertIsNone(
+                subnet_find_overlapping.call_args[1]["network_id"])
 
     def test_create_subnet_overlapping_conflict(self):
         cfg.CONF.set_override('allow_overlapping_ips', False)
@@ -171,6 +177,14 @@ class TestQuarkCreateSubnetOverlapping(test_quark_plugin.TestQuarkPlugin):
                                      network_id=1))
                 self.plugin.create_subnet(self.context, s)
 
+    def test_create_subnet_overlapping_same_network_conflict(self):
+        cfg.CONF.set_override('allow_overlapping_ips', True)
+        with self._stubs(subnets=[dict(cidr="192.168.10.1/24")]):
+            with self.assertRaises(exceptions.InvalidInput):
+                s = dict(subnet=dict(cidr="192.168.1.1/8",
+                                     network_id=1))
+                self.plugin.create_subnet(self.context, s)
+
 
 class TestQuarkCreateSubnetAllocationPools(test_quark_plugin.TestQuarkPlugin):
     @contextlib.contextmanager
@@ -688,24 +702,19 @@ class TestQuarkUpdateSubnet(test_quark_plugin.TestQuarkPlugin):
 class TestQuarkDeleteSubnet(test_quark_plugin.TestQuarkPlugin):
     @contextlib.contextmanager
     def _stubs(self, subnet, ips):
-        ip_mods = []
         subnet_mod = None
         if subnet:
             subnet_mod = models.Subnet()
             subnet_mod.update(subnet)
-        for ip in ips:
-            ip_mod = models.IPAddress()
-            ip_mod.update(ip)
-            ip_mods.append(ip_mod)
 
         db_mod = "quark.db.api"
         with contextlib.nested(
             mock.patch("%s.subnet_find" % db_mod),
-            mock.patch("%s.subnet_delete" % db_mod)
-        ) as (sub_find, sub_delete):
-            if subnet_mod:
-                subnet_mod.allocated_ips = ip_mods
+            mock.patch("%s.subnet_delete" % db_mod),
+            mock.patch("%s.subnet_has_allocated_ips" % db_mod)
+        ) as (sub_find, sub_delete, has_ips):
             sub_find.return_value = subnet_mod
+            has_ips.return_value = bool(ips)
             yield sub_delete
 
     def test_delete_subnet(self):
@@ -855,3 +864,54 @@ class TestQuarkDiagnoseSubnets(test_quark_plugin.TestQuarkPlugin):
         with self._stubs(subnets=subnet, routes=[route]):
             actual = self.plugin.diagnose_subnet(self.context, subnet_id, None)
             self.assertEqual(subnet["id"], actual["subnets"]["id"])
+
+
+class TestQuarkGetSubnetsUsage(test_quark_plugin.TestQuarkPlugin):
+    @contextlib.contextmanager
+    def _stubs(self, subnets, usage=None, cooling_down=None, rebuilt=None):
+        subnet_models = []
+        for subnet in subnets:
+            s = models.Subnet(network=models.Network())
+            s.update(subnet)
+            subnet_models.append(s)
+
+        db_mod = "quark.db.api"
+        with contextlib.nested(
+            mock.patch("neutron.db.api.get_session"),
+            mock.patch("%s.subnet_find" % db_mod),
+            mock.patch("%s.subnet_usage_find" % db_mod),
+            mock.patch("%s.subnet_usage_rebuild" % db_mod),
+            mock.patch("%s.ip_address_count_cooling_down" % db_mod)
+        ) as (get_session, subnet_find, usage_find, rebuild, cooling):
+            get_session.return_value.begin.return_value.__exit__.\
+                return_value = False
+            subnet_find.return_value = subnet_models
+            usage_find.return_value = usage or {}
+            rebuild.return_value = rebuilt
+            cooling.return_value = cooling_down or {}
+            yield rebuild
+
+    def test_get_subnets_usage(self):
+        subnets = [dict(id=1, network_id=1, cidr="192.168.0.0/24"),
+                   dict(id=2, network_id=1, cidr="192.168.1.0/24")]
+        usage = {1: (10, 5), 2: (1, 0)}
+        with self._stubs(subnets, usage=usage, cooling_down={1: 2}) as \
+                rebuild:
+            res = self.plugin.get_subnets_usage(self.context)
+            self.assertFalse(rebuild.called)
+            self.assertEqual(res["subnet_usage"][0],
+                             dict(subnet_id=1, network_id=1, total=256,
+                                  allocated=10, reusable=3, cooling_down=2,
+                                  policy_excluded=3, available=238))
+            self.assertEqual(res["network_usage"],
+                             [dict(network_id=1, total=512, allocated=11,
+                                   reusable=3, cooling_down=2,
+                                   policy_excluded=6, available=490)])
+
+    def test_get_subnets_usage_rebuilds_missing_counts(self):
+        subnets = [dict(id=1, network_id=1, cidr="192.168.0.0/24")]
+        with self._stubs(subnets, rebuilt=(4, 1)) as rebuild:
+            res = self.plugin.get_subnets_usage(self.context)
+            rebuild.assert_called_once_with(mock.ANY, 1)
+            self.assertEqual(res["subnet_usage"][0]["allocated"], 4)
+            self.assertEqual(res["subnet_usage"][0]["reusable"], 1)
@@ -0,0 +1,79 @@
+# Copyright 2013 Openstack Foundation
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+#  under the License.
+
+import contextlib
+import datetime
+
+import mock
+from oslo.config import cfg
+
+from quark import archiver
+from quark.tests import test_base
+
+
+class TestArchiver(test_base.TestBase):
+    def setUp(self):
+        super(TestArchiver, self).setUp()
+        self.now = datetime.datetime(2013, 10, 1)
+        cfg.CONF.set_override("archive_batch_size", 2, "QUARK")
+        self.context.session.begin = mock.MagicMock()
+        self.context.session.begin.return_value.__exit__.return_value = False
+
+    def tearDown(self):
+        for opt in ("archive_batch_size", "archive_ip_addresses_after",
+                    "archive_mac_addresses_after"):
+            cfg.CONF.clear_override(opt, "QUARK")
+        archiver.reset()
+
+    @contextlib.contextmanager
+    def _stubs(self, ip_batches=None, mac_batches=None):
+        db_mod = "quark.db.api"
+        with contextlib.nested(
+            mock.patch("neutron.openstack.common.timeutils.utcnow"),
+            mock.patch("%s.ip_address_archive" % db_mod),
+            mock.patch("%s.mac_address_archive" % db_mod)
+        ) as (utcnow, ip_archive, mac_archive):
+            utcnow.return_value = self.now
+            ip_archive.side_effect = ip_batches or []
+            mac_archive.side_effect = mac_batches or []
+            yield ip_archive, mac_archive
+
+    def test_archive_disabled(self):
+        with self._stubs() as (ip_archive, mac_archive):
+            self.assertEqual(archiver.archive(self.context), (0, 0))
+            self.assertFalse(ip_archive.called)
+            self.assertFalse(mac_archive.called)
+
+    def test_archive_runs_batches_until_short(self):
+        cfg.CONF.set_override("archive_ip_addresses_after", 60, "QUARK")
+        cfg.CONF.set_override("archive_mac_addresses_after", 120, "QUARK")
+        with self._stubs(ip_batches=[2, 2, 1],
+                         mac_batches=[0]) as (ip_archive, mac_archive):
+            self.assertEqual(archiver.archive(self.context), (5, 0))
+            self.assertEqual(ip_archive.call_count, 3)
+            ip_archive.assert_called_with(
+                self.context, self.now - datetime.timedelta(seconds=60), 2)
+            mac_archive.assert_called_once_with(
+                self.context, self.now - datetime.timedelta(seconds=120), 2)
+            self.assertEqual(self.context.session.begin.call_count, 4)
+
+    def test_start_disabled(self):
+        self.assertIsNone(archiver.start())
+
+    def test_start_once(self):
+        cfg.CONF.set_override("archive_ip_addresses_after", 60, "QUARK")
+        with mock.patch("quark.archiver.Archiver") as archiver_cls:
+            self.assertEqual(archiver.start(), archiver.start())
+            self.assertEqual(archiver_cls.call_count, 1)
@@ -0,0 +1,182 @@
+# Copyright 2013 Openstack Foundation
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+#  under the License.
+
+import contextlib
+import mock
+from neutron import context
+from oslo.config import cfg
+
+from quark import cache
+from quark.tests import test_base
+
+
+class TestLRUCache(test_base.TestBase):
+    def test_get_set(self):
+        lru = cache.LRUCache(size=2)
+        lru.set("a", 1)
+        self.assertEqual(lru.get("a"), 1)
+        self.assertIsNone(lru.get("b"))
+
+    def test_evicts_least_recently_used(self):
+        lru = cache.LRUCache(size=2)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        lru.get("a")
+        lru.set("c", 3)
+        self.assertEqual(lru.get("a"), 1)
+        self.assertIsNone(lru.get("b"))
+        self.assertEqual(lru.get("c"), 3)
+
+    def test_overwrite_does_not_grow(self):
+        lru = cache.LRUCache(size=2)
+        lru.set("a", 1)
+        lru.set("a", 2)
+        lru.set("b", 3)
+        self.assertEqual(lru.get("a"), 2)
+        self.assertEqual(lru.get("b"), 3)
+
+    def test_expiry(self):
+        lru = cache.LRUCache(size=2)
+        with mock.patch("quark.cache._now") as now:
+            now.return_value = 100
+            lru.set("a", 1, time=10)
+            now.return_value = 109
+            self.assertEqual(lru.get("a"), 1)
+            now.return_value = 110
+            self.assertIsNone(lru.get("a"))
+
+    def test_delete(self):
+        lru = cache.LRUCache(size=2)
+        lru.set("a", 1)
+        lru.delete("a")
+        lru.delete("a")
+        self.assertIsNone(lru.get("a"))
+
+
+class TestLocalMemcache(test_base.TestBase):
+    def test_expiry(self):
+        client = cache.MemcachedCache()
+        with mock.patch("quark.cache._now") as now:
+            now.return_value = 100
+            client.set("a", 1, time=10)
+            self.assertEqual(client.get("a"), 1)
+            now.return_value = 110
+            self.assertIsNone(client.get("a"))
+
+
+class TestResponseCache(test_base.TestBase):
+    def setUp(self):
+        super(TestResponseCache, self).setUp()
+        cfg.CONF.set_override("response_cache_enabled", True, "QUARK")
+        cache._BACKEND = cache.LRUCache(size=16)
+        self.calls = []
+
+        @cache.cached("networks")
+        def get_networks(context, filters=None, fields=None):
+            self.calls.append(filters)
+            return [{"id": len(self.calls)}]
+        self.get_networks = get_networks
+
+    def tearDown(self):
+        cfg.CONF.clear_override("response_cache_enabled", "QUARK")
+        cache._BACKEND = None
+
+    def test_second_call_is_cached(self):
+        first = self.get_networks(self.context, {"name": ["a"]})
+        second = self.get_networks(self.context, {"name": ["a"]})
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_cached_result_is_copied(self):
+        self.get_networks(self.context, {})
+        self.get_networks(self.context, {})[0]["id"] = "mutated"
+        self.assertEqual(self.get_networks(self.context, {})[0]["id"], 1)
+
+    def test_filters_and_fields_are_keyed(self):
+        self.get_networks(self.context, {"name": ["a"]})
+        self.get_networks(self.context, {"name": ["b"]})
+        self.get_networks(self.context, {"name": ["b"]}, ["id"])
+        self.assertEqual(len(self.calls), 3)
+
+    def test_tenants_are_isolated(self):
+        other = context.Context("fake", "other_tenant", is_admin=False)
+        self.get_networks(self.context, {})
+        self.get_networks(other, {})
+        self.assertEqual(len(self.calls), 2)
+
+    def test_admin_bypasses_cache(self):
+        admin = context.Context("fake", "fake", is_admin=True)
+        self.get_networks(admin, {})
+        self.get_networks(admin, {})
+        self.assertEqual(len(self.calls), 2)
+
+    def test_disabled(self):
+        cfg.CONF.set_override("response_cache_enabled", False, "QUARK")
+        self.get_networks(self.context, {})
+        self.get_networks(self.context, {})
+        self.assertEqual(len(self.calls), 2)
+
+    def test_invalidate_tenant(self):
+        self.get_networks(self.context, {})
+        cache.invalidate(self.context)
+        self.assertEqual(self.get_networks(self.context, {}), [{"id": 2}])
+
+    def test_invalidate_other_tenant_keeps_own(self):
+        other = context.Context("fake", "other_tenant", is_admin=False)
+        self.get_networks(self.context, {})
+        self.get_networks(other, {})
+        cache.invalidate(other)
+        self.get_networks(self.context, {})
+        self.get_networks(other, {})
+        self.assertEqual(len(self.calls), 3)
+
+    def test_invalidate_shared_network_retires_all_tenants(self):
+        other = context.Context("fake", "other_tenant", is_admin=False)
+        self.get_networks(self.context, {})
+        with mock.patch("quark.cache.is_shared_network") as shared:
+            shared.return_value = True
+            cache.invalidate(other, network_id="public_network")
+        self.get_networks(self.context, {})
+        self.assertEqual(len(self.calls), 2)
+
+    def test_invalidate_all(self):
+        self.get_networks(self.context, {})
+        cache.invalidate_all()
+        self.get_networks(self.context, {})
+        self.assertEqual(len(self.calls), 2)
+
+    def test_replica_read_not_cached_without_sticky_window(self):
+        with mock.patch("quark.db.replica.should_use_replica") as use:
+            use.return_value = True
+            self.get_networks(self.context, {})
+            self.get_networks(self.context, {})
+        self.assertEqual(len(self.calls), 2)
+
+    def test_replica_read_expires_with_sticky_window(self):
+        cfg.CONF.set_override("read_replica_sticky_seconds", 5, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override,
+                        "read_replica_sticky_seconds", "QUARK")
+        with contextlib.nested(
+            mock.patch("quark.db.replica.should_use_replica"),
+            mock.patch("quark.cache._now")
+        ) as (use, now):
+            use.return_value = True
+            now.return_value = 100
+            self.get_networks(self.context, {})
+            now.return_value = 104
+            self.get_networks(self.context, {})
+            now.return_value = 105
+            self.get_networks(self.context, {})
+        self.assertEqual(len(self.calls), 2)
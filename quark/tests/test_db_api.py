@@ -18,6 +18,7 @@ from neutron.db import api as neutron_db_api
 from oslo.config import cfg
 
 from quark.db import api as db_api
+from quark.db import models
 
 from quark.tests import test_base
 
@@ -45,3 +46,49 @@ class TestDBAPI(test_base.TestBase):
         query_obj = self.context.session.query.return_value
         filter_fn = query_obj.filter
         self.assertEqual(filter_fn.call_count, 1)
+
+    def test_bump_subnet_usage_falls_back_to_first_slot(self):
+        connection = mock.Mock()
+        connection.execute.side_effect = [mock.Mock(rowcount=0),
+                                          mock.Mock(rowcount=1)]
+        with mock.patch("random.randrange") as randrange:
+            randrange.return_value = 3
+            db_api._bump_subnet_usage(connection, "subnet", allocated=1)
+        self.assertEqual(connection.execute.call_count, 2)
+        slots = [call[0][0].compile().params["slot_1"]
+                 for call in connection.execute.call_args_list]
+        self.assertEqual(slots, [3, 0])
+
+    def test_bump_subnet_usage_without_subnet(self):
+        connection = mock.Mock()
+        db_api._bump_subnet_usage(connection, None, allocated=1)
+        self.assertFalse(connection.execute.called)
+
+    def test_model_query_criteria(self):
+        filters = dict(network_id=["net"], _deallocated=False, device_id=["d"],
+                       name=None)
+        criteria = db_api._model_query(self.context, models.IPAddress,
+                                       filters)
+        self.assertEqual(
+            [str(c) for c in criteria],
+            [str(models.IPAddress.network_id.in_(["net"])),
+             str(models.IPAddress._deallocated != 1)])
+
+    def test_model_query_injects_tenant_id(self):
+        criteria = db_api._model_query(self.context, models.Port, None)
+        self.assertEqual(
+            [str(c) for c in criteria],
+            [str(models.Port.tenant_id.in_([self.context.tenant_id]))])
+
+    def test_exists_probes_first_row(self):
+        query = mock.Mock()
+        query.first.return_value = None
+        self.assertFalse(db_api._exists(query))
+        query.first.return_value = ("row",)
+        self.assertTrue(db_api._exists(query))
+
+    def test_ip_policy_in_use_by_subnet(self):
+        with mock.patch("quark.db.api._exists") as exists:
+            exists.side_effect = [False, True]
+            self.assertTrue(db_api.ip_policy_in_use(self.context, "policy"))
+            self.assertEqual(exists.call_count, 2)
@@ -41,7 +41,14 @@ class TestDBCustomTypesINET(test_base.TestBase):
 
     def test_process_bind_param_with_value(self):
         bind = self.inet.process_bind_param("foo", sqlite.dialect())
-        self.assertEqual(bind, "foo")
+        self.assertEqual(bind, "0" * 36 + "foo")
+
+    def test_process_bind_param_sqlite_orders_numerically(self):
+        dialect = sqlite.dialect()
+        low = self.inet.process_bind_param(9, dialect)
+        high = self.inet.process_bind_param(10, dialect)
+        self.assertTrue(low < high)
+        self.assertEqual(self.inet.process_result_value(high, dialect), 10)
 
     def test_process_bind_param_with_value_not_sqlite(self):
         bind = self.inet.process_bind_param("foo", mysql.dialect())
@@ -60,6 +67,32 @@ class TestDBCustomTypesINET(test_base.TestBase):
         self.assertEqual(bind, 1.0)
 
 
+class TestDBCustomTypesOrderedINET(test_base.TestBase):
+    def setUp(self):
+        super(TestDBCustomTypesOrderedINET, self).setUp()
+        self.inet = custom_types.OrderedINET()
+
+    def test_load_dialect_impl(self):
+        for dialect in (mysql.dialect(), sqlite.dialect()):
+            impl = self.inet.load_dialect_impl(dialect)
+            self.assertEqual(impl.length, 39)
+
+    def test_process_bind_param_none(self):
+        self.assertIsNone(self.inet.process_bind_param(None, None))
+
+    def test_process_bind_param_orders_numerically(self):
+        dialect = mysql.dialect()
+        low = self.inet.process_bind_param(2 ** 53, dialect)
+        high = self.inet.process_bind_param(2 ** 53 + 1, dialect)
+        self.assertEqual(len(low), 39)
+        self.assertTrue(low < high)
+        self.assertEqual(self.inet.process_result_value(high, dialect),
+                         2 ** 53 + 1)
+
+    def test_process_result_value_none(self):
+        self.assertIsNone(self.inet.process_result_value(None, None))
+
+
 class TestDBCustomTypesMACAddress(test_base.TestBase):
     """Adding for coverage of the mac address custom types."""
 
@@ -0,0 +1,127 @@
+# Copyright 2013 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from neutron.common import exceptions
+from neutron.openstack.common.db import exception as db_exception
+from oslo.config import cfg
+
+from quark.db import locks
+from quark.tests import test_base
+
+
+class TestLocalLockManager(test_base.TestBase):
+    def setUp(self):
+        super(TestLocalLockManager, self).setUp()
+        self.manager = locks.LocalLockManager()
+        self.context = mock.MagicMock()
+
+    def test_begin_runs_transaction(self):
+        with self.manager.begin(self.context, "a"):
+            self.assertTrue(self.context.session.begin.called)
+
+    def test_names_lock_independently(self):
+        with self.manager.begin(self.context, "a"):
+            with self.manager.begin(self.context, "b"):
+                self.assertTrue(self.manager._locks["b"].locked())
+            self.assertTrue(self.manager._locks["a"].locked())
+            self.assertFalse(self.manager._locks["b"].locked())
+        self.assertFalse(self.manager._locks["a"].locked())
+
+
+class TestMySQLLockManager(test_base.TestBase):
+    def setUp(self):
+        super(TestMySQLLockManager, self).setUp()
+        self.manager = locks.MySQLLockManager()
+        self.context = mock.MagicMock()
+        self.connection = self.context.session.get_bind.return_value.\
+            connect.return_value
+
+    def _statements(self):
+        return [str(c[0][0]) for c in self.connection.execute.call_args_list]
+
+    def test_begin_takes_and_releases_lock(self):
+        self.connection.execute.return_value.scalar.return_value = 1
+        with self.manager.begin(self.context, "a"):
+            self.assertTrue(self.context.session.begin.called)
+        self.assertEqual(self._statements(),
+                         ["SELECT GET_LOCK(:name, :timeout)",
+                          "SELECT RELEASE_LOCK(:name)"])
+        self.assertTrue(self.connection.close.called)
+
+    def test_begin_times_out(self):
+        self.connection.execute.return_value.scalar.return_value = 0
+        with self.assertRaises(exceptions.Conflict):
+            with self.manager.begin(self.context, "a"):
+                pass
+        self.assertFalse(self.context.session.begin.called)
+        self.assertEqual(self._statements(),
+                         ["SELECT GET_LOCK(:name, :timeout)"])
+        self.assertTrue(self.connection.close.called)
+
+
+class TestTableLockManager(test_base.TestBase):
+    def setUp(self):
+        super(TestTableLockManager, self).setUp()
+        self.manager = locks.TableLockManager()
+        self.context = mock.MagicMock()
+        self.session = self.context.session
+        self.exists = self.session.query.return_value.filter.return_value
+        self.locked = self.session.query.return_value.\
+            with_lockmode.return_value.filter.return_value
+
+    def test_begin_locks_existing_row(self):
+        self.exists.first.return_value = ("a",)
+        with self.manager.begin(self.context, "a"):
+            pass
+        self.assertFalse(self.session.add.called)
+        self.assertEqual(self.session.begin.call_count, 1)
+        self.assertTrue(self.locked.first.called)
+
+    def test_begin_creates_missing_row_before_locking(self):
+        self.exists.first.return_value = None
+        with self.manager.begin(self.context, "a"):
+            pass
+        lock = self.session.add.call_args[0][0]
+        self.assertEqual(lock.name, "a")
+        self.assertEqual(self.session.begin.call_count, 2)
+        self.assertTrue(self.locked.first.called)
+
+    def test_begin_tolerates_concurrent_insert(self):
+        self.exists.first.return_value = None
+        self.session.add.side_effect = db_exception.DBDuplicateEntry()
+        with self.manager.begin(self.context, "a"):
+            pass
+        self.assertTrue(self.locked.first.called)
+
+
+class TestGetLockManager(test_base.TestBase):
+    def tearDown(self):
+        super(TestGetLockManager, self).tearDown()
+        cfg.CONF.clear_override("ipam_lock_driver", "QUARK")
+        locks.reset()
+
+    def test_builds_configured_manager_once(self):
+        cfg.CONF.set_override("ipam_lock_driver", "local", "QUARK")
+        locks.reset()
+        manager = locks.get_lock_manager()
+        self.assertIsInstance(manager, locks.LocalLockManager)
+        self.assertIs(locks.get_lock_manager(), manager)
+
+    def test_unknown_manager(self):
+        cfg.CONF.set_override("ipam_lock_driver", "bogus", "QUARK")
+        locks.reset()
+        with self.assertRaises(exceptions.InvalidInput):
+            locks.get_lock_manager()
@@ -41,3 +41,14 @@ class TestDBModels(test_base.TestBase):
             ip_policy_rules,
             IPSet(["fc00::/127",
                    "fdff:ffff:ffff:ffff:ffff:ffff:ffff:ffff/128"]))
+
+    def test_route_cidr_sets_bounds(self):
+        route = models.Route(cidr="10.0.0.0/8")
+        self.assertEqual(route.prefix, 8)
+        self.assertEqual(route.first_ip, 0xffff0a000000)
+        self.assertEqual(route.last_ip, 0xffff0affffff)
+
+    def test_route_default_cidr_prefix(self):
+        route = models.Route(cidr="0.0.0.0/0")
+        self.assertEqual(route.cidr, "0.0.0.0/0")
+        self.assertEqual(route.prefix, 0)
@@ -0,0 +1,118 @@
+# Copyright 2013 Openstack Foundation
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+#  under the License.
+
+import contextlib
+
+import mock
+from oslo.config import cfg
+
+from quark.db import replica
+from quark.tests import test_base
+from quark.tests import test_quark_plugin
+
+
+class TestReplicaRouting(test_base.TestBase):
+    def setUp(self):
+        super(TestReplicaRouting, self).setUp()
+        replica._LAST_WRITE.clear()
+
+    def tearDown(self):
+        super(TestReplicaRouting, self).tearDown()
+        cfg.CONF.clear_override("read_replica_connection", "QUARK")
+        cfg.CONF.clear_override("read_replica_sticky_seconds", "QUARK")
+        replica._LAST_WRITE.clear()
+
+    def test_replica_disabled_by_default(self):
+        self.assertFalse(replica.should_use_replica(self.context))
+
+    def test_replica_enabled(self):
+        cfg.CONF.set_override("read_replica_connection", "sqlite://",
+                              "QUARK")
+        self.assertTrue(replica.should_use_replica(self.context))
+
+    def test_record_write_without_stickiness_is_noop(self):
+        cfg.CONF.set_override("read_replica_connection", "sqlite://",
+                              "QUARK")
+        replica.record_write(self.context)
+        self.assertEqual(replica._LAST_WRITE, {})
+        self.assertTrue(replica.should_use_replica(self.context))
+
+    def test_sticky_after_write(self):
+        cfg.CONF.set_override("read_replica_connection", "sqlite://",
+                              "QUARK")
+        cfg.CONF.set_override("read_replica_sticky_seconds", 5, "QUARK")
+        with mock.patch("quark.db.replica.time") as time:
+            time.time.return_value = 100
+            replica.record_write(self.context)
+            time.time.return_value = 104
+            self.assertFalse(replica.should_use_replica(self.context))
+            time.time.return_value = 105
+            self.assertTrue(replica.should_use_replica(self.context))
+            self.assertFalse(self.context.tenant_id in replica._LAST_WRITE)
+
+    def test_sticky_only_for_writing_tenant(self):
+        cfg.CONF.set_override("read_replica_connection", "sqlite://",
+                              "QUARK")
+        cfg.CONF.set_override("read_replica_sticky_seconds", 5, "QUARK")
+        replica._LAST_WRITE["other_tenant"] = 2 ** 40
+        self.assertTrue(replica.should_use_replica(self.context))
+
+
+class TestQuarkPluginReplicaRouting(test_quark_plugin.TestQuarkPlugin):
+    @contextlib.contextmanager
+    def _stubs(self, enabled=True):
+        sessions = []
+
+        def _get_ports(context, filters, fields):
+            sessions.append(context.session)
+            return []
+
+        with contextlib.nested(
+            mock.patch("quark.db.replica.should_use_replica"),
+            mock.patch("quark.db.replica.get_session"),
+            mock.patch("quark.db.replica.record_write"),
+            mock.patch("quark.plugin_modules.ports.get_ports"),
+            mock.patch("quark.plugin_modules.ports.get_port"),
+            mock.patch("quark.plugin_modules.ports.delete_port")
+        ) as (use_replica, get_session, record_write, get_ports, get_port,
+              delete_port):
+            use_replica.return_value = enabled
+            get_ports.side_effect = _get_ports
+            yield get_session.return_value, sessions, record_write
+
+    def test_get_ports_uses_replica(self):
+        with self._stubs() as (replica_session, sessions, record_write):
+            self.plugin.get_ports(self.context)
+            self.assertEqual(sessions, [replica_session])
+            self.assertTrue(replica_session.close.called)
+            self.assertIsNone(self.context._session)
+            self.assertFalse(record_write.called)
+
+    def test_get_ports_uses_primary_when_replica_unavailable(self):
+        with self._stubs(enabled=False) as (replica_session, sessions,
+                                            record_write):
+            self.plugin.get_ports(self.context)
+            self.assertNotEqual(sessions, [replica_session])
+            self.assertFalse(record_write.called)
+
+    def test_writes_record_tenant_write(self):
+        with self._stubs() as (replica_session, sessions, record_write):
+            self.plugin.delete_port(self.context, 1)
+            record_write.assert_called_once_with(self.context)
+
+    def test_singular_get_does_not_record_write(self):
+        with self._stubs() as (replica_session, sessions, record_write):
+            self.plugin.get_port(self.context, 1)
+            self.assertFalse(record_write.called)
@@ -0,0 +1,99 @@
+# Copyright 2013 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from oslo.config import cfg
+
+from quark.db import retry
+from quark.tests import test_base
+
+
+class FakeOperationalError(Exception):
+    def __init__(self, *args):
+        super(FakeOperationalError, self).__init__(*args)
+        self.orig = self
+
+
+class TestRetryOnLockError(test_base.TestBase):
+    def setUp(self):
+        super(TestRetryOnLockError, self).setUp()
+        self.context = mock.Mock()
+        self.context.session.transaction = None
+        self.deadlock = FakeOperationalError(
+            1213, "Deadlock found when trying to get lock")
+        patcher = mock.patch("time.sleep")
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        cfg.CONF.clear_override("db_lock_retries", "QUARK")
+
+    def _func(self, side_effect):
+        calls = []
+
+        def func(context, body):
+            calls.append(dict(body))
+            body.pop("mac_address", None)
+            if side_effect:
+                raise side_effect.pop(0)
+            return "port"
+        return retry.retry_on_lock_error(func), calls
+
+    def test_is_lock_error(self):
+        self.assertTrue(retry.is_lock_error(self.deadlock))
+        self.assertTrue(retry.is_lock_error(
+            Exception("(OperationalError) (1205, 'Lock wait timeout "
+                      "exceeded; try restarting transaction')")))
+        self.assertFalse(retry.is_lock_error(
+            FakeOperationalError(1062, "Duplicate entry")))
+        self.assertFalse(retry.is_lock_error(ValueError()))
+
+    def test_replays_with_original_arguments(self):
+        stats = retry.get_stats()
+        func, calls = self._func([self.deadlock, self.deadlock])
+        self.assertEqual(func(self.context, dict(mac_address="aa")), "port")
+        self.assertEqual(calls, [dict(mac_address="aa")] * 3)
+        self.assertEqual(self.sleep.call_count, 2)
+        self.assertEqual(retry.get_stats()["retried"],
+                         stats["retried"] + 2)
+
+    def test_gives_up_after_budget(self):
+        cfg.CONF.set_override("db_lock_retries", 1, "QUARK")
+        stats = retry.get_stats()
+        func, calls = self._func([self.deadlock, self.deadlock])
+        with self.assertRaises(FakeOperationalError):
+            func(self.context, dict())
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(retry.get_stats()["exhausted"],
+                         stats["exhausted"] + 1)
+
+    def test_other_errors_not_replayed(self):
+        func, calls = self._func([ValueError()])
+        with self.assertRaises(ValueError):
+            func(self.context, dict())
+        self.assertEqual(len(calls), 1)
+
+    def test_not_replayed_inside_callers_transaction(self):
+        self.context.session.transaction = mock.Mock()
+        func, calls = self._func([self.deadlock])
+        with self.assertRaises(FakeOperationalError):
+            func(self.context, dict())
+        self.assertEqual(len(calls), 1)
+
+    def test_backoff_is_bounded(self):
+        with mock.patch("random.uniform") as uniform:
+            retry._backoff(20)
+            uniform.assert_called_once_with(
+                0, cfg.CONF.QUARK.db_lock_retry_max_interval)
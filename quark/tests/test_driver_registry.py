@@ -0,0 +1,59 @@
+# Copyright 2013 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from quark.drivers import base
+from quark.drivers import registry
+from quark.tests import test_base
+
+
+class TestDriverRegistry(test_base.TestBase):
+    def test_no_driver_built_at_creation(self):
+        nvp = "quark.drivers.optimized_nvp_driver.OptimizedNVPDriver.__init__"
+        with mock.patch(nvp) as nvp_init:
+            reg = registry.DriverRegistry()
+            self.assertFalse(nvp_init.called)
+            self.assertEqual(reg.drivers, {})
+
+    def test_get_driver_builds_once(self):
+        reg = registry.DriverRegistry()
+        driver = reg.get_driver("BASE")
+        self.assertIsInstance(driver, base.BaseDriver)
+        self.assertIs(reg.get_driver("BASE"), driver)
+        self.assertEqual(reg.drivers.keys(), ["BASE"])
+
+    def test_get_driver_from_entry_point(self):
+        entry_point = mock.Mock()
+        entry_point.load.return_value = base.BaseDriver
+        with mock.patch("pkg_resources.iter_entry_points") as iter_eps:
+            iter_eps.return_value = [entry_point]
+            driver = registry.DriverRegistry().get_driver("OTHER")
+            iter_eps.assert_called_once_with(registry.ENTRY_POINT_GROUP,
+                                             "OTHER")
+            self.assertIsInstance(driver, base.BaseDriver)
+
+    def test_get_driver_not_registered(self):
+        with mock.patch("pkg_resources.iter_entry_points") as iter_eps:
+            iter_eps.return_value = []
+            with self.assertRaises(Exception):
+                registry.DriverRegistry().get_driver("OTHER")
+
+    def test_reset_connections_of_built_drivers(self):
+        reg = registry.DriverRegistry()
+        driver = mock.Mock()
+        reg.drivers["BASE"] = driver
+        reg.reset_connections()
+        driver.reset_connections.assert_called_once_with()
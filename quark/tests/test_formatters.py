@@ -0,0 +1,63 @@
+# Copyright 2013 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import netaddr
+
+from quark import formatters
+from quark.tests import test_base
+
+
+class TestFormatters(test_base.TestBase):
+    def test_format_mac(self):
+        self.assertEqual(formatters.format_mac(187723572702975L),
+                         "AA:BB:CC:DD:EE:FF")
+        self.assertEqual(formatters.format_mac(1), "00:00:00:00:00:01")
+
+    def test_format_mac_string(self):
+        self.assertEqual(formatters.format_mac("aa-bb-cc-dd-ee-ff"),
+                         "AA:BB:CC:DD:EE:FF")
+        self.assertEqual(formatters.format_mac("187723572702975"),
+                         "AA:BB:CC:DD:EE:FF")
+
+    def test_format_ip_infers_version(self):
+        self.assertEqual(formatters.format_ip(0x0a000001), "10.0.0.1")
+        self.assertEqual(formatters.format_ip(0x20010db8 << 96),
+                         "2001:db8::")
+
+    def test_format_ip_converts_version(self):
+        mapped = netaddr.IPAddress("::ffff:10.0.0.1").value
+        self.assertEqual(formatters.format_ip(mapped, 4), "10.0.0.1")
+        self.assertEqual(formatters.format_ip(mapped, 6), "::ffff:10.0.0.1")
+        self.assertEqual(formatters.format_ip(str(mapped), 6),
+                         "::ffff:10.0.0.1")
+
+    def test_format_ip_matches_netaddr(self):
+        for value in (0, 1, 0xffffffff, 0x100000000, 2 ** 128 - 1,
+                      netaddr.IPAddress("fe80::1:2").value):
+            ip = netaddr.IPAddress(value)
+            self.assertEqual(formatters.format_ip(value), str(ip))
+        for value in (0, 1, 0x10000, 0x0a000001, 0xffffffff, 0x100000000,
+                      netaddr.IPAddress("::ffff:10.0.0.1").value):
+            self.assertEqual(formatters.format_ip(value, 6),
+                             str(netaddr.IPAddress(value, 6)))
+
+    def test_format_ip_keeps_small_ipv6(self):
+        self.assertEqual(formatters.format_ip(1, 6), "::1")
+
+    def test_format_ip_readable(self):
+        self.assertEqual(formatters.format_ip("192.168.1.100", 4),
+                         "192.168.1.100")
+        self.assertEqual(formatters.format_ip("192.168.1.100", 6),
+                         "::ffff:192.168.1.100")
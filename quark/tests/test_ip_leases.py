@@ -0,0 +1,105 @@
+# Copyright 2013 Openstack Foundation
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+#  under the License.
+
+import contextlib
+import datetime
+
+import mock
+import netaddr
+from neutron.openstack.common.db import exception as db_exception
+
+from quark import ip_leases
+from quark.tests import test_base
+
+
+class TestLeasePool(test_base.TestBase):
+    def setUp(self):
+        super(TestLeasePool, self).setUp()
+        self.pool = ip_leases.LeasePool()
+        self.pool._release_registered = True
+        self.now = datetime.datetime(2013, 10, 1)
+        self.subnet = dict(id=1, network_id=2, ip_version=4)
+        self.candidates = [netaddr.IPAddress("10.0.0.%d" % i)
+                           for i in xrange(2, 5)]
+
+    @contextlib.contextmanager
+    def _stubs(self, taken=None, reserve_side_effect=None):
+        db_mod = "quark.db.api"
+        with contextlib.nested(
+            mock.patch("neutron.db.api.get_session"),
+            mock.patch("neutron.openstack.common.timeutils.utcnow"),
+            mock.patch("%s.ip_address_reservation_delete_all" % db_mod),
+            mock.patch("%s.ip_address_find_taken" % db_mod),
+            mock.patch("%s.ip_address_reservation_create" % db_mod)
+        ) as (get_session, utcnow, delete_all, find_taken, reserve):
+            get_session.return_value.begin.return_value.__exit__.\
+                return_value = False
+            utcnow.return_value = self.now
+            find_taken.return_value = taken or set()
+            reserve.side_effect = reserve_side_effect
+            yield utcnow, delete_all, reserve
+
+    def test_take_empty(self):
+        self.assertIsNone(self.pool.take(1))
+
+    def test_take_skips_expired(self):
+        with self._stubs() as (utcnow, delete_all, reserve):
+            expired = self.now - datetime.timedelta(seconds=1)
+            valid = self.now + datetime.timedelta(seconds=1)
+            self.pool.add(1, ["10.0.0.2"], expired)
+            self.pool.add(1, ["10.0.0.3"], valid)
+            self.assertEqual(self.pool.take(1), "10.0.0.3")
+            self.assertIsNone(self.pool.take(1))
+
+    def test_take_from_network(self):
+        with self._stubs() as (utcnow, delete_all, reserve):
+            self.pool.refill(self.context, self.subnet, self.candidates)
+            self.assertIsNone(self.pool.take_from_network(3))
+            self.assertIsNone(self.pool.take_from_network(2, 6))
+            subnet, address = self.pool.take_from_network(2, 4)
+            self.assertEqual(subnet,
+                             dict(id=1, network_id=2, ip_version=4))
+            self.assertEqual(str(address), "10.0.0.2")
+
+    def test_refill_reserves_free_candidates(self):
+        with self._stubs(taken=set(["10.0.0.3"])) as (utcnow, delete_all,
+                                                      reserve):
+            added = self.pool.refill(self.context, self.subnet,
+                                     self.candidates)
+            self.assertEqual(added, 2)
+            delete_all.assert_called_once_with(mock.ANY, expired_at=self.now)
+            self.assertEqual([c[1]["address"] for c in reserve.call_args_list],
+                             ["10.0.0.2", "10.0.0.4"])
+            self.assertEqual(reserve.call_args[1]["owner"],
+                             ip_leases.get_owner())
+            self.assertEqual(str(self.pool.take(1)), "10.0.0.2")
+            self.assertEqual(str(self.pool.take(1)), "10.0.0.4")
+
+    def test_refill_race_adds_nothing(self):
+        duplicate = db_exception.DBDuplicateEntry()
+        with self._stubs(reserve_side_effect=duplicate):
+            added = self.pool.refill(self.context, self.subnet,
+                                     self.candidates)
+            self.assertEqual(added, 0)
+            self.assertIsNone(self.pool.take(1))
+
+    def test_release(self):
+        with self._stubs() as (utcnow, delete_all, reserve):
+            self.pool.add(1, ["10.0.0.2"],
+                          self.now + datetime.timedelta(seconds=1))
+            self.pool.release()
+            self.assertIsNone(self.pool.take(1))
+            delete_all.assert_called_once_with(mock.ANY,
+                                               owner=ip_leases.get_owner())
@@ -15,14 +15,18 @@
 
 import contextlib
 import mock
+import netaddr
 
 from neutron.common import exceptions
 from neutron.db import api as neutron_db_api
+from neutron.openstack.common.db import exception as db_exception
 from neutron.openstack.common.db.sqlalchemy import session as neutron_session
 from neutron.openstack.common.notifier import api as notifier_api
 from oslo.config import cfg
 
+from quark.db import api as db_api
 from quark.db import models
+from quark import ip_leases
 
 import quark.ipam
 
@@ -49,6 +53,7 @@ class QuarkIpamBaseTest(test_base.TestBase):
                 pass
 
         self.context.session.begin = FakeContext
+        self.context.session.begin_nested = FakeContext
         self.context.session.add = mock.Mock()
 
     def tearDown(self):
@@ -149,6 +154,26 @@ class QuarkNewMacAddressAllocation(QuarkIpamBaseTest):
             with self.assertRaises(exceptions.MacAddressGenerationFailure):
                 self.ipam.allocate_mac_address(self.context, 0, 0, 0)
 
+    def test_allocate_mac_wraps_to_first_address(self):
+        mar = dict(id=1, first_address=0, last_address=4,
+                   next_auto_assign_mac=4)
+        with self._stubs(ranges=[(mar, 3)], addresses=[None, None]):
+            address = self.ipam.allocate_mac_address(self.context, 0, 0, 0)
+            self.assertEqual(address["address"], 0)
+            self.assertEqual(mar["next_auto_assign_mac"], 1)
+
+    def test_allocate_mac_skips_range_after_full_pass(self):
+        mar1 = dict(id=1, first_address=0, last_address=2,
+                    next_auto_assign_mac=0)
+        mar2 = dict(id=2, first_address=2, last_address=255,
+                    next_auto_assign_mac=2)
+        ranges = [(mar1, 0), (mar2, 0)]
+        with self._stubs(ranges=ranges,
+                         addresses=[None, True, True, None]):
+            address = self.ipam.allocate_mac_address(self.context, 0, 0, 0)
+            self.assertEqual(address["mac_address_range_id"], 2)
+            self.assertEqual(address["address"], 2)
+
     def test_allocate_mac_two_open_ranges_chooses_first(self):
         mar1 = dict(id=1, first_address=0, last_address=255,
                     next_auto_assign_mac=0)
@@ -228,7 +253,9 @@ class QuarkIpamTestBothIpAllocation(QuarkIpamBaseTest):
             mock.patch("%s.subnet_find_allocation_counts" % db_mod)
         ) as (addr_find, subnet_find):
             addr_find.side_effect = addresses
-            subnet_find.side_effect = subnets
+            # NOTE(quark): both versions are counted by a single query
+            subnet_find.return_value = [subnet for per_version in subnets
+                                        for subnet in per_version]
             yield
 
     def test_allocate_new_ip_address_two_empty_subnets(self):
@@ -238,13 +265,14 @@ class QuarkIpamTestBothIpAllocation(QuarkIpamBaseTest):
                        ip_policy=None)
         subnet6 = dict(id=1, first_ip=self.v6_fip, last_ip=self.v6_lip,
                        cidr="feed::/104", ip_version=6,
-                       next_auto_assign_ip=0, network=dict(ip_policy=None),
+                       next_auto_assign_ip=self.v6_fip,
+                       network=dict(ip_policy=None),
                        ip_policy=None)
         with self._stubs(subnets=[[(subnet4, 0)], [(subnet6, 0)]],
                          addresses=[None, None, None, None]):
             address = self.ipam.allocate_ip_address(self.context, 0, 0, 0)
             self.assertEqual(address[0]["address"], 2)
-            self.assertEqual(address[1]["address"], 0)
+            self.assertEqual(address[1]["address"], self.v6_fip + 2)
 
     def test_allocate_new_ip_address_one_v4_subnet_open(self):
         subnet4 = dict(id=1, first_ip=0, last_ip=255,
@@ -260,7 +288,8 @@ class QuarkIpamTestBothIpAllocation(QuarkIpamBaseTest):
     def test_allocate_new_ip_address_one_v6_subnet_open(self):
         subnet6 = dict(id=1, first_ip=self.v6_fip, last_ip=self.v6_lip,
                        cidr="feed::/104", ip_version=6,
-                       next_auto_assign_ip=0, network=dict(ip_policy=None),
+                       next_auto_assign_ip=self.v6_fip,
+                       network=dict(ip_policy=None),
                        ip_policy=None)
         with self._stubs(subnets=[[], [(subnet6, 0)]],
                          addresses=[None, None, None, None]):
@@ -277,7 +306,8 @@ class QuarkIpamTestBothIpAllocation(QuarkIpamBaseTest):
     def test_reallocate_deallocated_v4_ip(self):
         subnet6 = dict(id=1, first_ip=self.v6_fip, last_ip=self.v6_lip,
                        cidr="feed::/104", ip_version=6,
-                       next_auto_assign_ip=0, network=dict(ip_policy=None),
+                       next_auto_assign_ip=self.v6_fip,
+                       network=dict(ip_policy=None),
                        ip_policy=None)
         address = models.IPAddress()
         address["address"] = 4
@@ -289,7 +319,7 @@ class QuarkIpamTestBothIpAllocation(QuarkIpamBaseTest):
             self.assertEqual(len(address), 2)
             self.assertEqual(address[0]["address"], 4)
             self.assertEqual(address[0]["version"], 4)
-            self.assertEqual(address[1]["address"], 0)
+            self.assertEqual(address[1]["address"], self.v6_fip + 2)
             self.assertEqual(address[1]["version"], 6)
 
     def test_reallocate_deallocated_v4_ip_no_avail_subnets(self):
@@ -377,7 +407,9 @@ class QuarkIpamTestBothRequiredIpAllocation(QuarkIpamBaseTest):
             mock.patch("%s.subnet_find_allocation_counts" % db_mod)
         ) as (addr_find, subnet_find):
             addr_find.side_effect = addresses
-            subnet_find.side_effect = subnets
+            # NOTE(quark): both versions are counted by a single query
+            subnet_find.return_value = [subnet for per_version in subnets
+                                        for subnet in per_version]
             yield
 
     def test_allocate_new_ip_address_two_empty_subnets(self):
@@ -387,13 +419,14 @@ class QuarkIpamTestBothRequiredIpAllocation(QuarkIpamBaseTest):
                        ip_policy=None)
         subnet6 = dict(id=1, first_ip=self.v6_fip, last_ip=self.v6_lip,
                        cidr="feed::/104", ip_version=6,
-                       next_auto_assign_ip=0, network=dict(ip_policy=None),
+                       next_auto_assign_ip=self.v6_fip,
+                       network=dict(ip_policy=None),
                        ip_policy=None)
         with self._stubs(subnets=[[(subnet4, 0)], [(subnet6, 0)]],
                          addresses=[None, None, None, None]):
             address = self.ipam.allocate_ip_address(self.context, 0, 0, 0)
             self.assertEqual(address[0]["address"], 2)
-            self.assertEqual(address[1]["address"], 0)
+            self.assertEqual(address[1]["address"], self.v6_fip + 2)
 
     def test_allocate_new_ip_address_one_v4_subnet_open(self):
         subnet4 = dict(id=1, first_ip=0, last_ip=255,
@@ -408,7 +441,8 @@ class QuarkIpamTestBothRequiredIpAllocation(QuarkIpamBaseTest):
     def test_allocate_new_ip_address_one_v6_subnet_open(self):
         subnet6 = dict(id=1, first_ip=self.v6_fip, last_ip=self.v6_lip,
                        cidr="feed::/104", ip_version=6,
-                       next_auto_assign_ip=0, network=dict(ip_policy=None),
+                       next_auto_assign_ip=self.v6_fip,
+                       network=dict(ip_policy=None),
                        ip_policy=None)
         with self._stubs(subnets=[[], [(subnet6, 0)]],
                          addresses=[None, None, None, None]):
@@ -424,7 +458,8 @@ class QuarkIpamTestBothRequiredIpAllocation(QuarkIpamBaseTest):
     def test_reallocate_deallocated_v4_ip(self):
         subnet6 = dict(id=1, first_ip=self.v6_fip, last_ip=self.v6_lip,
                        cidr="feed::/104", ip_version=6,
-                       next_auto_assign_ip=0, network=dict(ip_policy=None),
+                       next_auto_assign_ip=self.v6_fip,
+                       network=dict(ip_policy=None),
                        ip_policy=None)
         address = models.IPAddress()
         address["address"] = 4
@@ -436,7 +471,7 @@ class QuarkIpamTestBothRequiredIpAllocation(QuarkIpamBaseTest):
             self.assertEqual(len(address), 2)
             self.assertEqual(address[0]["address"], 4)
             self.assertEqual(address[0]["version"], 4)
-            self.assertEqual(address[1]["address"], 0)
+            self.assertEqual(address[1]["address"], self.v6_fip + 2)
             self.assertEqual(address[1]["version"], 6)
 
     def test_reallocate_deallocated_v6_ip(self):
@@ -520,20 +555,169 @@ class QuarkIpamBothRequired(QuarkIpamBaseTest):
         self.assertTrue(self.ipam.is_strategy_satisfied([self.v4, self.v6]))
 
 
+class QuarkIpamTestBothDerivedIpAllocation(QuarkIpamBaseTest):
+    def setUp(self):
+        super(QuarkIpamTestBothDerivedIpAllocation, self).setUp()
+        self.ipam = quark.ipam.QuarkIpamBOTHDERIVED()
+        self.mac = netaddr.EUI("AA:BB:CC:DD:EE:FF").value
+        self.eui64 = netaddr.IPAddress("feed::a8bb:ccff:fedd:eeff").value
+
+    def _subnet(self, cidr):
+        ipnet = netaddr.IPNetwork(cidr)
+        return dict(id=1, first_ip=ipnet.first, last_ip=ipnet.last,
+                    cidr=cidr, ip_version=6, next_auto_assign_ip=ipnet.first,
+                    network=dict(ip_policy=None), ip_policy=None)
+
+    @contextlib.contextmanager
+    def _stubs(self, subnet, taken=None):
+        taken = taken or []
+        db_mod = "quark.db.api"
+        ip_address_create = db_api.ip_address_create
+
+        def _create(context, **address_dict):
+            if int(address_dict["address"]) in taken:
+                raise db_exception.DBDuplicateEntry()
+            return ip_address_create(context, **address_dict)
+
+        with contextlib.nested(
+            mock.patch("%s.ip_address_find" % db_mod),
+            mock.patch("%s.ip_address_create" % db_mod),
+            mock.patch("%s.subnet_find_allocation_counts" % db_mod)
+        ) as (addr_find, addr_create, subnet_find):
+            addr_find.return_value = None
+            addr_create.side_effect = _create
+            subnet_find.return_value = [(subnet, 0)]
+            yield addr_create
+
+    def test_eui64_interface_id(self):
+        self.assertEqual(quark.ipam.eui64_interface_id(self.mac),
+                         netaddr.IPAddress("::a8bb:ccff:fedd:eeff").value)
+
+    def test_allocate_derives_eui64_address(self):
+        subnet = self._subnet("feed::/64")
+        with self._stubs(subnet) as addr_create:
+            address = self.ipam.allocate_ip_address(
+                self.context, 0, 0, 0, mac_address=self.mac)
+            self.assertEqual(address[0]["address"], self.eui64)
+            self.assertEqual(addr_create.call_count, 1)
+            self.assertEqual(subnet["next_auto_assign_ip"],
+                             subnet["first_ip"])
+
+    def test_allocate_hashes_when_prefix_too_long_for_eui64(self):
+        subnet = self._subnet("feed::/104")
+        with self._stubs(subnet) as addr_create:
+            address = self.ipam.allocate_ip_address(
+                self.context, 0, 0, 0, mac_address=self.mac)
+            self.assertIn(netaddr.IPAddress(address[0]["address"]),
+                          netaddr.IPNetwork(subnet["cidr"]))
+            self.assertEqual(addr_create.call_count, 1)
+            self.assertEqual(subnet["next_auto_assign_ip"],
+                             subnet["first_ip"])
+
+    def test_allocate_hashes_when_eui64_taken(self):
+        subnet = self._subnet("feed::/64")
+        with self._stubs(subnet, taken=[self.eui64]) as addr_create:
+            address = self.ipam.allocate_ip_address(
+                self.context, 0, 0, 0, mac_address=self.mac)
+            self.assertNotEqual(address[0]["address"], self.eui64)
+            self.assertEqual(addr_create.call_count, 2)
+            self.assertEqual(subnet["next_auto_assign_ip"],
+                             subnet["first_ip"])
+
+    def test_allocate_walks_cursor_when_derived_taken(self):
+        subnet = self._subnet("feed::/64")
+        cfg.CONF.set_override("ipam_v6_hash_attempts", 0, "QUARK")
+        try:
+            with self._stubs(subnet, taken=[self.eui64]) as addr_create:
+                address = self.ipam.allocate_ip_address(
+                    self.context, 0, 0, 0, mac_address=self.mac)
+                # NOTE(quark): the default policy excludes the first two
+                self.assertEqual(address[0]["address"],
+                                 subnet["first_ip"] + 2)
+                self.assertEqual(addr_create.call_count, 2)
+        finally:
+            cfg.CONF.clear_override("ipam_v6_hash_attempts", "QUARK")
+
+
+class QuarkSubnetSelection(QuarkIpamBaseTest):
+    def setUp(self):
+        super(QuarkSubnetSelection, self).setUp()
+        self.full = dict(id=1, first_ip=0, last_ip=255,
+                         cidr="0.0.0.0/24", ip_version=4,
+                         next_auto_assign_ip=200, ip_policy=None,
+                         network=dict(ip_policy=None))
+        self.empty = dict(id=2, first_ip=256, last_ip=511,
+                          cidr="0.0.1.0/24", ip_version=4,
+                          next_auto_assign_ip=256, ip_policy=None,
+                          network=dict(ip_policy=None))
+        self.candidates = [(self.full, 50), (self.empty, 250)]
+
+    def _policy(self, name):
+        return quark.ipam.SUBNET_SELECTION_REGISTRY.get_policy(name)
+
+    def test_fill_first(self):
+        self.assertEqual(self._policy("fill_first").choose(self.candidates),
+                         self.full)
+
+    def test_spread(self):
+        self.assertEqual(self._policy("spread").choose(self.candidates),
+                         self.empty)
+
+    def test_least_contended(self):
+        policy = self._policy("least_contended")
+        self.assertEqual(policy.choose(self.candidates), self.empty)
+        policy.allocating(self.empty["id"])
+        try:
+            self.assertEqual(policy.choose(self.candidates), self.full)
+        finally:
+            policy.allocated(self.empty["id"])
+        self.assertEqual(policy.choose(self.candidates), self.empty)
+
+    def test_weighted_random(self):
+        policy = self._policy("weighted_random")
+        with mock.patch("random.random") as rand:
+            rand.return_value = 0.1
+            self.assertEqual(policy.choose(self.candidates), self.full)
+            rand.return_value = 0.9
+            self.assertEqual(policy.choose(self.candidates), self.empty)
+
+    def test_unknown_policy_falls_back_to_fill_first(self):
+        self.assertEqual(self._policy("BUSTED").get_name(), "fill_first")
+
+    def test_select_subnet_uses_network_policy(self):
+        for subnet in (self.full, self.empty):
+            subnet["network"]["subnet_selection"] = "spread"
+        with mock.patch("quark.db.api.subnet_find_allocation_counts") as \
+                subnet_find:
+            subnet_find.return_value = [(self.full, 200), (self.empty, 0)]
+            subnet = self.ipam.select_subnet(self.context, 0, None)
+            self.assertEqual(subnet, self.empty)
+
+
 class QuarkNewIPAddressAllocation(QuarkIpamBaseTest):
     @contextlib.contextmanager
-    def _stubs(self, addresses=None, subnets=None):
+    def _stubs(self, addresses=None, subnets=None, taken=None):
         if not addresses:
             addresses = [None]
+        taken = taken or []
         db_mod = "quark.db.api"
         self.context.session.add = mock.Mock()
+        ip_address_create = db_api.ip_address_create
+
+        def _create(context, **address_dict):
+            if int(address_dict["address"]) in taken:
+                raise db_exception.DBDuplicateEntry()
+            return ip_address_create(context, **address_dict)
+
         with contextlib.nested(
             mock.patch("%s.ip_address_find" % db_mod),
+            mock.patch("%s.ip_address_create" % db_mod),
             mock.patch("%s.subnet_find_allocation_counts" % db_mod)
-        ) as (addr_find, subnet_find):
+        ) as (addr_find, addr_create, subnet_find):
             addr_find.side_effect = addresses
+            addr_create.side_effect = _create
             subnet_find.return_value = subnets
-            yield
+            yield addr_create
 
     def test_allocate_new_ip_address_in_empty_range(self):
         subnet = dict(id=1, first_ip=0, last_ip=255,
@@ -546,14 +730,36 @@ class QuarkNewIPAddressAllocation(QuarkIpamBaseTest):
             self.assertEqual(address[0]["address"], 2)  # 0 => 2
 
     def test_allocate_new_ip_in_partially_allocated_range(self):
-        addr = dict(id=1, address=3)
         subnet = dict(id=1, first_ip=0, last_ip=255,
                       cidr="0.0.0.0/24", ip_version=4,
                       next_auto_assign_ip=2, network=dict(ip_policy=None),
                       ip_policy=None)
-        with self._stubs(subnets=[(subnet, 0)], addresses=[None, addr, None]):
+        with self._stubs(subnets=[(subnet, 0)], addresses=[None],
+                         taken=[2]) as addr_create:
             address = self.ipam.allocate_ip_address(self.context, 0, 0, 0)
             self.assertEqual(address[0]["address"], 3)
+            self.assertEqual(addr_create.call_count, 2)
+            self.assertEqual(subnet["next_auto_assign_ip"], 4)
+
+    def test_allocate_new_ip_exhausted_range_fails(self):
+        subnet = dict(id=1, first_ip=0, last_ip=4,
+                      cidr="0.0.0.0/24", ip_version=4,
+                      next_auto_assign_ip=2, network=dict(ip_policy=None),
+                      ip_policy=None)
+        with self._stubs(subnets=[(subnet, 0)], addresses=[None],
+                         taken=[2, 3, 4]):
+            with self.assertRaises(exceptions.IpAddressGenerationFailure):
+                self.ipam.allocate_ip_address(self.context, 0, 0, 0)
+
+    def test_allocate_new_ip_wraps_to_first_ip(self):
+        subnet = dict(id=1, first_ip=0, last_ip=255,
+                      cidr="0.0.0.0/24", ip_version=4,
+                      next_auto_assign_ip=256, network=dict(ip_policy=None),
+                      ip_policy=None)
+        with self._stubs(subnets=[(subnet, 0)], addresses=[None]):
+            address = self.ipam.allocate_ip_address(self.context, 0, 0, 0)
+            self.assertEqual(address[0]["address"], 2)
+            self.assertEqual(subnet["next_auto_assign_ip"], 3)
 
     def test_allocate_ip_one_full_one_open_subnet(self):
         subnet1 = dict(id=1, first_ip=0, last_ip=0,
@@ -616,7 +822,7 @@ class QuarkNewIPAddressAllocation(QuarkIpamBaseTest):
                        network=dict(ip_policy=None),
                        ip_policy=None)
         subnets = [(subnet1, 1)]
-        with self._stubs(subnets=subnets, addresses=[None, True]):
+        with self._stubs(subnets=subnets, addresses=[None], taken=[240]):
             with self.assertRaises(exceptions.IpAddressGenerationFailure):
                 self.ipam.allocate_ip_address(
                     self.context, 0, 0, 0, ip_address="0.0.0.240")
@@ -631,6 +837,492 @@ class QuarkNewIPAddressAllocation(QuarkIpamBaseTest):
                     self.context, 0, 0, 0, ip_address="0.0.0.240")
 
 
+class QuarkOptimisticIPAddressAllocation(QuarkIpamBaseTest):
+    def setUp(self):
+        super(QuarkOptimisticIPAddressAllocation, self).setUp()
+        cfg.CONF.set_override("ipam_allocation_mode", "optimistic", "QUARK")
+        cfg.CONF.set_override("ipam_cursor_block_size", 4, "QUARK")
+
+    def tearDown(self):
+        super(QuarkOptimisticIPAddressAllocation, self).tearDown()
+        cfg.CONF.clear_override("ipam_allocation_mode", "QUARK")
+        cfg.CONF.clear_override("ipam_cursor_block_size", "QUARK")
+
+    def _subnet(self, next_auto_assign_ip=0):
+        return dict(id=1, first_ip=0, last_ip=255, network_id=1,
+                    cidr="0.0.0.0/24", ip_version=4,
+                    next_auto_assign_ip=next_auto_assign_ip,
+                    network=dict(ip_policy=None), ip_policy=None)
+
+    @contextlib.contextmanager
+    def _claim_stubs(self, cursors, swapped):
+        db_mod = "quark.db.api"
+        with contextlib.nested(
+            mock.patch("neutron.db.api.get_session"),
+            mock.patch("%s.subnet_find_next_auto_assign_ip" % db_mod),
+            mock.patch("%s.subnet_update_next_auto_assign_ip" % db_mod)
+        ) as (get_session, cursor_find, cursor_update):
+            get_session.return_value.begin.return_value.__exit__.\
+                return_value = False
+            cursor_find.side_effect = cursors
+            cursor_update.side_effect = swapped
+            yield cursor_update
+
+    @contextlib.contextmanager
+    def _insert_stubs(self, created):
+        db_mod = "quark.db.api"
+        begin_nested = mock.MagicMock()
+        begin_nested.return_value.__exit__.return_value = False
+        self.context.session.begin_nested = begin_nested
+        with contextlib.nested(
+            mock.patch("%s.ip_address_create" % db_mod),
+            mock.patch("quark.ipam.QuarkIpam._claim_ip_block")
+        ) as (addr_create, claim):
+            addr_create.side_effect = created
+            yield addr_create, claim
+
+    def test_claim_advances_cursor_by_block(self):
+        with self._claim_stubs([8], [True]) as cursor_update:
+            block = self.ipam._claim_ip_block(self.context, self._subnet())
+        self.assertEqual(block, (8, 12))
+        cursor_update.assert_called_once_with(mock.ANY, 1, 8, 12)
+
+    def test_claim_wraps_to_first_ip(self):
+        with self._claim_stubs([256], [True]) as cursor_update:
+            block = self.ipam._claim_ip_block(self.context, self._subnet())
+        self.assertEqual(block, (0, 4))
+        cursor_update.assert_called_once_with(mock.ANY, 1, 256, 4)
+
+    def test_claim_stops_at_last_ip(self):
+        with self._claim_stubs([254], [True]):
+            block = self.ipam._claim_ip_block(self.context, self._subnet())
+        self.assertEqual(block, (254, 256))
+
+    def test_claim_retries_when_cursor_moved(self):
+        with self._claim_stubs([0, 4], [False, True]) as cursor_update:
+            block = self.ipam._claim_ip_block(self.context, self._subnet())
+        self.assertEqual(block, (4, 8))
+        self.assertEqual(cursor_update.call_count, 2)
+
+    def test_claim_gives_up(self):
+        cfg.CONF.set_override("ipam_cursor_claim_retries", 2, "QUARK")
+        try:
+            with self._claim_stubs([0, 4], [False, False]):
+                with self.assertRaises(
+                        exceptions.IpAddressGenerationFailure):
+                    self.ipam._claim_ip_block(self.context, self._subnet())
+        finally:
+            cfg.CONF.clear_override("ipam_cursor_claim_retries", "QUARK")
+
+    def test_insert_skips_taken_addresses(self):
+        address = models.IPAddress()
+        created = [db_exception.DBDuplicateEntry(), address]
+        with self._insert_stubs(created) as (addr_create, claim):
+            claim.return_value = (4, 8)
+            res = self.ipam._insert_next_available_ip(
+                self.context, self._subnet(), 1, None)
+        self.assertEqual(res, address)
+        self.assertEqual([str(c[1]["address"])
+                          for c in addr_create.call_args_list],
+                         ["0.0.0.4", "0.0.0.5"])
+
+    def test_insert_claims_another_block(self):
+        address = models.IPAddress()
+        duplicate = db_exception.DBDuplicateEntry()
+        created = [duplicate, duplicate, address]
+        with self._insert_stubs(created) as (addr_create, claim):
+            claim.side_effect = [(4, 6), (6, 10)]
+            self.ipam._insert_next_available_ip(
+                self.context, self._subnet(), 1, None)
+        self.assertEqual(claim.call_count, 2)
+        self.assertEqual(str(addr_create.call_args[1]["address"]), "0.0.0.6")
+
+    def test_allocate_does_not_lock_subnets(self):
+        address = models.IPAddress(address=2, subnet_id=1, version=4)
+        with contextlib.nested(
+            mock.patch("quark.db.api.ip_address_find"),
+            mock.patch("quark.db.api.subnet_find_allocation_counts"),
+            mock.patch("quark.ipam.QuarkIpam._insert_next_available_ip")
+        ) as (addr_find, subnet_find, insert):
+            addr_find.return_value = None
+            subnet_find.return_value = [(self._subnet(), 0)]
+            insert.return_value = address
+            res = self.ipam.allocate_ip_address(self.context, 0, 0, 0)
+        self.assertEqual(res, [address])
+        self.assertFalse(subnet_find.call_args[1]["lock_mode"])
+
+
+class QuarkAdvisoryAllocation(QuarkIpamBaseTest):
+    def setUp(self):
+        super(QuarkAdvisoryAllocation, self).setUp()
+        cfg.CONF.set_override("ipam_allocation_mode", "advisory", "QUARK")
+        cfg.CONF.set_override("ipam_cursor_block_size", 4, "QUARK")
+
+    def tearDown(self):
+        super(QuarkAdvisoryAllocation, self).tearDown()
+        cfg.CONF.clear_override("ipam_allocation_mode", "QUARK")
+        cfg.CONF.clear_override("ipam_cursor_block_size", "QUARK")
+
+    @contextlib.contextmanager
+    def _stubs(self):
+        db_mod = "quark.db.api"
+        with contextlib.nested(
+            mock.patch("neutron.db.api.get_session"),
+            mock.patch("quark.db.locks.get_lock_manager"),
+            mock.patch("%s.subnet_find_next_auto_assign_ip" % db_mod),
+            mock.patch("%s.subnet_update_next_auto_assign_ip" % db_mod),
+            mock.patch("%s.mac_address_range_find_next_auto_assign_mac" %
+                       db_mod),
+            mock.patch("%s.mac_address_range_update_next_auto_assign_mac" %
+                       db_mod)
+        ) as (get_session, get_manager, ip_find, ip_update, mac_find,
+              mac_update):
+            get_manager.return_value.begin.return_value.__exit__.\
+                return_value = False
+            yield dict(manager=get_manager.return_value, ip_find=ip_find,
+                       ip_update=ip_update, mac_find=mac_find,
+                       mac_update=mac_update)
+
+    def test_claim_ip_block_under_subnet_lock(self):
+        subnet = dict(id=1, first_ip=0, last_ip=255, network_id=1)
+        with self._stubs() as stubs:
+            stubs["ip_find"].return_value = 8
+            stubs["ip_update"].return_value = True
+            block = self.ipam._claim_ip_block(self.context, subnet)
+        self.assertEqual(block, (8, 12))
+        stubs["manager"].begin.assert_called_once_with(mock.ANY,
+                                                       "quark_subnet_1")
+
+    def test_claim_mac_address_under_range_lock(self):
+        rng = dict(id=2, first_address=0, last_address=255)
+        with self._stubs() as stubs:
+            stubs["mac_find"].side_effect = [5, 6]
+            stubs["mac_update"].side_effect = [False, True]
+            mac = self.ipam._claim_mac_address(self.context, rng, 1)
+        self.assertEqual(mac, 6)
+        stubs["mac_update"].assert_called_with(mock.ANY, 2, 6, 7)
+        stubs["manager"].begin.assert_called_with(mock.ANY,
+                                                  "quark_mac_range_2")
+
+    def test_claim_mac_address_wraps_at_last_address(self):
+        rng = dict(id=2, first_address=16, last_address=32)
+        with self._stubs() as stubs:
+            stubs["mac_find"].return_value = 32
+            stubs["mac_update"].return_value = True
+            mac = self.ipam._claim_mac_address(self.context, rng, 1)
+        self.assertEqual(mac, 16)
+        stubs["mac_update"].assert_called_once_with(mock.ANY, 2, 32, 17)
+
+    def test_allocate_mac_address_does_not_lock_ranges(self):
+        mac_range = dict(id=1, first_address=0, last_address=255,
+                         next_auto_assign_mac=0)
+        db_mod = "quark.db.api"
+        with contextlib.nested(
+            mock.patch("%s.mac_address_find" % db_mod),
+            mock.patch("%s.mac_address_range_find_allocation_counts" % db_mod),
+            mock.patch("quark.ipam.QuarkIpam._claim_mac_address")
+        ) as (mac_find, range_counts, claim):
+            mac_find.return_value = None
+            range_counts.return_value = [(mac_range, 0)]
+            claim.return_value = 3
+            address = self.ipam.allocate_mac_address(self.context, 0, 0, 0)
+        self.assertEqual(address["address"], 3)
+        self.assertFalse(range_counts.call_args[1]["lock_mode"])
+        self.assertEqual(mac_range["next_auto_assign_mac"], 0)
+
+    def test_allocate_does_not_lock_subnets(self):
+        subnet = dict(id=1, first_ip=0, last_ip=255, network_id=1,
+                      cidr="0.0.0.0/24", ip_version=4, next_auto_assign_ip=0,
+                      network=dict(ip_policy=None), ip_policy=None)
+        address = models.IPAddress(address=2, subnet_id=1, version=4)
+        with contextlib.nested(
+            mock.patch("quark.db.api.ip_address_find"),
+            mock.patch("quark.db.api.subnet_find_allocation_counts"),
+            mock.patch("quark.ipam.QuarkIpam._insert_next_available_ip")
+        ) as (addr_find, subnet_find, insert):
+            addr_find.return_value = None
+            subnet_find.return_value = [(subnet, 0)]
+            insert.return_value = address
+            res = self.ipam.allocate_ip_address(self.context, 0, 0, 0)
+        self.assertEqual(res, [address])
+        self.assertFalse(subnet_find.call_args[1]["lock_mode"])
+
+
+class QuarkBatchIPAddressAllocation(QuarkIpamBaseTest):
+    def setUp(self):
+        super(QuarkBatchIPAddressAllocation, self).setUp()
+        self.subnet4 = dict(id=1, first_ip=0, last_ip=255,
+                            cidr="0.0.0.0/24", ip_version=4,
+                            next_auto_assign_ip=0,
+                            network=dict(ip_policy=None), ip_policy=None)
+        self.subnet6 = dict(id=2, first_ip=0, last_ip=2 ** 24 - 1,
+                            cidr="feed::/104", ip_version=6,
+                            next_auto_assign_ip=0,
+                            network=dict(ip_policy=None), ip_policy=None)
+
+    @contextlib.contextmanager
+    def _stubs(self, reusable=None, reallocatable=None):
+        db_mod = "quark.db.api"
+        with contextlib.nested(
+            mock.patch("%s.ip_address_find_reusable" % db_mod),
+            mock.patch("%s.ip_address_find_next_reusable" % db_mod),
+            mock.patch("%s.ip_address_update" % db_mod),
+            mock.patch("%s.subnet_find_allocation_counts" % db_mod),
+            mock.patch("quark.ipam.log_ip_event"),
+            mock.patch("quark.notifications.record")
+        ) as (reusable_find, next_reusable, addr_update, subnet_find,
+              log_event, record):
+            reusable_find.return_value = reusable or []
+            next_reusable.side_effect = (lambda *args, **kwargs:
+                                         (reallocatable or [None]).pop(0))
+            addr_update.side_effect = lambda context, address, **kw: address
+            subnet_find.return_value = [(self.subnet4, 0),
+                                        (self.subnet6, 0)]
+            yield dict(reusable_find=reusable_find,
+                       next_reusable=next_reusable, addr_update=addr_update,
+                       subnet_find=subnet_find, log_event=log_event,
+                       record=record)
+
+    def test_allocate_fixed_addresses_with_one_count(self):
+        requests = [dict(subnet_id=1, ip_address="0.0.0.5"),
+                    dict(ip_address="feed::7")]
+        with self._stubs() as stubs:
+            addresses = self.ipam.allocate_ip_addresses(
+                self.context, 0, 0, 0, requests)
+        self.assertEqual([a["address_readable"] for a in addresses],
+                         ["0.0.0.5", "feed::7"])
+        self.assertEqual(stubs["subnet_find"].call_count, 1)
+        self.assertFalse(stubs["subnet_find"].call_args[1]["lock_mode"])
+        stubs["reusable_find"].assert_called_once_with(
+            mock.ANY, 0, 0, ["0.0.0.5", "feed::7"])
+        self.assertEqual(stubs["record"].call_count, 2)
+
+    def test_allocate_reuses_deallocated_fixed_address(self):
+        address = models.IPAddress(address_readable="0.0.0.5", subnet_id=1)
+        requests = [dict(subnet_id=1, ip_address="0.0.0.5")]
+        with self._stubs(reusable=[address]) as stubs:
+            addresses = self.ipam.allocate_ip_addresses(
+                self.context, 0, 0, 0, requests)
+        self.assertEqual(addresses, [address])
+        self.assertFalse(stubs["addr_update"].call_args[1]["deallocated"])
+
+    def test_allocate_by_version_and_subnet(self):
+        requests = [dict(version=6), dict(subnet_id=1), dict(subnet_id=1)]
+        with self._stubs() as stubs:
+            addresses = self.ipam.allocate_ip_addresses(
+                self.context, 0, 0, 0, requests)
+        self.assertEqual([a["subnet_id"] for a in addresses], [2, 1, 1])
+        self.assertEqual([a["address_readable"] for a in addresses[1:]],
+                         ["0.0.0.2", "0.0.0.3"])
+        self.assertFalse(stubs["reusable_find"].called)
+        self.assertTrue(stubs["subnet_find"].call_args[1]["lock_mode"])
+
+    def test_allocate_reuses_deallocated_for_auto_requests(self):
+        address = models.IPAddress(address_readable="feed::9", subnet_id=2,
+                                   version=6)
+        requests = [dict(subnet_id=1, ip_address="0.0.0.5"),
+                    dict(version=6), dict(version=6)]
+        with self._stubs(reallocatable=[address, None]) as stubs:
+            addresses = self.ipam.allocate_ip_addresses(
+                self.context, 0, 0, 0, requests)
+        self.assertEqual([a["address_readable"] for a in addresses[:2]],
+                         ["0.0.0.5", "feed::9"])
+        self.assertEqual(addresses[2]["subnet_id"], 2)
+        stubs["next_reusable"].assert_called_with(
+            mock.ANY, [2], 0, exclude=["0.0.0.5"])
+        self.assertEqual(stubs["next_reusable"].call_count, 2)
+
+    def test_both_required_checks_reused_addresses(self):
+        self.ipam = quark.ipam.QuarkIpamBOTHREQ()
+        address = models.IPAddress(address_readable="0.0.0.9", subnet_id=1,
+                                   version=4)
+        requests = [dict(), dict(subnet_id=1)]
+        with self._stubs(reallocatable=[address, None]) as stubs:
+            with self.assertRaises(exceptions.IpAddressGenerationFailure):
+                self.ipam.allocate_ip_addresses(self.context, 0, 0, 0,
+                                                requests)
+        self.assertFalse(stubs["log_event"].called)
+
+    def test_allocate_fixed_address_outside_subnet_fails(self):
+        requests = [dict(subnet_id=2, ip_address="0.0.0.5")]
+        with self._stubs():
+            with self.assertRaises(exceptions.BadRequest):
+                self.ipam.allocate_ip_addresses(self.context, 0, 0, 0,
+                                                requests)
+
+    def test_allocate_fixed_address_outside_network_fails(self):
+        requests = [dict(ip_address="10.0.0.5")]
+        with self._stubs():
+            with self.assertRaises(exceptions.IpAddressGenerationFailure):
+                self.ipam.allocate_ip_addresses(self.context, 0, 0, 0,
+                                                requests)
+
+    def test_both_required_needs_both_versions(self):
+        self.ipam = quark.ipam.QuarkIpamBOTHREQ()
+        requests = [dict(subnet_id=1, ip_address="0.0.0.5")]
+        with self._stubs() as stubs:
+            with self.assertRaises(exceptions.IpAddressGenerationFailure):
+                self.ipam.allocate_ip_addresses(self.context, 0, 0, 0,
+                                                requests)
+        self.assertFalse(stubs["log_event"].called)
+
+    def test_both_required_with_both_versions(self):
+        self.ipam = quark.ipam.QuarkIpamBOTHREQ()
+        requests = [dict(subnet_id=1, ip_address="0.0.0.5"),
+                    dict(subnet_id=2, ip_address="feed::7")]
+        with self._stubs():
+            addresses = self.ipam.allocate_ip_addresses(
+                self.context, 0, 0, 0, requests)
+        self.assertEqual([a["version"] for a in addresses], [4, 6])
+
+    def test_select_subnets_counts_once(self):
+        with self._stubs() as stubs:
+            subnets = self.ipam.select_subnets(self.context, 0, None, [6, 4])
+        self.assertEqual(subnets, [self.subnet6, self.subnet4])
+        self.assertEqual(stubs["subnet_find"].call_count, 1)
+
+
+class QuarkLeasedIPAddressAllocation(QuarkIpamBaseTest):
+    def setUp(self):
+        super(QuarkLeasedIPAddressAllocation, self).setUp()
+        cfg.CONF.set_override("ipam_lease_size", 4, "QUARK")
+        self.subnet = dict(id=1, first_ip=0, last_ip=255, network_id=1,
+                           cidr="0.0.0.0/24", ip_version=4,
+                           next_auto_assign_ip=0,
+                           network=dict(ip_policy=None), ip_policy=None)
+
+    def tearDown(self):
+        super(QuarkLeasedIPAddressAllocation, self).tearDown()
+        cfg.CONF.clear_override("ipam_lease_size", "QUARK")
+
+    @contextlib.contextmanager
+    def _stubs(self, leases, created=None, reserved=None):
+        with contextlib.nested(
+            mock.patch("quark.ip_leases.LEASES"),
+            mock.patch("quark.ipam.QuarkIpam._claim_ip_block"),
+            mock.patch("quark.ipam.QuarkIpam._try_create_ip"),
+            mock.patch("quark.db.api.ip_address_reservation_delete")
+        ) as (lease_pool, claim, try_create, reservation_delete):
+            lease_pool.take.side_effect = leases
+            claim.return_value = (0, 4)
+            try_create.side_effect = created
+            if reserved is None:
+                reservation_delete.return_value = 1
+            else:
+                reservation_delete.side_effect = reserved
+            yield lease_pool, claim, try_create, reservation_delete
+
+    def test_allocate_from_lease(self):
+        address = models.IPAddress()
+        with self._stubs(["0.0.0.5"], [address]) as (lease_pool, claim,
+                                                     try_create, _):
+            res = self.ipam._allocate_from_leases(self.context, self.subnet,
+                                                  1, None)
+            self.assertEqual(res, address)
+            self.assertFalse(claim.called)
+            try_create.assert_called_once_with(self.context, self.subnet, 1,
+                                               "0.0.0.5")
+
+    def test_allocate_refills_empty_pool(self):
+        address = models.IPAddress()
+        with self._stubs([None, "0.0.0.2"], [address]) as (lease_pool, claim,
+                                                           try_create, _):
+            policy = netaddr.IPSet(["0.0.0.0/31"])
+            res = self.ipam._allocate_from_leases(self.context, self.subnet,
+                                                  1, policy)
+            self.assertEqual(res, address)
+            claim.assert_called_once_with(self.context, self.subnet,
+                                          block_size=4)
+            candidates = lease_pool.refill.call_args[0][2]
+            self.assertEqual([str(ip) for ip in candidates],
+                             ["0.0.0.2", "0.0.0.3"])
+
+    def test_allocate_skips_taken_lease(self):
+        address = models.IPAddress()
+        with self._stubs(["0.0.0.2", "0.0.0.3"],
+                         [None, address]) as (lease_pool, claim, try_create,
+                                              _):
+            res = self.ipam._allocate_from_leases(self.context, self.subnet,
+                                                  1, None)
+            self.assertEqual(res, address)
+            self.assertEqual(try_create.call_count, 2)
+
+    def test_allocate_gives_up_after_one_refill(self):
+        with self._stubs([None, None]) as (lease_pool, claim, try_create,
+                                           _):
+            res = self.ipam._allocate_from_leases(self.context, self.subnet,
+                                                  1, None)
+            self.assertIsNone(res)
+            self.assertEqual(claim.call_count, 1)
+
+    def test_allocate_drops_reservation_of_used_lease(self):
+        address = models.IPAddress()
+        with self._stubs(["0.0.0.5"], [address]) as (lease_pool, claim,
+                                                     try_create, delete):
+            self.ipam._allocate_from_leases(self.context, self.subnet, 1,
+                                            None)
+            delete.assert_called_once_with(self.context, 1, "0.0.0.5",
+                                           ip_leases.get_owner())
+
+    def test_allocate_skips_lease_without_reservation(self):
+        address = models.IPAddress()
+        with self._stubs(["0.0.0.2", "0.0.0.3"], [address],
+                         [0, 1]) as (lease_pool, claim, try_create, _):
+            res = self.ipam._allocate_from_leases(self.context, self.subnet,
+                                                  1, None)
+            self.assertEqual(res, address)
+            try_create.assert_called_once_with(self.context, self.subnet, 1,
+                                               "0.0.0.3")
+
+    @contextlib.contextmanager
+    def _network_stubs(self, leases, created):
+        db_mod = "quark.db.api"
+        with contextlib.nested(
+            mock.patch("quark.ip_leases.LEASES"),
+            mock.patch("quark.ipam.QuarkIpam._try_create_ip"),
+            mock.patch("%s.ip_address_reservation_delete" % db_mod),
+            mock.patch("%s.subnet_find_allocation_counts" % db_mod),
+            mock.patch("%s.ip_address_find" % db_mod),
+            mock.patch("quark.ipam.log_ip_event"),
+            mock.patch("quark.ipam.QuarkIpam._notify_allocated")
+        ) as (lease_pool, try_create, reservation_delete, subnet_counts,
+              addr_find, log_event, notify):
+            self.context.session.begin_nested = mock.MagicMock()
+            lease_pool.take_from_network.side_effect = leases
+            try_create.side_effect = created
+            reservation_delete.return_value = 1
+            yield (lease_pool, subnet_counts, addr_find,
+                   self.context.session.begin_nested.return_value)
+
+    def test_allocate_from_network_lease_skips_subnet_count(self):
+        address = models.IPAddress()
+        lease = (dict(id=1, network_id=1, ip_version=4), "0.0.0.5")
+        with self._network_stubs([lease], [address]) as (
+                lease_pool, subnet_counts, addr_find, savepoint):
+            res = self.ipam.allocate_ip_address(self.context, 1, 0, 0,
+                                                version=4)
+            self.assertEqual(res, [address])
+            self.assertEqual(address["deallocated"], 0)
+            lease_pool.take_from_network.assert_called_once_with(1, 4)
+            self.assertFalse(subnet_counts.called)
+            self.assertFalse(addr_find.called)
+            self.assertTrue(savepoint.commit.called)
+
+    def test_allocate_both_needs_lease_of_each_version(self):
+        self.ipam = quark.ipam.QuarkIpamBOTH()
+        address = models.IPAddress()
+        lease = (dict(id=1, network_id=1, ip_version=4), "0.0.0.5")
+        with self._network_stubs([lease, None], [address]) as (
+                lease_pool, subnet_counts, addr_find, savepoint):
+            res = self.ipam._allocate_from_network_leases(
+                self.context, 1, self.ipam._lease_versions(None))
+            self.assertEqual(res, [])
+            self.assertEqual(lease_pool.take_from_network.call_args_list,
+                             [mock.call(1, 4), mock.call(1, 6)])
+            self.assertTrue(savepoint.rollback.called)
+            self.assertFalse(savepoint.commit.called)
+
+
 class QuarkIPAddressAllocateDeallocated(QuarkIpamBaseTest):
     @contextlib.contextmanager
     def _stubs(self, ip_find, subnet, address, addresses_found,
@@ -819,7 +1511,61 @@ class TestQuarkIpPoliciesIpAllocation(QuarkIpamBaseTest):
             self.assertEqual(address[0]["address"], 240)
 
 
+class QuarkIPAddressEvents(QuarkIpamBaseTest):
+    @contextlib.contextmanager
+    def _stubs(self, address, subnets=None):
+        address = models.IPAddress(**address)
+        db_mod = "quark.db.api"
+        with contextlib.nested(
+            mock.patch("%s.ip_address_find" % db_mod),
+            mock.patch("%s.ip_address_create" % db_mod),
+            mock.patch("%s.subnet_find_allocation_counts" % db_mod),
+            mock.patch("%s.ip_address_event_create" % db_mod)
+        ) as (addr_find, addr_create, subnet_find, event_create):
+            addr_find.return_value = None
+            addr_create.return_value = address
+            subnet_find.return_value = subnets
+            yield event_create
+
+    def test_allocation_logs_event(self):
+        subnet = dict(id=1, first_ip=0, last_ip=255,
+                      cidr="0.0.0.0/24", ip_version=4,
+                      next_auto_assign_ip=0, network=dict(ip_policy=None),
+                      ip_policy=None)
+        address = dict(id=1, address=0, subnet_id=1, network_id=2,
+                       address_readable="0.0.0.0")
+        with self._stubs(address, subnets=[(subnet, 1)]) as event_create:
+            self.ipam.allocate_ip_address(self.context, 2, 3, 0, version=4,
+                                          device_id="foo")
+            event_create.assert_called_once_with(
+                self.context, event="allocate", address_readable="0.0.0.0",
+                ip_address_id=1, subnet_id=1, network_id=2,
+                tenant_id=self.context.tenant_id, port_id=3, device_id="foo")
+
+    def test_deallocation_logs_event(self):
+        address = dict(id=1, subnet_id=1, network_id=2, ports=[],
+                       address_readable="0.0.0.0", used_by_tenant_id=1,
+                       created_at=None)
+        port = dict(id=3, tenant_id="owner", device_id="foo",
+                    ip_addresses=[address])
+        address["ports"].append(port)
+        with self._stubs(dict()) as event_create:
+            self.ipam.deallocate_ip_address(self.context, port)
+            event_create.assert_called_once_with(
+                self.context, event="deallocate",
+                address_readable="0.0.0.0", ip_address_id=1, subnet_id=1,
+                network_id=2, tenant_id="owner", port_id=3, device_id="foo")
+
+
 class QuarkIPAddressAllocationNotifications(QuarkIpamBaseTest):
+    def setUp(self):
+        super(QuarkIPAddressAllocationNotifications, self).setUp()
+        cfg.CONF.set_override("notification_async", False, "QUARK")
+
+    def tearDown(self):
+        super(QuarkIPAddressAllocationNotifications, self).tearDown()
+        cfg.CONF.clear_override("notification_async", "QUARK")
+
     @contextlib.contextmanager
     def _stubs(self, address, addresses=None, subnets=None, deleted_at=None):
 
@@ -885,3 +1631,27 @@ class QuarkIPAddressAllocationNotifications(QuarkIpamBaseTest):
                      created_at=address["created_at"],
                      deleted_at="456",
                      used_by_tenant_id=1))
+
+
+class QuarkIpamRegistry(test_base.TestBase):
+    def test_strategies_built_on_first_use(self):
+        registry = quark.ipam.IpamRegistry()
+        self.assertEqual(registry.strategies, {})
+        self.assertTrue(registry.is_valid_strategy("ANY"))
+        strategy = registry.get_strategy("ANY")
+        self.assertIsInstance(strategy, quark.ipam.QuarkIpamANY)
+        self.assertIs(registry.get_strategy("ANY"), strategy)
+        self.assertEqual(registry.strategies.keys(), ["ANY"])
+
+    def test_unknown_strategy_falls_back(self):
+        registry = quark.ipam.IpamRegistry()
+        self.assertFalse(registry.is_valid_strategy("foo"))
+        self.assertIsInstance(registry.get_strategy("foo"),
+                              registry.strategy_classes[
+                                  cfg.CONF.QUARK.default_ipam_strategy])
+
+    def test_get_ipam_driver_builds_once(self):
+        with mock.patch("quark.ipam._IPAM_DRIVER", None):
+            driver = quark.ipam.get_ipam_driver()
+            self.assertIsInstance(driver, quark.ipam.QuarkIpam)
+            self.assertIs(quark.ipam.get_ipam_driver(), driver)
@@ -0,0 +1,173 @@
+# Copyright 2013 Openstack Foundation
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+#  under the License.
+
+import contextlib
+import Queue
+
+import mock
+from oslo.config import cfg
+
+from quark import notifications
+from quark.tests import test_base
+
+
+class FakeTransaction(object):
+    def __init__(self, parent=None, nested=False):
+        self._parent = parent
+        self.nested = nested
+
+
+class FakeSession(object):
+    transaction = None
+
+
+class FakeContext(object):
+    def __init__(self):
+        self.session = FakeSession()
+
+
+class TestNotificationBuffer(test_base.TestBase):
+    def setUp(self):
+        super(TestNotificationBuffer, self).setUp()
+        cfg.CONF.set_override("notification_async", False, "QUARK")
+        self.context = FakeContext()
+        self.session = self.context.session
+
+    def tearDown(self):
+        cfg.CONF.clear_override("notification_async", "QUARK")
+        notifications._PENDING.clear()
+
+    @contextlib.contextmanager
+    def _stubs(self):
+        with contextlib.nested(
+            mock.patch("quark.notifications._listen"),
+            mock.patch("neutron.openstack.common.notifier.api.notify")
+        ) as (listen, notify):
+            yield listen, notify
+
+    def _sent(self, notify):
+        return [call[0][2] for call in notify.call_args_list]
+
+    def test_record_outside_transaction_sends(self):
+        with self._stubs() as (listen, notify):
+            notifications.record(self.context, "create", dict(a=1))
+            self.assertEqual(self._sent(notify), ["create"])
+            self.assertEqual(notify.call_args[0][4], dict(a=1))
+            self.assertFalse(listen.called)
+
+    def test_record_waits_for_commit(self):
+        root = FakeTransaction()
+        self.session.transaction = root
+        with self._stubs() as (listen, notify):
+            notifications.record(self.context, "create", {})
+            self.session.transaction = FakeTransaction(parent=root)
+            notifications.record(self.context, "delete", {})
+            self.assertEqual(self._sent(notify), [])
+            listen.assert_called_once_with(self.session)
+
+            self.session.transaction = root
+            notifications._after_commit(self.session)
+            self.assertEqual(self._sent(notify), ["create", "delete"])
+
+    def test_savepoint_release_does_not_send(self):
+        root = FakeTransaction()
+        savepoint = FakeTransaction(parent=root, nested=True)
+        self.session.transaction = savepoint
+        with self._stubs() as (listen, notify):
+            notifications.record(self.context, "create", {})
+            notifications._after_commit(self.session)
+            self.assertEqual(self._sent(notify), [])
+
+            self.session.transaction = root
+            notifications._after_commit(self.session)
+            self.assertEqual(self._sent(notify), ["create"])
+
+    def test_rollback_discards(self):
+        root = FakeTransaction()
+        self.session.transaction = root
+        with self._stubs() as (listen, notify):
+            notifications.record(self.context, "create", {})
+            notifications._after_soft_rollback(self.session, root)
+            notifications._after_commit(self.session)
+            self.assertEqual(self._sent(notify), [])
+
+    def test_savepoint_rollback_discards_only_its_own(self):
+        root = FakeTransaction()
+        savepoint = FakeTransaction(parent=root, nested=True)
+        with self._stubs() as (listen, notify):
+            self.session.transaction = root
+            notifications.record(self.context, "kept", {})
+            self.session.transaction = FakeTransaction(parent=savepoint)
+            notifications.record(self.context, "discarded", {})
+            notifications._after_soft_rollback(self.session, savepoint)
+
+            self.session.transaction = root
+            notifications._after_commit(self.session)
+            self.assertEqual(self._sent(notify), ["kept"])
+
+    def test_subtransaction_rollback_is_ignored(self):
+        root = FakeTransaction()
+        sub = FakeTransaction(parent=root)
+        self.session.transaction = sub
+        with self._stubs() as (listen, notify):
+            notifications.record(self.context, "create", {})
+            notifications._after_soft_rollback(self.session, sub)
+            self.session.transaction = root
+            notifications._after_commit(self.session)
+            self.assertEqual(self._sent(notify), ["create"])
+
+
+class TestNotificationSender(test_base.TestBase):
+    def setUp(self):
+        super(TestNotificationSender, self).setUp()
+        self.sender = notifications.NotificationSender.__new__(
+            notifications.NotificationSender)
+        self.sender.queue = Queue.Queue(2)
+        self.stats = dict(notifications.STATS)
+
+    def _delta(self, stat):
+        return notifications.STATS[stat] - self.stats[stat]
+
+    def _notification(self, name):
+        return notifications.Notification(None, name, {})
+
+    def test_put_drops_when_full(self):
+        cfg.CONF.set_override("notification_enqueue_timeout", 0, "QUARK")
+        try:
+            for name in ("a", "b", "c"):
+                self.sender.put(self._notification(name))
+        finally:
+            cfg.CONF.clear_override("notification_enqueue_timeout", "QUARK")
+        self.assertEqual(self._delta("queued"), 2)
+        self.assertEqual(self._delta("blocked"), 1)
+        self.assertEqual(self._delta("dropped"), 1)
+
+    def test_batch_is_bounded(self):
+        cfg.CONF.set_override("notification_batch_size", 1, "QUARK")
+        try:
+            self.sender.put(self._notification("a"))
+            self.sender.put(self._notification("b"))
+            batch = self.sender._batch()
+        finally:
+            cfg.CONF.clear_override("notification_batch_size", "QUARK")
+        self.assertEqual([n.event_type for n in batch], ["a"])
+        self.assertEqual(self.sender.queue.qsize(), 1)
+
+    def test_send_failure_is_counted(self):
+        with mock.patch("neutron.openstack.common.notifier.api.notify") as \
+                notify:
+            notify.side_effect = Exception
+            notifications._send(self._notification("a"))
+        self.assertEqual(self._delta("failed"), 1)
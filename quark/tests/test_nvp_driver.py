@@ -874,3 +874,10 @@ class TestNVPGetConnection(TestNVPDriver):
         with self._stubs(has_conn=True) as aiclib_conn:
             self.driver.get_connection()
             self.assertFalse(aiclib_conn.called)
+
+    def test_reset_connections(self):
+        with self._stubs(has_conn=False) as aiclib_conn:
+            self.driver.nvp_connections[0]["connection"] = "foo"
+            self.driver.reset_connections()
+            self.driver.get_connection()
+            self.assertTrue(aiclib_conn.called)
@@ -0,0 +1,182 @@
+# Copyright 2013 Openstack Foundation
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+#  under the License.
+
+import contextlib
+import datetime
+
+import mock
+from neutron.common import exceptions
+
+from quark.db import models
+from quark import quota_driver
+from quark.tests import test_base
+
+
+class TestQuarkQuotaDriver(test_base.TestBase):
+    def setUp(self):
+        super(TestQuarkQuotaDriver, self).setUp()
+        self.now = datetime.datetime(2013, 10, 1)
+        self.driver = quota_driver.QuarkQuotaDriver
+
+    def tearDown(self):
+        quota_driver.reset()
+
+    @contextlib.contextmanager
+    def _stubs(self, usage=None, limit=2, expired=None):
+        db_mod = "quark.db.api"
+        with contextlib.nested(
+            mock.patch("neutron.openstack.common.timeutils.utcnow"),
+            mock.patch("neutron.quota.QUOTAS"),
+            mock.patch("quark.quota_driver.QuarkQuotaDriver."
+                       "get_tenant_quotas"),
+            mock.patch("%s.quota_usage_find_for_update" % db_mod),
+            mock.patch("%s.quota_reservation_find_expired" % db_mod),
+            mock.patch("%s.quota_reservation_delete" % db_mod)
+        ) as (utcnow, quotas, get_quotas, usage_find, find_expired,
+              reservation_delete):
+            utcnow.return_value = self.now
+            quotas.resources = {"ports_per_network": None}
+            get_quotas.return_value = {"ports_per_network": limit}
+            usage_find.return_value = usage
+            find_expired.return_value = expired or []
+            yield usage_find, reservation_delete
+
+    def test_reserve(self):
+        usage = models.QuotaUsage(id="usage", in_use=1, reserved=0)
+        with self._stubs(usage) as (usage_find, res_delete):
+            reservation = self.driver.reserve(
+                self.context, "fake", "ports_per_network", "net")
+            self.assertEqual(usage.reservations[0]["id"], reservation)
+            self.assertEqual(usage.reservations[0]["delta"], 1)
+            self.assertEqual(usage.reservations[0]["expires_at"],
+                             self.now + datetime.timedelta(seconds=300))
+            self.assertEqual(usage["reserved"], 1)
+            usage_find.assert_called_once_with(
+                self.context, "ports_per_network", "net", "fake")
+
+    def test_reserve_drops_expired_reservations(self):
+        usage = models.QuotaUsage(id="usage", in_use=1, reserved=1)
+        expired = models.QuotaReservation(id="expired", delta=1)
+        with self._stubs(usage, expired=[expired]) as (usage_find,
+                                                       res_delete):
+            res_delete.side_effect = lambda context, reservation_id: \
+                usage.update(dict(reserved=usage["reserved"] - 1))
+            self.driver.reserve(self.context, "fake", "ports_per_network",
+                                "net")
+            res_delete.assert_called_once_with(self.context, "expired")
+            self.assertEqual(usage["reserved"], 1)
+
+    def test_reserve_over_quota_counts_reserved(self):
+        usage = models.QuotaUsage(in_use=1, reserved=1)
+        with self._stubs(usage):
+            with self.assertRaises(exceptions.OverQuota):
+                self.driver.reserve(self.context, "fake",
+                                    "ports_per_network", "net")
+            self.assertEqual(usage["reserved"], 1)
+
+    def test_reserve_unlimited(self):
+        usage = models.QuotaUsage(in_use=10, reserved=0)
+        with self._stubs(usage, limit=-1):
+            self.assertIsNotNone(self.driver.reserve(
+                self.context, "fake", "ports_per_network", "net"))
+
+    def test_reserve_untracked_resource(self):
+        with self._stubs() as (usage_find, res_delete):
+            self.assertIsNone(self.driver.reserve(self.context, "fake",
+                                                  "floatingip", "net"))
+            self.assertFalse(usage_find.called)
+
+    def test_commit_and_rollback_release_reservation(self):
+        with self._stubs() as (usage_find, res_delete):
+            self.driver.commit(self.context, "reservation")
+            self.driver.rollback(self.context, "other")
+            self.driver.commit(self.context, None)
+            self.assertEqual(res_delete.call_args_list,
+                             [mock.call(self.context, "reservation"),
+                              mock.call(self.context, "other")])
+
+    def test_reserving_reserves_before_transaction(self):
+        self.context.session.begin = mock.MagicMock()
+        self.context.session.begin.return_value.__exit__.return_value = False
+        with contextlib.nested(
+            mock.patch("quark.quota_driver.QuarkQuotaDriver.reserve"),
+            mock.patch("quark.quota_driver.QuarkQuotaDriver.rollback")
+        ) as (reserve, rollback):
+            reserve.side_effect = lambda *args: \
+                self.assertFalse(self.context.session.begin.called) or "net"
+            with quota_driver.reserving(
+                    self.context, ("network", "fake", 1),
+                    ("subnet", "fake", 2)) as reservations:
+                self.assertEqual(reservations, ["net", "net"])
+                self.assertTrue(self.context.session.begin.called)
+            self.assertEqual(reserve.call_args_list,
+                             [mock.call(self.context, "fake", "network",
+                                        "fake", 1),
+                              mock.call(self.context, "fake", "subnet",
+                                        "fake", 2)])
+            self.assertFalse(rollback.called)
+
+    def test_reserving_rolls_back_earlier_reservations(self):
+        with contextlib.nested(
+            mock.patch("quark.quota_driver.QuarkQuotaDriver.reserve"),
+            mock.patch("quark.quota_driver.QuarkQuotaDriver.rollback")
+        ) as (reserve, rollback):
+            reserve.side_effect = ["net", exceptions.OverQuota(overs=[])]
+            with self.assertRaises(exceptions.OverQuota):
+                with quota_driver.reserving(self.context,
+                                            ("network", "fake", 1),
+                                            ("subnet", "fake", 1)):
+                    pass
+            rollback.assert_called_once_with(self.context, "net")
+
+    def test_reserving_rolls_back_when_transaction_fails(self):
+        with mock.patch("quark.quota_driver.QuarkQuotaDriver."
+                        "rollback") as rollback:
+            with self.assertRaises(ValueError):
+                with quota_driver.reserving(self.context) as reservations:
+                    reservations.extend(["net", None])
+                    raise ValueError()
+            self.assertEqual(rollback.call_args_list,
+                             [mock.call(self.context, "net"),
+                              mock.call(self.context, None)])
+
+    def test_reserving_keeps_committed_reservations(self):
+        with mock.patch("quark.quota_driver.QuarkQuotaDriver."
+                        "rollback") as rollback:
+            with quota_driver.reserving(self.context) as reservations:
+                reservations.append("net")
+            self.assertFalse(rollback.called)
+
+    def test_resync(self):
+        db_mod = "quark.db.api"
+        self.context.session.begin = mock.MagicMock()
+        self.context.session.begin.return_value.__exit__.return_value = False
+        with contextlib.nested(
+            mock.patch("neutron.openstack.common.timeutils.utcnow"),
+            mock.patch("%s.quota_reservation_find_expired" % db_mod),
+            mock.patch("%s.quota_reservation_delete" % db_mod),
+            mock.patch("%s.quota_usage_refresh" % db_mod)
+        ) as (utcnow, find_expired, res_delete, refresh):
+            utcnow.return_value = self.now
+            find_expired.return_value = [dict(id="expired")]
+            self.assertEqual(self.driver.resync(self.context), 1)
+            find_expired.assert_called_once_with(self.context, self.now)
+            res_delete.assert_called_once_with(self.context, "expired")
+            self.assertEqual(sorted(c[0][1] for c in refresh.call_args_list),
+                             ["network", "ports_per_network",
+                              "security_rules_per_group", "subnet"])
+
+    def test_start_disabled(self):
+        self.assertIsNone(quota_driver.start())
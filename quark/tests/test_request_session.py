@@ -0,0 +1,100 @@
+# Copyright 2013 Openstack Foundation
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+#  under the License.
+
+import mock
+from neutron import context
+from neutron import wsgi
+import webob.dec
+import webob.exc
+
+from quark.api import request_session
+import quark.plugin
+from quark.tests import test_base
+
+
+class TestRequestSession(test_base.TestBase):
+    def setUp(self):
+        super(TestRequestSession, self).setUp()
+        self.session = mock.MagicMock()
+        self.context._session = self.session
+        self.seen = []
+
+    def _request(self, application):
+        middleware = request_session.RequestSession(application)
+        req = wsgi.Request.blank("/ports")
+        req.environ["neutron.context"] = self.context
+        return req.get_response(middleware)
+
+    def test_session_shared_then_closed(self):
+        @webob.dec.wsgify
+        def application(req):
+            ctx = req.environ["neutron.context"]
+            self.seen.append(request_session.is_request_scoped(ctx))
+            self.seen.append(ctx._session)
+            return "ok"
+
+        res = self._request(application)
+        self.assertEqual(res.status_int, 200)
+        self.assertEqual(self.seen, [True, self.session])
+        self.session.close.assert_called_once_with()
+        self.assertIsNone(self.context._session)
+        self.assertFalse(request_session.is_request_scoped(self.context))
+
+    def test_session_closed_on_error(self):
+        @webob.dec.wsgify
+        def application(req):
+            raise webob.exc.HTTPInternalServerError()
+
+        res = self._request(application)
+        self.assertEqual(res.status_int, 500)
+        self.session.close.assert_called_once_with()
+        self.assertIsNone(self.context._session)
+
+    def test_no_context_passes_through(self):
+        @webob.dec.wsgify
+        def application(req):
+            return "ok"
+
+        middleware = request_session.RequestSession(application)
+        res = wsgi.Request.blank("/").get_response(middleware)
+        self.assertEqual(res.status_int, 200)
+
+
+class TestSessioned(test_base.TestBase):
+    def setUp(self):
+        super(TestSessioned, self).setUp()
+        self.session = mock.MagicMock()
+        self.context = context.Context("fake", "fake")
+        self.context._session = self.session
+
+        @quark.plugin.sessioned
+        def plugin_call(plugin, context):
+            return context.session
+
+        self.plugin_call = plugin_call
+
+    def test_sessioned_closes_session(self):
+        with mock.patch("quark.db.replica.record_write"):
+            self.assertEqual(self.plugin_call(None, self.context),
+                             self.session)
+        self.session.close.assert_called_once_with()
+        self.assertIsNone(self.context._session)
+
+    def test_sessioned_keeps_request_scoped_session(self):
+        setattr(self.context, request_session.REQUEST_SCOPED, True)
+        with mock.patch("quark.db.replica.record_write"):
+            self.plugin_call(None, self.context)
+        self.assertFalse(self.session.close.called)
+        self.assertEqual(self.context._session, self.session)
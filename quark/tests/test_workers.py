@@ -0,0 +1,104 @@
+# Copyright 2013 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import contextlib
+
+import mock
+
+from quark.tests import test_base
+from quark import workers
+
+
+class TestWorkers(test_base.TestBase):
+    @contextlib.contextmanager
+    def _stubs(self):
+        with contextlib.nested(
+            mock.patch("quark.workers._reset_pools"),
+            mock.patch("quark.workers._warm_engines"),
+            mock.patch("quark.drivers.registry.DRIVER_REGISTRY"),
+            mock.patch("quark.cache.reset"),
+            mock.patch("quark.ip_leases.LEASES"),
+            mock.patch("quark.notifications.reset"),
+            mock.patch("quark.archiver.reset"),
+            mock.patch("quark.archiver.start"),
+            mock.patch("quark.quota_driver.reset"),
+            mock.patch("quark.quota_driver.start"),
+            mock.patch("quark.workers._PID", 1),
+            mock.patch("os.getpid")
+        ) as (reset_pools, warm, driver_registry, cache_reset, leases,
+              notifications_reset, archiver_reset, archiver_start,
+              quota_reset, quota_start, pid, getpid):
+            getpid.return_value = 1
+            yield dict(reset_pools=reset_pools, warm=warm,
+                       driver_registry=driver_registry,
+                       cache_reset=cache_reset, leases=leases,
+                       notifications_reset=notifications_reset,
+                       archiver_reset=archiver_reset,
+                       archiver_start=archiver_start,
+                       quota_reset=quota_reset, quota_start=quota_start,
+                       getpid=getpid)
+
+    def test_post_fork_resets_and_rewarms(self):
+        with self._stubs() as stubs:
+            workers.post_fork()
+            self.assertTrue(stubs["reset_pools"].called)
+            stubs["driver_registry"].reset_connections.\
+                assert_called_once_with()
+            self.assertTrue(stubs["cache_reset"].called)
+            stubs["leases"].clear.assert_called_once_with()
+            self.assertTrue(stubs["notifications_reset"].called)
+            self.assertTrue(stubs["archiver_reset"].called)
+            self.assertTrue(stubs["quota_reset"].called)
+            self.assertTrue(stubs["warm"].called)
+            self.assertTrue(stubs["archiver_start"].called)
+            self.assertTrue(stubs["quota_start"].called)
+
+    def test_check_fork_same_process(self):
+        with self._stubs() as stubs:
+            workers.check_fork()
+            self.assertFalse(stubs["reset_pools"].called)
+
+    def test_check_fork_after_fork_runs_once(self):
+        with self._stubs() as stubs:
+            stubs["getpid"].return_value = 2
+            workers.check_fork()
+            workers.check_fork()
+            self.assertEqual(stubs["reset_pools"].call_count, 1)
+            self.assertEqual(workers._PID, 2)
+
+
+class TestResetPools(test_base.TestBase):
+    def test_recreates_pools_without_closing_connections(self):
+        engine = mock.Mock()
+        old_pool = engine.pool
+        with contextlib.nested(
+            mock.patch.object(workers.neutron_session, "_ENGINE", engine),
+            mock.patch("quark.db.replica._ENGINE", None)
+        ):
+            workers._reset_pools()
+        self.assertEqual(engine.pool, old_pool.recreate.return_value)
+        self.assertFalse(old_pool.dispose.called)
+        self.assertFalse(engine.dispose.called)
+
+    def test_recreates_replica_pool(self):
+        engine = mock.Mock()
+        old_pool = engine.pool
+        with contextlib.nested(
+            mock.patch.object(workers.neutron_session, "_ENGINE", None),
+            mock.patch("quark.db.replica._ENGINE", engine)
+        ):
+            workers._reset_pools()
+        self.assertEqual(engine.pool, old_pool.recreate.return_value)
+        self.assertFalse(engine.dispose.called)
@@ -25,3 +25,13 @@ def pop_param(attrs, param, default=None):
     if attr_specified(val):
         return val
     return default
+
+
+def detached_context(context):
+    """Returns an elevated copy of context with a session of its own.
+
+    Work done through it commits independently of the caller's transaction.
+    """
+    detached = context.elevated()
+    detached._session = None
+    return detached
@@ -0,0 +1,94 @@
+# Copyright 2013 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Per worker process state
+
+The database pools, NVP connections, response cache backend, IP leases and
+background threads are module singletons of whichever process loaded the
+plugin. API workers forked from it would share its sockets with each other
+and lose its threads, so post_fork() swaps them for the worker's own.
+Plugin calls run check_fork(), which covers servers that fork without
+calling the hook.
+"""
+
+import os
+import threading
+
+from neutron.openstack.common.db.sqlalchemy import session as neutron_session
+from neutron.openstack.common import log as logging
+
+from quark import archiver
+from quark import cache
+from quark.db import locks
+from quark.db import replica
+from quark.drivers import registry
+from quark import ip_leases
+from quark import notifications
+from quark import quota_driver
+
+LOG = logging.getLogger(__name__)
+
+_PID = os.getpid()
+_PID_LOCK = threading.Lock()
+
+
+def _reset_pools():
+    # NOTE(quark): dispose() would close the inherited sockets, sending
+    # COM_QUIT on connections the parent and other workers still use. New
+    # pools just drop our references to them.
+    if neutron_session._ENGINE is not None:
+        engine = neutron_session._ENGINE
+        engine.pool = engine.pool.recreate()
+    replica.reset_pool()
+
+
+def _warm_engines():
+    try:
+        if neutron_session._ENGINE is not None:
+            neutron_session._ENGINE.connect().close()
+        if replica.is_enabled():
+            replica.get_engine().connect().close()
+    except Exception:
+        LOG.exception("Failed to open database connections after fork")
+
+
+def post_fork():
+    """Gives this process its own connections and background threads."""
+    global _PID
+    _PID = os.getpid()
+    LOG.info("Resetting inherited state in worker %d" % _PID)
+
+    _reset_pools()
+    registry.DRIVER_REGISTRY.reset_connections()
+    cache.reset()
+    locks.reset()
+    ip_leases.LEASES.clear()
+    notifications.reset()
+    archiver.reset()
+    quota_driver.reset()
+
+    _warm_engines()
+    archiver.start()
+    quota_driver.start()
+
+
+def check_fork():
+    """Runs post_fork() if this process was forked since it last ran."""
+    if _PID == os.getpid():
+        return
+    with _PID_LOCK:
+        if _PID != os.getpid():
+            post_fork()